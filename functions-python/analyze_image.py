@@ -3,16 +3,20 @@ Python Cloud Function for Image Analysis using OpenRouter
 Analyzes images and returns tags, category, and description
 """
 import os
+import asyncio
 import json
 import logging
 from typing import Dict, Any, Optional
 
-import requests
 from firebase_functions import https_fn
 from firebase_functions.options import CorsOptions
 from firebase_functions.params import Secret
 from firebase_admin import initialize_app
 
+from http_transport import get_transport
+import vendored  # noqa: F401  (shared python/services)
+from services.rate_limit import get_rate_limiter
+
 # Initialize Firebase Admin
 initialize_app()
 
@@ -23,6 +27,9 @@ logger = logging.getLogger(__name__)
 # OpenRouter API configuration
 OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# Rate limited models are skipped for the next one; only the last model waits (up to this long) for a token
+OPENROUTER_RATE_LIMIT_WAIT_SECONDS = float(os.environ.get("OPENROUTER_RATE_LIMIT_WAIT_SECONDS", "30"))
+
 # Get API keys from Firebase Secrets
 openrouter_api_key = Secret("OPENROUTER_API_KEY")
 
@@ -42,8 +49,14 @@ MODELS_TO_TRY = [
 
 
 def analyze_image_with_openrouter(image_url: str, api_key: str) -> Dict[str, Any]:
+    """Sync wrapper for the on_request handler (see analyze_image_with_openrouter_async)."""
+    return get_transport().run(analyze_image_with_openrouter_async(image_url, api_key))
+
+
+async def analyze_image_with_openrouter_async(image_url: str, api_key: str) -> Dict[str, Any]:
     """
     Analyze an image using OpenRouter API with multiple model fallbacks.
+    Runs on the shared HTTP transport, so several analyses can be in flight at once (transport.gather).
     
     Args:
         image_url: Public URL of the image to analyze
@@ -84,6 +97,11 @@ Focus on identifying:
     
     for model in MODELS_TO_TRY:
         try:
+            # The limiter sleeps while waiting, so keep it off the event loop
+            await asyncio.to_thread(
+                get_rate_limiter().acquire, "openrouter", model,
+                OPENROUTER_RATE_LIMIT_WAIT_SECONDS if model == MODELS_TO_TRY[-1] else 0
+            )
             logger.info(f"[analyze_image] Attempting model: {model}")
             logger.info(f"[analyze_image] Image URL: {image_url[:100]}...")
             
@@ -101,7 +119,7 @@ Focus on identifying:
                 'response_format': {'type': 'json_object'}
             }
             
-            response = requests.post(
+            response = await get_transport().client.post(
                 OPENROUTER_CHAT_URL,
                 headers=headers,
                 json=body,
@@ -110,7 +128,7 @@ Focus on identifying:
             
             logger.info(f"[analyze_image] Response status: {response.status_code}")
             
-            if not response.ok:
+            if not response.is_success:
                 error_text = response.text
                 logger.error(f"[analyze_image] OpenRouter API error ({response.status_code}): {error_text}")
                 raise Exception(f"OpenRouter error ({response.status_code}): {error_text}")
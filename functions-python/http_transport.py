@@ -0,0 +1,85 @@
+"""
+Async HTTP transport for the provider calls (HF Inference API, OpenRouter).
+One pooled httpx.AsyncClient (HTTP/2 when the h2 package is installed) lives on a background event
+loop for the life of the instance, so a warm instance keeps connections open and can have many
+calls in flight without a thread each. The Firebase on_request handlers are synchronous: they
+call run() (one coroutine) or gather() (fan-out) and block until the result is ready.
+"""
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Iterable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncTransport:
+    """A background event loop thread owning one httpx.AsyncClient; created lazily, shared by all requests."""
+
+    def __init__(self, http2: bool = HTTP2_AVAILABLE, max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_keepalive: int = HTTP_MAX_KEEPALIVE):
+        self.http2 = http2
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled client; only use it from coroutines running on this transport (run/gather)."""
+        self._start()
+        return self._client
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the transport's loop and wait for its result (from sync code)."""
+        self._start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def gather(self, coros: Iterable[Awaitable], timeout: Optional[float] = None,
+               return_exceptions: bool = False) -> List[Any]:
+        """Run several coroutines concurrently and wait for all of them."""
+        async def _all():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return self.run(_all(), timeout)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="http-transport", daemon=True).start()
+
+            async def _make_client():
+                return httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=self._limits,
+                    timeout=httpx.Timeout(None, connect=HTTP_CONNECT_TIMEOUT),
+                )
+            self._client = asyncio.run_coroutine_threadsafe(_make_client(), loop).result()
+            self._loop = loop
+            logger.info(f"HTTP transport started (http2={self.http2}, max_connections={self._limits.max_connections})")
+
+
+_transport: Optional[AsyncTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> AsyncTransport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = AsyncTransport()
+        return _transport
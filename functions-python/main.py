@@ -3,11 +3,15 @@ Python Cloud Function for Hugging Face Image Generation using Inference API
 This uses the Hugging Face Inference API directly (no model download needed!)
 """
 import os
+import asyncio
 import json
+import time
+import uuid
 import logging
+import threading
 from typing import Optional
 
-import requests
+import httpx
 from PIL import Image
 from io import BytesIO
 from google.cloud import storage
@@ -16,6 +20,12 @@ from firebase_functions import https_fn
 from firebase_functions.options import CorsOptions
 from firebase_admin import initialize_app
 
+from http_transport import get_transport
+import vendored  # noqa: F401  (shared python/services)
+from services.models import MODEL_ID
+from services.rate_limit import RateLimited, get_rate_limiter
+from services.singleflight import SingleFlight, canonical_request_key
+
 # Initialize Firebase Admin
 initialize_app()
 
@@ -40,10 +50,13 @@ def get_firestore_client():
     return _firestore_client
 
 # Configuration
-MODEL_ID = os.environ.get("SD_MODEL_ID", "stabilityai/stable-diffusion-2-1")
 BUCKET_NAME = os.environ.get("IMAGE_BUCKET_NAME", "systemicshiftv2.firebasestorage.app")
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER", "generated_images")
+JOBS_COLLECTION = os.environ.get("IMAGE_JOBS_COLLECTION", "imageJobs")
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "5"))
 API_URL = f"https://api-inference.huggingface.co/models/{MODEL_ID}"
+# How long a request may wait for an HF API token (RATE_LIMITS) before failing with 429
+HF_RATE_LIMIT_WAIT_SECONDS = float(os.environ.get("HF_RATE_LIMIT_WAIT_SECONDS", "60"))
 
 # Get HF token from Firebase Secrets
 try:
@@ -56,14 +69,15 @@ except ImportError:
     def get_hf_token():
         return os.environ.get("HF_API_TOKEN")
 
-def generate_image_via_api(
+async def generate_image_via_api_async(
     prompt: str,
     num_inference_steps: int = 20,
     guidance_scale: float = 7.5,
     width: int = 512,
-    height: int = 512
+    height: int = 512,
+    seed: Optional[int] = None
 ) -> bytes:
-    """Generate image using Hugging Face Inference API and return as PNG bytes"""
+    """Generate image using Hugging Face Inference API and return as PNG bytes (runs on the shared HTTP transport)"""
     if not prompt:
         raise ValueError("prompt must be a non-empty string")
     
@@ -73,19 +87,26 @@ def generate_image_via_api(
     
     logger.info(f"Generating image via HF API: prompt length={len(prompt)}, steps={num_inference_steps}, size={width}x{height}")
     
+    parameters = {
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "width": width,
+        "height": height
+    }
+    if seed is not None:
+        parameters["seed"] = seed
+    
+    # Wait for a token rather than bursting into provider 429s (off the event loop: the limiter sleeps)
+    await asyncio.to_thread(get_rate_limiter().acquire, "hf_api", MODEL_ID, HF_RATE_LIMIT_WAIT_SECONDS)
+    
     try:
         # Call Hugging Face Inference API
-        response = requests.post(
+        response = await get_transport().client.post(
             API_URL,
             headers={"Authorization": f"Bearer {hf_token}"},
             json={
                 "inputs": prompt,
-                "parameters": {
-                    "num_inference_steps": num_inference_steps,
-                    "guidance_scale": guidance_scale,
-                    "width": width,
-                    "height": height
-                }
+                "parameters": parameters
             },
             timeout=300  # 5 minute timeout
         )
@@ -105,9 +126,9 @@ def generate_image_via_api(
             except json.JSONDecodeError:
                 raise RuntimeError(f"Unexpected response from HF API: {response.text[:500]}")
                 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise RuntimeError("Hugging Face API request timed out after 5 minutes")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.exception("HF API request failed")
         raise RuntimeError(f"HF API request failed: {e}")
 
@@ -121,6 +142,88 @@ def upload_to_gcs(image_bytes: bytes, filename: str) -> str:
     
     return f"https://storage.googleapis.com/{BUCKET_NAME}/{filename}"
 
+# Concurrent identical seeded requests (frontend retries, several users on one story)
+# share a single generation + upload on this instance. The shared asyncio SingleFlight lives on
+# the transport's event loop, so every request thread coalesces through the same loop.
+_singleflight = SingleFlight()
+
+async def generate_and_upload_async(prompt: str, num_inference_steps: int, guidance_scale: float,
+                                    width: int, height: int, seed: Optional[int]) -> str:
+    """Generate via HF API, upload to GCS and return the public URL"""
+    image_bytes = await generate_image_via_api_async(
+        prompt=prompt,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        width=width,
+        height=height,
+        seed=seed
+    )
+    
+    logger.info(f"Image generated: {len(image_bytes)} bytes")
+    
+    filename = f"{IMAGE_FOLDER}/{os.urandom(8).hex()}.png"
+    return await asyncio.to_thread(upload_to_gcs, image_bytes, filename)
+
+def coalesced_generate_and_upload(key: Optional[str], *args):
+    """Sync entry for the handlers: (public URL, shared) from the single-flight on the transport loop."""
+    return get_transport().run(_singleflight.do(key, lambda: generate_and_upload_async(*args)))
+
+def update_story_image(doc_id: Optional[str], public_url: str):
+    """Set the generated image URL on the story, if a docId was provided"""
+    if not doc_id:
+        return
+    try:
+        doc_ref = get_firestore_client().collection("stories").document(doc_id)
+        doc_ref.update({
+            "aiGeneratedImageUrl": public_url,
+            "analysisTimestamp": firestore.SERVER_TIMESTAMP
+        })
+        logger.info(f"Updated Firestore document: {doc_id}")
+    except Exception as e:
+        logger.error(f"Failed to update Firestore: {e}")
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_generation(job_id: str, doc_id: Optional[str], render):
+    """
+    Server-sent events for one generation: a job event with the jobId (for reconnecting via
+    getImageJobStatus), progress heartbeats while the HF API call runs, then done/failed.
+    Job state is mirrored to Firestore so clients can drop the stream and poll instead.
+    """
+    job_ref = get_firestore_client().collection(JOBS_COLLECTION).document(job_id)
+    job_ref.set({"status": "running", "docId": doc_id, "createdAt": firestore.SERVER_TIMESTAMP})
+    
+    outcome = {}
+    def _worker():
+        # Finishes the job (story + job doc) even if the client disconnects from the stream
+        try:
+            outcome["url"], outcome["shared"] = render()
+        except Exception as e:
+            logger.exception("Streamed generation failed")
+            outcome["error"] = str(e)
+            job_ref.update({"status": "failed", "error": outcome["error"], "finishedAt": firestore.SERVER_TIMESTAMP})
+            return
+        update_story_image(doc_id, outcome["url"])
+        job_ref.update({"status": "done", "image_url": outcome["url"], "finishedAt": firestore.SERVER_TIMESTAMP})
+    
+    worker = threading.Thread(target=_worker, daemon=True)
+    started = time.monotonic()
+    worker.start()
+    
+    yield _sse("job", {"jobId": job_id, "status": "running"})
+    # The HF Inference API doesn't report steps; heartbeats show the job is alive
+    while worker.is_alive():
+        worker.join(timeout=SSE_HEARTBEAT_SECONDS)
+        if worker.is_alive():
+            yield _sse("progress", {"jobId": job_id, "status": "running", "elapsedSeconds": round(time.monotonic() - started, 1)})
+    
+    if "error" in outcome:
+        yield _sse("failed", {"jobId": job_id, "status": "failed", "message": outcome["error"]})
+        return
+    
+    yield _sse("done", {"jobId": job_id, "status": "done", "image_url": outcome["url"], "coalesced": outcome["shared"]})
+
 @https_fn.on_request(
     cors=CorsOptions(
         cors_origins=["*"],
@@ -164,37 +267,31 @@ def generateImageHfPython(req: https_fn.Request) -> https_fn.Response:
         guidance = request_json.get("guidance_scale") or request_json.get("guidance") or 7.5
         width = request_json.get("width") or 512
         height = request_json.get("height") or 512
+        seed = request_json.get("seed")
+        seed = int(seed) if seed is not None else None
         
         logger.info(f"Generating image for docId: {doc_id or 'none'}")
         
-        # Generate image via HF Inference API
-        image_bytes = generate_image_via_api(
-            prompt=prompt,
-            num_inference_steps=int(num_steps),
-            guidance_scale=float(guidance),
-            width=int(width),
-            height=int(height)
+        # Generate image via HF Inference API and upload to GCS (coalesced with identical in-flight requests)
+        key = canonical_request_key(prompt, seed, int(num_steps), float(guidance), int(width), int(height), MODEL_ID)
+        render = lambda: coalesced_generate_and_upload(
+            key, prompt, int(num_steps), float(guidance), int(width), int(height), seed
         )
         
-        logger.info(f"Image generated: {len(image_bytes)} bytes")
+        # Streaming mode: server-sent events instead of one response at the end
+        if request_json.get("stream"):
+            return https_fn.Response(
+                stream_generation(uuid.uuid4().hex, doc_id, render),
+                status=200,
+                headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+            )
         
-        # Upload to GCS
-        filename = f"{IMAGE_FOLDER}/{os.urandom(8).hex()}.png"
-        public_url = upload_to_gcs(image_bytes, filename)
+        public_url, shared = render()
         
-        logger.info(f"Image uploaded to: {public_url}")
+        logger.info(f"Image uploaded to: {public_url}" + (" (shared with a concurrent identical request)" if shared else ""))
         
         # Update Firestore if docId provided
-        if doc_id:
-            try:
-                doc_ref = get_firestore_client().collection("stories").document(doc_id)
-                doc_ref.update({
-                    "aiGeneratedImageUrl": public_url,
-                    "analysisTimestamp": firestore.SERVER_TIMESTAMP
-                })
-                logger.info(f"Updated Firestore document: {doc_id}")
-            except Exception as e:
-                logger.error(f"Failed to update Firestore: {e}")
+        update_story_image(doc_id, public_url)
         
         # Return response
         return https_fn.Response(
@@ -206,6 +303,16 @@ def generateImageHfPython(req: https_fn.Request) -> https_fn.Response:
             headers={"Content-Type": "application/json"}
         )
         
+    except RateLimited as e:
+        logger.warning(f"generateImageHfPython rate limited: {e}")
+        return https_fn.Response(
+            json.dumps({
+                "status": "error",
+                "message": str(e)
+            }),
+            status=429,
+            headers={"Content-Type": "application/json", "Retry-After": str(max(1, int(e.retry_after + 0.999)))}
+        )
     except Exception as e:
         logger.exception("Error in generateImageHfPython")
         return https_fn.Response(
@@ -218,6 +325,51 @@ def generateImageHfPython(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["*"],
+        cors_methods=["GET", "OPTIONS"],
+    ),
+    timeout_sec=30,
+    memory=256,
+)
+def getImageJobStatus(req: https_fn.Request) -> https_fn.Response:
+    """
+    Status of a streamed generation job, so clients can reconnect by jobId
+    instead of holding the stream open. Deployed as: getImageJobStatus
+    """
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    job_id = req.args.get("jobId")
+    if not job_id:
+        return https_fn.Response(
+            json.dumps({"error": "jobId is required"}),
+            status=400,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    snapshot = get_firestore_client().collection(JOBS_COLLECTION).document(job_id).get()
+    if not snapshot.exists:
+        return https_fn.Response(
+            json.dumps({"error": "Unknown job"}),
+            status=404,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    job = snapshot.to_dict()
+    return https_fn.Response(
+        json.dumps({
+            "jobId": job_id,
+            "status": job.get("status"),
+            "image_url": job.get("image_url"),
+            "error": job.get("error")
+        }),
+        status=200,
+        headers={"Content-Type": "application/json"}
+    )
+
+
 # Import and export the analyze image function
 # The function is defined in analyze_image.py with @https_fn.on_request decorator
 # Firebase will automatically discover and deploy it
@@ -4,19 +4,20 @@ Follows the documentation pattern using StableDiffusionPipeline
 """
 import os
 import json
-import io
 import logging
 from typing import Optional
 
-import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
-from PIL import Image
 from google.cloud import storage
 from google.cloud import firestore
 from firebase_functions import https_fn
 from firebase_functions.options import CorsOptions
 from firebase_admin import initialize_app
 
+# Generation is done by the shared engine in python/services (vendored, see vendored.py)
+import vendored  # noqa: F401
+from services.backends import set_hf_token_provider
+from services.generate import generate_image_bytes as engine_generate_image_bytes
+
 # Initialize Firebase Admin
 initialize_app()
 
@@ -41,7 +42,6 @@ def get_firestore_client():
     return _firestore_client
 
 # Configuration
-MODEL_ID = os.environ.get("SD_MODEL_ID", "stabilityai/stable-diffusion-2-1")
 BUCKET_NAME = os.environ.get("IMAGE_BUCKET_NAME", "systemicshiftv2.firebasestorage.app")
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER", "generated_images")
 # Get HF token from Firebase Secrets
@@ -55,55 +55,7 @@ except ImportError:
     def get_hf_token():
         return os.environ.get("HF_API_TOKEN")
 
-# Global pipeline (loaded once, reused)
-_pipeline: Optional[StableDiffusionPipeline] = None
-
-def get_pipeline() -> StableDiffusionPipeline:
-    """Get or create the Stable Diffusion pipeline (singleton pattern)"""
-    global _pipeline
-    if _pipeline is not None:
-        return _pipeline
-    
-    logger.info(f"Loading Stable Diffusion pipeline: {MODEL_ID}")
-    
-    # Determine device and dtype
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    torch_dtype = torch.float16 if device == "cuda" else torch.float32
-    
-    logger.info(f"Using device: {device}, dtype: {torch_dtype}")
-    
-    try:
-        # Get token first
-        hf_token = get_hf_token()
-        if not hf_token:
-            raise ValueError("HF_API_TOKEN secret is not set or is empty")
-        
-        logger.info(f"Using HF token (length: {len(hf_token) if hf_token else 0})")
-        
-        # Load pipeline following documentation pattern
-        # Note: Both 'token' and 'use_auth_token' work, but 'token' is preferred in newer versions
-        scheduler = DPMSolverMultistepScheduler.from_pretrained(
-            MODEL_ID, 
-            subfolder="scheduler",
-            token=hf_token
-        )
-        
-        _pipeline = StableDiffusionPipeline.from_pretrained(
-            MODEL_ID,
-            scheduler=scheduler,
-            torch_dtype=torch_dtype,
-            token=hf_token  # Use 'token' parameter
-        )
-        _pipeline = _pipeline.to(device)
-        
-        # Enable attention slicing for memory efficiency (as in documentation)
-        _pipeline.enable_attention_slicing()
-        
-        logger.info("Pipeline loaded successfully")
-        return _pipeline
-    except Exception as e:
-        logger.error(f"Failed to load pipeline: {e}")
-        raise
+set_hf_token_provider(get_hf_token)
 
 def generate_image_bytes(
     prompt: str,
@@ -113,43 +65,17 @@ def generate_image_bytes(
     height: int = 512,
     seed: Optional[int] = None
 ) -> bytes:
-    """Generate image from prompt and return as PNG bytes"""
-    if not prompt:
-        raise ValueError("prompt must be a non-empty string")
-    
-    pipe = get_pipeline()
-    
-    # Create generator with seed if provided
-    generator = None
-    if seed is not None:
-        device = next(pipe.unet.parameters()).device
-        generator = torch.Generator(device=device).manual_seed(seed)
-    
-    logger.info(f"Generating image: prompt length={len(prompt)}, steps={num_inference_steps}, size={width}x{height}")
-    
-    try:
-        with torch.no_grad():
-            result = pipe(
-                prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height,
-                generator=generator
-            )
-        
-        if not hasattr(result, "images") or not result.images:
-            raise RuntimeError("Pipeline returned no images")
-        
-        image: Image.Image = result.images[0]
-        
-        # Convert to PNG bytes
-        buf = io.BytesIO()
-        image.save(buf, format="PNG")
-        return buf.getvalue()
-    except Exception as e:
-        logger.exception("Image generation failed")
-        raise RuntimeError(f"Image generation failed: {e}") from e
+    """Generate image from prompt and return as PNG bytes (via the shared engine)"""
+    logger.info(f"Generating image: prompt length={len(prompt or '')}, steps={num_inference_steps}, size={width}x{height}")
+    return engine_generate_image_bytes(
+        prompt,
+        seed=seed,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        width=width,
+        height=height,
+        preset="standard"
+    )
 
 def upload_to_gcs(image_bytes: bytes, filename: str) -> str:
     """Upload image to Google Cloud Storage and return public URL"""
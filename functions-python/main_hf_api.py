@@ -3,11 +3,12 @@ Python Cloud Function for Hugging Face Image Generation using Inference API
 This uses the Hugging Face Inference API directly (no model download needed!)
 """
 import os
+import asyncio
 import json
 import logging
 from typing import Optional
 
-import requests
+import httpx
 from PIL import Image
 from io import BytesIO
 from google.cloud import storage
@@ -16,6 +17,11 @@ from firebase_functions import https_fn
 from firebase_functions.options import CorsOptions
 from firebase_admin import initialize_app
 
+from http_transport import get_transport
+import vendored  # noqa: F401  (shared python/services)
+from services.models import MODEL_ID
+from services.rate_limit import RateLimited, get_rate_limiter
+
 # Initialize Firebase Admin
 initialize_app()
 
@@ -40,10 +46,11 @@ def get_firestore_client():
     return _firestore_client
 
 # Configuration
-MODEL_ID = os.environ.get("SD_MODEL_ID", "stabilityai/stable-diffusion-2-1")
 BUCKET_NAME = os.environ.get("IMAGE_BUCKET_NAME", "systemicshiftv2.firebasestorage.app")
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER", "generated_images")
 API_URL = f"https://api-inference.huggingface.co/models/{MODEL_ID}"
+# How long a request may wait for an HF API token (RATE_LIMITS) before failing with 429
+HF_RATE_LIMIT_WAIT_SECONDS = float(os.environ.get("HF_RATE_LIMIT_WAIT_SECONDS", "60"))
 
 # Get HF token from Firebase Secrets
 try:
@@ -56,14 +63,14 @@ except ImportError:
     def get_hf_token():
         return os.environ.get("HF_API_TOKEN")
 
-def generate_image_via_api(
+async def generate_image_via_api_async(
     prompt: str,
     num_inference_steps: int = 20,
     guidance_scale: float = 7.5,
     width: int = 512,
     height: int = 512
 ) -> bytes:
-    """Generate image using Hugging Face Inference API and return as PNG bytes"""
+    """Generate image using Hugging Face Inference API and return as PNG bytes (runs on the shared HTTP transport)"""
     if not prompt:
         raise ValueError("prompt must be a non-empty string")
     
@@ -73,19 +80,24 @@ def generate_image_via_api(
     
     logger.info(f"Generating image via HF API: prompt length={len(prompt)}, steps={num_inference_steps}, size={width}x{height}")
     
+    parameters = {
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "width": width,
+        "height": height
+    }
+    
+    # Wait for a token rather than bursting into provider 429s (off the event loop: the limiter sleeps)
+    await asyncio.to_thread(get_rate_limiter().acquire, "hf_api", MODEL_ID, HF_RATE_LIMIT_WAIT_SECONDS)
+    
     try:
         # Call Hugging Face Inference API
-        response = requests.post(
+        response = await get_transport().client.post(
             API_URL,
             headers={"Authorization": f"Bearer {hf_token}"},
             json={
                 "inputs": prompt,
-                "parameters": {
-                    "num_inference_steps": num_inference_steps,
-                    "guidance_scale": guidance_scale,
-                    "width": width,
-                    "height": height
-                }
+                "parameters": parameters
             },
             timeout=300  # 5 minute timeout
         )
@@ -105,12 +117,22 @@ def generate_image_via_api(
             except json.JSONDecodeError:
                 raise RuntimeError(f"Unexpected response from HF API: {response.text[:500]}")
                 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise RuntimeError("Hugging Face API request timed out after 5 minutes")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.exception("HF API request failed")
         raise RuntimeError(f"HF API request failed: {e}")
 
+def generate_image_via_api(
+    prompt: str,
+    num_inference_steps: int = 20,
+    guidance_scale: float = 7.5,
+    width: int = 512,
+    height: int = 512
+) -> bytes:
+    """Sync wrapper for the on_request handlers"""
+    return get_transport().run(generate_image_via_api_async(prompt, num_inference_steps, guidance_scale, width, height))
+
 def upload_to_gcs(image_bytes: bytes, filename: str) -> str:
     """Upload image to Google Cloud Storage and return public URL"""
     bucket = get_storage_client().bucket(BUCKET_NAME)
@@ -206,6 +228,16 @@ def generateImageHfPython(req: https_fn.Request) -> https_fn.Response:
             headers={"Content-Type": "application/json"}
         )
         
+    except RateLimited as e:
+        logger.warning(f"generateImageHfPython rate limited: {e}")
+        return https_fn.Response(
+            json.dumps({
+                "status": "error",
+                "message": str(e)
+            }),
+            status=429,
+            headers={"Content-Type": "application/json", "Retry-After": str(max(1, int(e.retry_after + 0.999)))}
+        )
     except Exception as e:
         logger.exception("Error in generateImageHfPython")
         return https_fn.Response(
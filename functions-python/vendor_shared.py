@@ -0,0 +1,24 @@
+"""
+Copy the shared generation engine (python/services) into functions-python/vendor/ so it is
+uploaded with the function: only functions-python/ is deployed. Runs as the python codebase's
+predeploy step in firebase.json; run it by hand before deploying from elsewhere.
+"""
+import os
+import shutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, "..", "python", "services")
+VENDOR_DIR = os.path.join(HERE, "vendor")
+
+
+def vendor_shared(source: str = SOURCE, vendor_dir: str = VENDOR_DIR) -> str:
+    """Replace vendor/services with a fresh copy of python/services; returns the copy's path."""
+    target = os.path.join(vendor_dir, "services")
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    shutil.copytree(source, target, ignore=shutil.ignore_patterns("__pycache__", "*.pyc"))
+    return target
+
+
+if __name__ == "__main__":
+    print(f"Vendored {os.path.normpath(SOURCE)} -> {vendor_shared()}")
@@ -0,0 +1,14 @@
+"""
+Puts the shared python/services package on sys.path. It's copied into vendor/ by vendor_shared.py
+(the python codebase's predeploy step) because only functions-python/ is uploaded.
+Import this before any `services.*` import.
+"""
+import os
+import sys
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendor")
+
+if not os.path.isdir(os.path.join(VENDOR_DIR, "services")):
+    raise ImportError("python/services isn't vendored: run `python vendor_shared.py` in functions-python/")
+if VENDOR_DIR not in sys.path:
+    sys.path.insert(0, VENDOR_DIR)
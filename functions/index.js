@@ -27,6 +27,19 @@ const db = admin.firestore();
 const storage = admin.storage();
 const bucket = storage.bucket("systemicshiftv2.firebasestorage.app");
 
+// Story image work queue picked up by python/local_image_generator.py (states and priorities:
+// python/services/job_queue.py). New submissions and manual triggers run first.
+const IMAGE_JOB_PRIORITY_INTERACTIVE = 100;
+function pendingImageJob(priority = IMAGE_JOB_PRIORITY_INTERACTIVE) {
+  return {
+    status: "pending",
+    priority: priority,
+    enqueuedAt: admin.firestore.FieldValue.serverTimestamp(),
+    fullQuality: false,
+    attemptCount: 0,
+  };
+}
+
 // ✅ 1. Generate Image Function - wrapped in onRequest
 const hfApiKey = defineSecret('HF_API_TOKEN');
 const generateImageHfHandler = require('./generate_image_hf').generateImageHf;
@@ -266,12 +279,17 @@ exports.analyzeStorySubmission = onDocumentCreated(
 
     try {
         console.log(`Updating Firestore document ${storyId}...`);
-        await db.collection('stories').doc(storyId).update({
+        const update = {
             aiGeneratedWriteup: aiWriteup,
             aiInfographicConcept: aiInfographicConcept,
             aiGeneratedImageUrl: aiGeneratedImageUrl,
             analysisTimestamp: admin.firestore.FieldValue.serverTimestamp()
-        });
+        };
+        if (aiGeneratedImageUrl === "Pending local generation") {
+            // Queue the story for local_image_generator.py (see python/services/job_queue.py)
+            update.imageJob = pendingImageJob();
+        }
+        await db.collection('stories').doc(storyId).update(update);
         console.log(`Successfully updated document ${storyId} with all AI analysis.`);
     } catch (error) {
         console.error(`Error updating Firestore document ${storyId}:`, error);
@@ -370,6 +388,7 @@ Return JSON with: {"title": "...", "keyMetrics": [{"label": "...", "value": "...
         await docRef.update({
           aiInfographicConcept: aiInfographicConcept,
           aiGeneratedImageUrl: "Pending local generation",
+          imageJob: pendingImageJob(),
           analysisTimestamp: admin.firestore.FieldValue.serverTimestamp(),
         });
 
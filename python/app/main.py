@@ -1,18 +1,231 @@
 # python/app/main.py (small test server)
-from fastapi import FastAPI, HTTPException, Response
-from pydantic import BaseModel
-from python.services.generate import generate_image_bytes
+import asyncio
+import io
+import os
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+import torch
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from python.services.batching import BatchScheduler
+from python.services.executor import InferenceExecutor, QueueFull
+from python.services.generate import generate_images
+from python.services.image_store import ImageStore
+from python.services.jobs import JobRegistry
+from python.services.memory import MemoryBudgetExceeded, plan_job
+from python.services.pipeline import pool, resolve_device_dtype, resolve_model
+from python.services.presets import resolve_preset
+from python.services.rate_limit import get_rate_limiter
+from python.services.safety import get_safety_stage
+from python.services.singleflight import SingleFlight, canonical_request_key
+
+@asynccontextmanager
+async def lifespan(app):
+    jobs.bind(asyncio.get_running_loop())
+    yield
+    jobs.shutdown()
+    executor.shutdown(wait=False)
+    safety.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Rendered images by sha256, served immutably from GET /images/{sha256}
+store = ImageStore()
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Largest width/height a request may ask for; sizes within it are still checked against the memory budget
+API_MAX_EDGE = int(os.environ.get("API_MAX_EDGE", "1024"))
 
 class Req(BaseModel):
     prompt: str
     seed: int | None = None
+    preset: str | None = None  # "draft" | "standard" | "final" (defaults to IMAGE_PRESET)
+    width: int = Field(512, ge=64, le=API_MAX_EDGE)
+    height: int = Field(512, ge=64, le=API_MAX_EDGE)
+    model: str | None = None  # one of IMAGE_MODELS (defaults to SD_MODEL_ID)
+
+def _store_outputs(images, results, seconds, applied):
+    """Encode and store a safety-checked batch; returns (sha256, png, applied_preset, safety_result) per image."""
+    outputs = []
+    for image, result in zip(images, results):
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        png = buf.getvalue()
+        outputs.append((store.put(png), png, applied, result))
+    return outputs
+
+def _memory_plan(width, height, batch=1):
+    """plan_job for the local pipeline's dtype, without loading it (default weight size)."""
+    _, dtype = resolve_device_dtype()
+    return plan_job(width, height, batch=batch, dtype_bytes=torch.finfo(dtype).bits // 8)
+
+def _run_batch(key, items):
+    """
+    Run one micro-batch: items are (prompt, seed, job) sharing (model, preset, width, height), so
+    the pipeline and steps/guidance/size match. Jobs (streamed requests) get step progress from the pipeline callback.
+    Only denoising runs on the inference thread: the batch is handed to the safety stage (which also
+    encodes and stores it) and each item gets (future, index) so the next batch can start right away.
+    """
+    model_id, preset, width, height = key
+    batch_jobs = [job for _, _, job in items if job is not None]
+    for job in batch_jobs:
+        jobs.mark_running(job)
+    # Each request fits alone (checked in _validate); use the batch's settings when the batch fits too
+    plan = _memory_plan(width, height, len(items)) if len(items) > 1 else None
+    if plan is None or plan.downsized:
+        plan = _memory_plan(width, height)
+
+    def on_step(pipe, step, timestep, callback_kwargs):
+        total = getattr(pipe, "num_timesteps", None) or len(pipe.scheduler.timesteps)
+        for job in batch_jobs:
+            jobs.progress(job, step + 1, total)
+        return callback_kwargs
+
+    images, applied = generate_images(
+        [prompt for prompt, _, _ in items],
+        [seed for _, seed, _ in items],
+        width=width,
+        height=height,
+        preset=preset,
+        callback_on_step_end=on_step if batch_jobs else None,
+        memory_plan=plan,
+        model_id=model_id,
+        check_safety=False,
+    )
+    outputs = safety.submit(images, then=lambda *checked: _store_outputs(*checked, applied))
+    return [(outputs, index) for index in range(len(images))]
+
+# Inference runs here, off the event loop (INFERENCE_SLOTS / INFERENCE_MAX_QUEUE);
+# concurrent compatible requests are grouped first (BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS)
+executor = InferenceExecutor()
+batcher = BatchScheduler(_run_batch, executor)
+# Identical seeded requests in flight at the same time share one render
+singleflight = SingleFlight()
+# Streamed/background jobs, reconnectable by id
+jobs = JobRegistry()
+# Safety check (SAFETY_CHECKER=off|default|light), batched, on its own thread
+safety = get_safety_stage()
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "inference": executor.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    return {"inference": executor.stats(), "batching": batcher.stats(), "singleflight": singleflight.stats(),
+            "pipelines": pool.stats(), "safety": safety.stats(), "rateLimits": get_rate_limiter().stats()}
+
+def _validate(r: Req):
+    try:
+        preset = resolve_preset(r.preset)
+        r.model = resolve_model(r.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if r.width % 8 or r.height % 8:
+        raise HTTPException(status_code=400, detail="width and height must be multiples of 8")
+    try:
+        plan = _memory_plan(r.width, r.height)
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if plan.downsized:
+        raise HTTPException(status_code=413, detail=(
+            f"{r.width}x{r.height} exceeds the memory budget ({plan.budget_mb:.0f} MB); "
+            f"the largest size that fits is {plan.width}x{plan.height}"))
+    return preset
+
+async def _render(r: Req, preset, job=None):
+    """Coalesce, batch and run one request; returns ((sha256, png, applied_preset, safety_result), shared)."""
+    key = canonical_request_key(r.prompt, r.seed, preset.steps, preset.guidance_scale,
+                                r.width, r.height, r.model, scheduler=preset.scheduler)
+
+    async def _submit():
+        outputs, index = await batcher.submit((r.model, preset.name, r.width, r.height), (r.prompt, r.seed, job))
+        return (await asyncio.wrap_future(outputs))[index]
+
+    return await singleflight.do(key, _submit)
+
+def _queue_full(e: QueueFull):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 @app.post("/generate")
 async def gen(r: Req):
+    preset = _validate(r)
     try:
-        png = generate_image_bytes(r.prompt, r.seed, num_inference_steps=20)
-        return Response(content=png, media_type="image/png")
+        (digest, png, applied, checked), shared = await _render(r, preset)
+        # The hash lets clients/CDNs fetch (and cache) this result again without touching the model
+        return Response(content=png, media_type="image/png", headers={
+            "X-Image-SHA256": digest,
+            "ETag": f'"{digest}"',
+            "Location": f"/images/{digest}",
+            "X-Image-Preset": applied.name,
+            "X-Image-Model": r.model,
+            "X-Safety-Flagged": "1" if checked.flagged else "0",
+            "X-Coalesced": "1" if shared else "0",
+        })
+    except QueueFull as e:
+        raise _queue_full(e)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+
+async def _run_job(job, r: Req, preset):
+    try:
+        (digest, _, applied, checked), shared = await _render(r, preset, job)
+        jobs.finish(job, {"imageUrl": f"/images/{digest}", "sha256": digest, "preset": applied.name,
+                           "model": r.model, "safetyFlagged": checked.flagged, "coalesced": shared})
+    except Exception as e:
+        jobs.fail(job, str(e))
+
+@app.post("/jobs", status_code=202)
+async def create_job(r: Req):
+    """Start a generation in the background; follow it via /jobs/{id}/events (SSE) or poll /jobs/{id}."""
+    preset = _validate(r)
+    if batcher.full:
+        raise _queue_full(QueueFull(executor.retry_after()))
+    job = jobs.create(r.model_dump() if hasattr(r, "model_dump") else r.dict())
+    asyncio.create_task(_run_job(job, r, preset))
+    return {"jobId": job.id, "statusUrl": f"/jobs/{job.id}", "eventsUrl": f"/jobs/{job.id}/events"}
+
+def _get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _get_job(job_id).snapshot()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: queue position while waiting, step progress, then done/failed with the image URL."""
+    _get_job(job_id)
+    return StreamingResponse(jobs.events(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/image")
+async def job_image(job_id: str):
+    job = _get_job(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return RedirectResponse(job.result["imageUrl"], status_code=307)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison: ignore W/ prefixes
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in (c[2:] if c.startswith("W/") else c for c in candidates)
+
+@app.get("/images/{digest}")
+async def get_image(digest: str, request: Request):
+    """
+    Content-addressed image: strong ETag (the hash itself), 304 on If-None-Match, immutable caching.
+    FileResponse handles Range requests and uses the server's zero-copy/sendfile path where available.
+    """
+    path = store.get_path(digest)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown image")
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/png", headers=headers)
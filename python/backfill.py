@@ -0,0 +1,169 @@
+"""
+Backfill: (re)generate images for historical stories with the same code path as the monitor
+(process_story), paging through `stories` with a locally checkpointed cursor so it can resume.
+Run from the python/ folder, e.g.:
+    python backfill.py --dry-run
+    python backfill.py --statuses failed,pending --parallel 2 --rate 6
+    python backfill.py --regenerate --since 2025-01-01        # redo finished images too
+"""
+import os
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+import local_image_generator as generator  # initializes Firebase/Firestore and the engine
+from services.job_queue import DONE, FAILED, PENDING, PRIORITY_BACKFILL, enqueue_fields
+from services.rate_limit import RateLimiter
+
+logger = logging.getLogger("backfill")
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".backfill_checkpoint.json")
+# Scheduling only needs these; the AI write-ups stay on the server
+SCAN_FIELDS = ["imageJob", "submittedAt"]
+SAMPLE_PROMPT = ("Corporate infographic for PETRONAS Upstream. Vertical layout. TEAL and GREEN colors. "
+                 "Title: Backfill Estimate. Metrics: Cost: 20% lower. Flat design, minimal icons, professional.")
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"cursor": None, "counts": {}}
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    # Write-then-rename, so a crash mid-write never leaves a corrupt checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc) if value else None
+
+
+def eligible(story: dict, statuses, since: Optional[datetime], until: Optional[datetime]) -> bool:
+    status = (story.get("imageJob") or {}).get("status")
+    if status not in statuses:
+        return False
+    submitted = generator.convert_firestore_timestamp(story.get("submittedAt"))
+    if since and (submitted is None or submitted < since):
+        return False
+    if until and (submitted is None or submitted >= until):
+        return False
+    return True
+
+
+def pages(stories_ref, page_size: int, cursor: Optional[str]):
+    """Pages of masked story snapshots in document-id order, starting after cursor."""
+    while True:
+        query = stories_ref.order_by("__name__").select(SCAN_FIELDS).limit(page_size)
+        if cursor:
+            query = query.start_after({"__name__": stories_ref.document(cursor)})
+        docs = list(query.stream())
+        if not docs:
+            return
+        yield docs
+        cursor = docs[-1].id
+
+
+def start_limiter(per_minute: Optional[float]) -> RateLimiter:
+    """At most `per_minute` story starts per minute, evenly spaced (burst 1); None = unlimited."""
+    spec = f"backfill={per_minute:g}/m:1" if per_minute else ""
+    return RateLimiter(spec=spec, backend="local")
+
+
+def backfill_story(doc, limiter: RateLimiter) -> str:
+    limiter.acquire("backfill")
+    # Queue it first (the claim only takes pending stories); if a monitor grabs it meanwhile, that's fine too
+    doc.reference.update(enqueue_fields(PRIORITY_BACKFILL))
+    # queue_depth=1: admission control must not degrade a backfill just because it's long
+    if generator.process_story(doc.id, queue_depth=1):
+        return "generated"
+    return "not generated"
+
+
+def estimate_seconds_per_image(samples: int) -> float:
+    """Measured latency of the configured engine/preset on this host (first render excluded as warm-up)."""
+    generator.generate_image(SAMPLE_PROMPT)
+    started = time.monotonic()
+    for _ in range(samples):
+        generator.generate_image(SAMPLE_PROMPT)
+    return (time.monotonic() - started) / samples
+
+
+def run(args) -> None:
+    statuses = set(args.statuses.split(","))
+    if args.regenerate:
+        statuses.add(DONE)
+    since, until = parse_date(args.since), parse_date(args.until)
+
+    checkpoint = {"cursor": None, "counts": {}} if args.reset or args.dry_run else load_checkpoint(args.checkpoint)
+    if checkpoint["cursor"]:
+        logger.info(f"Resuming after story {checkpoint['cursor']} ({checkpoint['counts']})")
+    counts = checkpoint["counts"]
+    limiter = start_limiter(args.rate)
+    stories_ref = generator.db.collection("stories")
+    selected = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel), thread_name_prefix="backfill") as pool:
+        for page in pages(stories_ref, args.page_size, checkpoint["cursor"]):
+            batch = []
+            for doc in page:
+                if eligible(doc.to_dict() or {}, statuses, since, until):
+                    batch.append(doc)
+            if args.limit:
+                batch = batch[:max(0, args.limit - selected)]
+            selected += len(batch)
+
+            if args.dry_run:
+                counts["eligible"] = counts.get("eligible", 0) + len(batch)
+            else:
+                for outcome in pool.map(lambda doc: backfill_story(doc, limiter), batch):
+                    counts[outcome] = counts.get(outcome, 0) + 1
+                # The cursor only moves past a page once every story on it is done
+                checkpoint.update(cursor=page[-1].id, counts=counts, updatedAt=datetime.now(timezone.utc).isoformat())
+                save_checkpoint(args.checkpoint, checkpoint)
+            logger.info(f"Through {page[-1].id}: {counts}")
+            if args.limit and selected >= args.limit:
+                break
+
+    if args.dry_run:
+        total = counts.get("eligible", 0)
+        logger.info(f"{total} stories would be backfilled (statuses: {', '.join(sorted(statuses))})")
+        if total:
+            per_image = estimate_seconds_per_image(args.samples)
+            # Renders are serialized per pipeline, so parallelism only hides the non-inference work
+            compute = total * per_image / max(1, min(args.parallel, generator.INFERENCE_SLOTS))
+            floor = total / args.rate * 60 if args.rate else 0
+            logger.info(f"Measured {per_image:.1f}s per image; estimated total: {max(compute, floor) / 3600:.2f} h"
+                        f"{' (rate-limited)' if floor > compute else ''}")
+    else:
+        generator.writes.flush()
+        logger.info(f"Backfill finished: {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate images for historical stories")
+    parser.add_argument("--statuses", default=f"{FAILED},{PENDING}", help="imageJob statuses to backfill")
+    parser.add_argument("--regenerate", action="store_true", help="also redo stories that already have an image")
+    parser.add_argument("--since", help="only stories submitted on/after this ISO date")
+    parser.add_argument("--until", help="only stories submitted before this ISO date")
+    parser.add_argument("--limit", type=int, help="stop after this many stories")
+    parser.add_argument("--parallel", type=int, default=1, help="stories in flight at once")
+    parser.add_argument("--rate", type=float, help="max stories started per minute")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="cursor file for resuming")
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start from the beginning")
+    parser.add_argument("--dry-run", action="store_true", help="count eligible stories and estimate compute time")
+    parser.add_argument("--samples", type=int, default=2, help="timed renders for the dry-run estimate")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# Benchmarks for the image generation stack (wall time and peak memory).
+# Run from the python/ folder, e.g.:
+#   python benchmark.py upscale --target 768x1152 --factor 1.5 --preset standard
+#   python benchmark.py engines --size 256 --steps 10
+#   python benchmark.py reads --cycles 5
+# Each variant runs in its own subprocess so peak RSS is measured independently.
+import argparse
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODEL_ID = os.environ.get("SD_MODEL_ID")  # None: the engine default (services.pipeline.MODEL_ID)
+PROMPT = ("Corporate infographic for PETRONAS Upstream. Vertical layout. TEAL and GREEN colors. "
+          "Title: Benchmark Story. Metrics: Cost: 20% lower. Flat design, minimal icons, professional.")
+
+
+def parse_size(value: str):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def load_pipeline():
+    from services.pipeline import get_pipeline
+
+    return get_pipeline(MODEL_ID)
+
+
+def run_in_subprocess(command: str, *extra: str) -> dict:
+    """Run one benchmark variant in a fresh interpreter and return its JSON result."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), command, *extra],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{command} {' '.join(extra)} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# --- upscale: direct high-res generation vs generate-small-then-upscale ---
+
+def upscale_worker(args):
+    import torch
+    from services.memory import observed_peak_rss_mb
+    from services.presets import apply_preset, resolve_preset
+    from services.upscale import upscale_image
+
+    target_w, target_h = parse_size(args.target)
+    if args.mode == "direct":
+        render_w, render_h = target_w, target_h
+    else:
+        render_w = max(256, int(target_w / args.factor) // 64 * 64)
+        render_h = max(256, int(target_h / args.factor) // 64 * 64)
+
+    pipe = load_pipeline()
+    applied = apply_preset(pipe, resolve_preset(args.preset))
+    pipe.set_progress_bar_config(disable=True)
+    generator = torch.Generator(device="cpu").manual_seed(0)
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        with torch.no_grad():
+            image = pipe(PROMPT, width=render_w, height=render_h, num_inference_steps=applied.steps,
+                         guidance_scale=applied.guidance_scale, generator=generator).images[0]
+        if args.mode == "upscale":
+            image, _ = upscale_image(image, target_w / render_w, args.upscaler)
+        timings.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        "mode": args.mode,
+        "render": f"{render_w}x{render_h}",
+        "output": f"{image.width}x{image.height}",
+        "seconds_min": round(min(timings), 2),
+        "seconds_mean": round(sum(timings) / len(timings), 2),
+        "peak_rss_mb": round(observed_peak_rss_mb() or 0, 0),
+    }))
+
+
+def upscale_benchmark(args):
+    common = ["--target", args.target, "--factor", str(args.factor), "--preset", args.preset,
+              "--upscaler", args.upscaler, "--repeat", str(args.repeat)]
+    results = [run_in_subprocess("upscale-worker", "--mode", mode, *common) for mode in ("direct", "upscale")]
+    print(f"{'mode':<10}{'render':>12}{'output':>12}{'min s':>10}{'mean s':>10}{'peak MB':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['render']:>12}{r['output']:>12}{r['seconds_min']:>10}{r['seconds_mean']:>10}{r['peak_rss_mb']:>10}")
+
+
+# --- engines: every entry point should render the same image in the same time via services/ ---
+
+ENTRY_POINTS = ("engine", "cpu-script", "local-generator", "cloud-function")
+
+
+def engines_worker(args):
+    import torch
+    from PIL import Image
+    from services.memory import observed_peak_rss_mb
+    from services.presets import resolve_preset
+
+    preset = resolve_preset(args.preset)
+    if args.entry == "engine":
+        from services.generate import generate_images
+        render = lambda: generate_images([PROMPT], [args.seed], None, args.steps, args.size, args.size, preset, model_id=MODEL_ID)[0][0]
+    elif args.entry == "cpu-script":
+        # What diffusers_cpu.py runs; only comparable with the others when they also run on CPU
+        from services.backends import DiffusersBackend
+        backend = DiffusersBackend(MODEL_ID, device="cpu", dtype=torch.float32)
+        render = lambda: backend.generate([PROMPT], [args.seed], preset, args.size, args.size, num_steps=args.steps)[0][0]
+    elif args.entry == "local-generator":
+        try:
+            import local_image_generator as entry  # initializes Firebase clients on import
+        except Exception as exc:
+            print(json.dumps({"entry": args.entry, "skipped": f"Firebase credentials unavailable ({exc})"}))
+            return
+        render = lambda: entry.generate_image(PROMPT, args.size, args.size, preset, args.steps, seed=args.seed)[0]
+    else:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions-python"))
+        try:
+            import main_diffusers_backup as entry
+        except Exception as exc:
+            print(json.dumps({"entry": args.entry, "skipped": f"firebase_functions unavailable ({exc})"}))
+            return
+        render = lambda: Image.open(io.BytesIO(entry.generate_image_bytes(
+            PROMPT, args.steps, preset.guidance_scale, args.size, args.size, seed=args.seed)))
+
+    timings, digest = [], None
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        image = render()
+        timings.append(time.perf_counter() - started)
+        digest = hashlib.sha256(image.convert("RGB").tobytes()).hexdigest()
+
+    print(json.dumps({
+        "entry": args.entry,
+        "seconds_first": round(timings[0], 2),
+        "seconds_min": round(min(timings), 2),
+        "peak_rss_mb": round(observed_peak_rss_mb() or 0, 0),
+        "sha256": digest,
+    }))
+
+
+def engines_benchmark(args):
+    common = ["--size", str(args.size), "--steps", str(args.steps), "--seed", str(args.seed),
+              "--preset", args.preset, "--repeat", str(args.repeat)]
+    results = [run_in_subprocess("engines-worker", "--entry", entry, *common) for entry in ENTRY_POINTS]
+    print(f"{'entry':<18}{'first s':>10}{'min s':>10}{'peak MB':>10}  image sha256")
+    for r in results:
+        if "skipped" in r:
+            print(f"{r['entry']:<18}  skipped: {r['skipped']}")
+            continue
+        print(f"{r['entry']:<18}{r['seconds_first']:>10}{r['seconds_min']:>10}{r['peak_rss_mb']:>10}  {r['sha256'][:16]}")
+    digests = {r["sha256"] for r in results if "sha256" in r}
+    print("identical output" if len(digests) == 1 else f"{len(digests)} distinct outputs (device/dtype differ?)")
+
+
+# --- reads: Firestore bytes/CPU/latency per monitor cycle, full documents vs field masks ---
+
+def _payload_bytes(data: dict) -> int:
+    # Decoded size as a proxy for the bytes on the wire
+    return len(json.dumps(data, default=str).encode("utf-8"))
+
+
+def _read_cycle(variant: str, stories_ref) -> dict:
+    from services.job_queue import QUEUE_FIELDS, STORY_FIELDS, pending_query
+
+    started = time.perf_counter()
+    decode_cpu, payload, docs_read = 0.0, 0, 0
+
+    def decode(snapshot, times=1):
+        nonlocal decode_cpu, payload, docs_read
+        cpu = time.process_time()
+        for _ in range(times):
+            data = snapshot.to_dict() or {}
+        decode_cpu += time.process_time() - cpu
+        payload += _payload_bytes(data)
+        docs_read += 1
+        return data
+
+    if variant == "legacy-scan":
+        # The old monitor: 50 most recent full stories, to_dict() in the filter, the sample log and the loop
+        from google.cloud import firestore
+        for doc in stories_ref.order_by("submittedAt", direction=firestore.Query.DESCENDING).limit(50).stream():
+            decode(doc, times=3)
+    else:
+        query = pending_query(stories_ref, fields=None if variant == "queue-full-docs" else QUEUE_FIELDS)
+        for doc in query.stream():
+            decode(doc)
+            if variant == "queue-masked":
+                # What claiming reads for each story it processes
+                decode(stories_ref.document(doc.id).get(field_paths=QUEUE_FIELDS + STORY_FIELDS))
+            else:
+                decode(stories_ref.document(doc.id).get())
+
+    return {"seconds": time.perf_counter() - started, "decode_cpu": decode_cpu, "bytes": payload, "docs": docs_read}
+
+
+def reads_benchmark(args):
+    from services.firestore_client import get_db
+
+    stories_ref = get_db().collection("stories")
+    print(f"{'variant':<18}{'docs':>6}{'KB/cycle':>10}{'decode ms':>11}{'latency s':>11}")
+    for variant in ("legacy-scan", "queue-full-docs", "queue-masked"):
+        cycles = [_read_cycle(variant, stories_ref) for _ in range(args.cycles)]
+        mean = lambda key: sum(c[key] for c in cycles) / len(cycles)
+        print(f"{variant:<18}{mean('docs'):>6.0f}{mean('bytes') / 1024:>10.1f}{mean('decode_cpu') * 1000:>11.1f}{mean('seconds'):>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image generation benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("upscale", "upscale-worker"):
+        p = sub.add_parser(name, help="direct high-res vs generate-small-then-upscale" if name == "upscale" else "(internal) run one variant")
+        p.add_argument("--target", default="768x1152", help="final output size WxH")
+        p.add_argument("--factor", type=float, default=1.5, help="upscale factor for the small render")
+        p.add_argument("--preset", default="standard")
+        p.add_argument("--upscaler", default="lanczos", choices=["lanczos", "esrgan"])
+        p.add_argument("--repeat", type=int, default=2)
+        if name == "upscale-worker":
+            p.add_argument("--mode", choices=["direct", "upscale"], required=True)
+
+    for name in ("engines", "engines-worker"):
+        p = sub.add_parser(name, help="same seeded render through every entry point" if name == "engines" else "(internal) run one entry point")
+        p.add_argument("--size", type=int, default=256)
+        p.add_argument("--steps", type=int, default=10)
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--preset", default="standard")
+        p.add_argument("--repeat", type=int, default=2)
+        if name == "engines-worker":
+            p.add_argument("--entry", choices=ENTRY_POINTS, required=True)
+
+    p = sub.add_parser("reads", help="Firestore read cost per monitor cycle: legacy scan vs masked queue")
+    p.add_argument("--cycles", type=int, default=5)
+
+    args = parser.parse_args()
+    {
+        "reads": reads_benchmark,
+        "upscale": upscale_benchmark,
+        "upscale-worker": upscale_worker,
+        "engines": engines_benchmark,
+        "engines-worker": engines_worker,
+    }[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
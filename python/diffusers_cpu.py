@@ -2,10 +2,13 @@
 # Save as python/diffusers_cpu.py, create a venv, pip install -r requirements, then run.
 import os
 import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+
+from services.backends import DiffusersBackend
+from services.pipeline import MODEL_ID
+from services.presets import resolve_preset
 
 # --- Configuration ---
-MODEL_ID = "stabilityai/stable-diffusion-2-1"
+PRESET = "standard"  # DPM++ 2M Karras: good quality at low step counts
 OUTPUT_FILENAME = "output_diffusers_cpu.png"
 IMAGE_SIZE = 256  # Small size for CPU
 INFERENCE_STEPS = 15  # Fewer steps for faster generation
@@ -23,18 +26,10 @@ if __name__ == "__main__":
         print("\nWarning: HF_API_TOKEN not set. Public models should work, but private/gated ones will fail.")
 
     try:
-        # --- 1. Set up the pipeline ---
-        # Use DPMSolver for improved quality at low step counts
-        scheduler = DPMSolverMultistepScheduler.from_pretrained(MODEL_ID, subfolder="scheduler")
-
-        # Load the pipeline. This will download the model if not cached (~5GB)
-        pipe = StableDiffusionPipeline.from_pretrained(
-            MODEL_ID,
-            scheduler=scheduler,
-            torch_dtype=torch.float32,  # Use float32 for CPU
-            use_auth_token=use_auth_token
-        )
-        pipe = pipe.to("cpu")
+        # --- 1. Set up the pipeline (shared engine, forced onto CPU in float32) ---
+        # This will download the model if not cached (~5GB)
+        backend = DiffusersBackend(MODEL_ID, device="cpu", dtype=torch.float32)
+        backend.pipeline
 
         # --- 2. Get user prompt ---
         prompt = input(f"\nEnter a prompt for the image: ")
@@ -44,8 +39,11 @@ if __name__ == "__main__":
 
         # --- 3. Generate the image ---
         print(f"\nGenerating image from prompt... (this can be slow on CPU)")
-        with torch.no_grad():
-            image = pipe(prompt, num_inference_steps=INFERENCE_STEPS).images[0]
+        images, _ = backend.generate(
+            [prompt], [None], resolve_preset(PRESET),
+            IMAGE_SIZE, IMAGE_SIZE, num_steps=INFERENCE_STEPS
+        )
+        image = images[0]
 
         # --- 4. Save the image ---
         image.save(OUTPUT_FILENAME)
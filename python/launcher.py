@@ -0,0 +1,180 @@
+# Multi-process launcher for CPU-only hosts: K local_image_generator.py workers, each pinned to its
+# own cores (NUMA-aware) with matching torch thread settings, sharding stories by doc id.
+# Run from the python/ folder, e.g.:
+#   python launcher.py calibrate --candidates 1,2,4,8
+#   python launcher.py run --workers 4
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from services.workers import format_cpulist, numa_nodes, plan_core_sets
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROMPT = ("Corporate infographic for PETRONAS Upstream. Vertical layout. TEAL and GREEN colors. "
+          "Title: Calibration Story. Metrics: Cost: 20% lower. Flat design, minimal icons, professional.")
+
+
+def worker_env(index: int, count: int, plan: dict, interop_threads: int) -> dict:
+    threads = str(len(plan["cpus"]))
+    env = dict(os.environ)
+    env.update({
+        "WORKER_INDEX": str(index),
+        "WORKER_COUNT": str(count),
+        "WORKER_CPUS": format_cpulist(plan["cpus"]),
+        "WORKER_INTEROP_THREADS": str(interop_threads),
+        # OpenMP/MKL read these at import time, before torch.set_num_threads runs
+        "OMP_NUM_THREADS": threads,
+        "MKL_NUM_THREADS": threads,
+        "PIPELINE_DEVICE": "cpu",
+    })
+    return env
+
+
+def worker_command(plan: dict, *args: str) -> list:
+    """Python command for one worker, under numactl when its cores sit on a single NUMA node."""
+    command = [sys.executable, *args]
+    if plan["node"] is not None and len(numa_nodes()) > 1 and shutil.which("numactl"):
+        # Keep the model weights in the worker's local memory
+        command = ["numactl", f"--physcpubind={format_cpulist(plan['cpus'])}", f"--membind={plan['node']}", *command]
+    return command
+
+
+def describe(plans) -> None:
+    for index, plan in enumerate(plans):
+        node = f"node {plan['node']}" if plan["node"] is not None else "multiple nodes"
+        print(f"worker {index}: {len(plan['cpus']):>3} cores on {node}: {format_cpulist(plan['cpus'])}")
+
+
+# --- run: K monitor workers sharing the Firestore queue by doc-id hash ---
+
+def run(args):
+    plans = plan_core_sets(args.workers, physical_only=not args.smt)
+    describe(plans)
+    procs = []
+    for index, plan in enumerate(plans):
+        command = worker_command(plan, os.path.join(HERE, "local_image_generator.py"))
+        procs.append(subprocess.Popen(command, cwd=HERE, env=worker_env(index, len(plans), plan, args.interop_threads)))
+
+    def stop(*_):
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            for index, proc in enumerate(procs):
+                if proc.poll() is not None:
+                    # One worker dying leaves its shard unserved, so restart it
+                    print(f"worker {index} exited with {proc.returncode}; restarting", file=sys.stderr)
+                    plan = plans[index]
+                    command = worker_command(plan, os.path.join(HERE, "local_image_generator.py"))
+                    procs[index] = subprocess.Popen(command, cwd=HERE, env=worker_env(index, len(plans), plan, args.interop_threads))
+            time.sleep(5)
+    except KeyboardInterrupt:
+        stop()
+    for proc in procs:
+        proc.wait()
+
+
+# --- calibrate: images per minute for each K on this host ---
+
+def calibrate_worker(args):
+    from services.workers import apply_worker_settings
+    apply_worker_settings()
+    from services.generate import generate_images
+
+    render = lambda: generate_images([PROMPT], [0], None, args.steps, args.size, args.size, args.preset)
+    render()  # warm-up: model load and first-run allocations aren't throughput
+    print("ready", flush=True)
+    sys.stdin.readline()  # wait until every worker is ready so the timed windows overlap
+
+    started = time.time()
+    for _ in range(args.images):
+        render()
+    print(json.dumps({"started": started, "finished": time.time(), "images": args.images}), flush=True)
+
+
+def calibrate(args):
+    from services.memory import DEFAULT_WEIGHTS_MB, memory_budget_mb
+
+    budget = memory_budget_mb()
+    results = []
+    for workers in [int(k) for k in args.candidates.split(",")]:
+        # Every worker holds its own copy of the model
+        if budget and workers * DEFAULT_WEIGHTS_MB * 1.5 > budget:
+            print(f"K={workers}: skipped, {workers} x ~{DEFAULT_WEIGHTS_MB * 1.5:.0f} MB exceeds the {budget:.0f} MB budget")
+            continue
+        try:
+            plans = plan_core_sets(workers, physical_only=not args.smt)
+        except ValueError as exc:
+            print(f"K={workers}: skipped, {exc}")
+            continue
+
+        procs = []
+        for index, plan in enumerate(plans):
+            command = worker_command(plan, os.path.abspath(__file__), "calibrate-worker",
+                                     "--images", str(args.images), "--size", str(args.size),
+                                     "--steps", str(args.steps), "--preset", args.preset)
+            procs.append(subprocess.Popen(command, cwd=HERE, env=worker_env(index, workers, plan, args.interop_threads),
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+        for proc in procs:
+            if proc.stdout.readline().strip() != "ready":
+                raise RuntimeError(f"calibration worker failed to start for K={workers}")
+        for proc in procs:
+            proc.stdin.write("go\n")
+            proc.stdin.flush()
+        reports = [json.loads(proc.stdout.readline()) for proc in procs]
+        for proc in procs:
+            proc.wait()
+
+        seconds = max(r["finished"] for r in reports) - min(r["started"] for r in reports)
+        images = sum(r["images"] for r in reports)
+        per_minute = images / seconds * 60
+        results.append({"workers": workers, "threads": [len(p["cpus"]) for p in plans],
+                        "images": images, "seconds": round(seconds, 1), "imagesPerMinute": round(per_minute, 2)})
+        print(f"K={workers}: {images} images in {seconds:.1f}s = {per_minute:.2f} images/min "
+              f"({len(plans[0]['cpus'])} threads per worker)")
+
+    if results:
+        best = max(results, key=lambda r: r["imagesPerMinute"])
+        print(f"\nBest on this host: K={best['workers']} ({best['imagesPerMinute']} images/min); "
+              f"start with: python launcher.py run --workers {best['workers']}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"results": results, "best": best}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process CPU launcher for the local image generator")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="start K pinned local_image_generator.py workers")
+    p.add_argument("--workers", type=int, required=True)
+
+    p = sub.add_parser("calibrate", help="measure images/min for each worker count")
+    p.add_argument("--candidates", default="1,2,4,8", help="comma-separated worker counts to try")
+    p.add_argument("--output", help="write results as JSON")
+
+    p = sub.add_parser("calibrate-worker", help="(internal) one calibration worker")
+
+    for name, p in sub.choices.items():
+        p.add_argument("--interop-threads", type=int, default=1)
+        p.add_argument("--smt", action="store_true", help="also use SMT siblings (hyperthreads)")
+        if name != "run":
+            p.add_argument("--images", type=int, default=3, help="timed images per worker")
+            p.add_argument("--size", type=int, default=256)
+            p.add_argument("--steps", type=int, default=10)
+            p.add_argument("--preset", default="standard")
+
+    args = parser.parse_args()
+    {"run": run, "calibrate": calibrate, "calibrate-worker": calibrate_worker}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,32 +6,59 @@ Uses diffusers with local GPU (much faster than Cloud Functions!)
 import os
 import json
 import time
+import socket
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 
 import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
 from PIL import Image
 from google.cloud import firestore
 from google.cloud import storage
 from firebase_admin import initialize_app, credentials
-import requests
 from rag_image_retriever import ImageStyleRetriever
+from services.backends import active_backend
+from services.generate import generate_images
+from services.pipeline import MODEL_ID, resolve_model
+from services.presets import Preset, resolve_preset
+from services.admission import AdmissionController, AdmissionDecision, REQUEUE_FULL_QUALITY
+from services.preview import PreviewPublisher, PREVIEW_ENABLED, get_tiny_decoder
+from services.upscale import upscale_image
+from services.safety import get_safety_stage
+from services.workers import WORKER_COUNT, WORKER_INDEX, apply_worker_settings, owns
+from services.deadline import JOB_DEADLINE_SECONDS, Deadline, DeadlineExceeded, JobCancelled
+from services.write_buffer import WriteBehindBuffer
+from services.executor import INFERENCE_SLOTS
+from services.retry import attempt_failure_fields
+from services.job_queue import (
+    CLAIMED, DONE, FAILED, PENDING, PRIORITY_RERENDER, QUEUE_FIELDS, RETRY, STORY_FIELDS,
+    due_retries_query, enqueue_fields, expired_leases_query, oldest_pending_query, pending_query,
+)
+from services.scheduler import JobScheduler, QueuedJob, job_class
+from services.journal import FINISHED, RUNNING, JobJournal, open_journal
+from services.render_cache import DETERMINISTIC_SEEDS, RenderCache, derive_seed, render_key
+from services.memory import (
+    HIGHRES_ENABLED, HIGHRES_WIDTH, HIGHRES_HEIGHT, MemoryPlan,
+    model_weights_mb, observed_peak_rss_mb, plan_job,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Configuration
-# Using CompVis/stable-diffusion-v1-4 (widely available via HF Inference API)
-# Note: stabilityai/stable-diffusion-2-1 returns 410 Gone from HF Inference API
-# Alternative: "runwayml/stable-diffusion-v1-5" (may also work)
-MODEL_ID = os.environ.get("SD_MODEL_ID", "CompVis/stable-diffusion-v1-4")
+# Model: SD_MODEL_ID, default in services/pipeline.py (MODEL_ID)
 BUCKET_NAME = os.environ.get("IMAGE_BUCKET_NAME", "systemicshiftv2.firebasestorage.app")
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER", "generated_images")
 HF_TOKEN = os.environ.get("HF_API_TOKEN")  # Set this in your environment
 PROJECT_ID = "systemicshiftv2"
+# Identifies this worker on the stories it has leased (imageJob.worker)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# A lease outlives the job's deadline by this much, so a crashed worker's stories become claimable again
+LEASE_GRACE_SECONDS = float(os.environ.get("LEASE_GRACE_SECONDS", "60"))
 
 # Initialize Firebase Admin with service account key
 # Check for service account key file or environment variable
@@ -85,9 +112,20 @@ else:
         logger.error("")
         raise
 
-# Global pipeline (loaded once, reused)
-_pipeline: Optional[StableDiffusionPipeline] = None
-_use_api_fallback = False  # Flag to use API instead of local model
+# Story completions/failures are written behind, in batches (WRITE_BATCH_SIZE / WRITE_FLUSH_SECONDS)
+writes = WriteBehindBuffer(db)
+
+# Crash-safe record of this worker's jobs (SQLite, JOB_JOURNAL_DIR); opened by monitor_firestore()
+journal: Optional[JobJournal] = None
+
+# Finished deterministic renders, shared by all workers (RENDER_CACHE / DETERMINISTIC_SEEDS)
+render_cache = RenderCache(db)
+
+# Backlog-aware admission control (fewer steps / smaller size when the queue is long)
+admission = AdmissionController()
+
+# Safety check runs as its own stage (SAFETY_CHECKER=off|default|light), overlapped with the upscale
+safety = get_safety_stage()
 
 # Initialize RAG style retriever
 try:
@@ -97,140 +135,82 @@ except Exception as e:
     logger.warning(f"Failed to initialize RAG retriever: {e}. Continuing without RAG enhancement.")
     style_retriever = None
 
-def get_pipeline() -> StableDiffusionPipeline:
-    """Get or create the Stable Diffusion pipeline (singleton pattern)"""
-    global _pipeline
-    if _pipeline is not None:
-        return _pipeline
-    
-    logger.info(f"Loading Stable Diffusion pipeline: {MODEL_ID}")
-    
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    torch_dtype = torch.float16 if device == "cuda" else torch.float32
-    
-    logger.info(f"Using device: {device}, dtype: {torch_dtype}")
-    
-    try:
-        # Use memory-efficient loading options
-        logger.info("Loading pipeline with memory optimizations...")
-        pipe = StableDiffusionPipeline.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch_dtype,
-            token=HF_TOKEN if HF_TOKEN else None,
-            low_cpu_mem_usage=True,  # Memory-efficient loading
-            use_safetensors=True  # Use safetensors format (more memory efficient)
-        )
-        pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
-        
-        # Enable memory optimizations
-        pipe.enable_attention_slicing()
-        
-        # For CPU, try sequential CPU offload to save memory
-        if device == "cpu":
-            try:
-                pipe.enable_sequential_cpu_offload()
-                logger.info("Sequential CPU offload enabled for memory efficiency")
-            except Exception as offload_error:
-                logger.warning(f"Could not enable sequential CPU offload: {offload_error}")
-                # Fallback: just move to device normally
-                pipe = pipe.to(device)
-        else:
-            pipe = pipe.to(device)
-        
-        logger.info("Pipeline loaded successfully")
-        _pipeline = pipe
-        return _pipeline
-    except MemoryError as e:
-        logger.error(f"MemoryError: Not enough RAM to load the model locally.")
-        logger.warning(f"Falling back to Hugging Face Inference API (no local model needed)")
-        global _use_api_fallback
-        _use_api_fallback = True
-        # Return None - we'll use API instead
+def get_pipeline(model_id: Optional[str] = None):
+    """
+    Get the local Stable Diffusion pipeline from the shared engine's pool (services/), or None when
+    the model doesn't fit in RAM and the engine has fallen back to the Hugging Face Inference API.
+    """
+    backend = active_backend(model_id=model_id or MODEL_ID)
+    if backend.name != "diffusers":
         return None
-    except Exception as e:
-        logger.error(f"Failed to load pipeline: {e}")
-        logger.error(f"Error type: {type(e).__name__}")
-        raise
-
-def generate_image_via_api(prompt: str, width: int = 512, height: int = 512,
-                           num_steps: int = 30, guidance_scale: float = 7.5) -> Image.Image:
-    """Generate image using Hugging Face Inference API (fallback when local model fails)"""
-    if not HF_TOKEN:
-        raise ValueError("HF_API_TOKEN is required for API fallback")
-    
-    api_url = f"https://api-inference.huggingface.co/models/{MODEL_ID}"
-    logger.info(f"Generating image via HF API: {len(prompt)} chars, {width}x{height}, {num_steps} steps")
+    pipe = backend.pipeline
     
-    try:
-        response = requests.post(
-            api_url,
-            headers={"Authorization": f"Bearer {HF_TOKEN}"},
-            json={
-                "inputs": prompt,
-                "parameters": {
-                    "num_inference_steps": num_steps,
-                    "guidance_scale": guidance_scale,
-                    "width": width,
-                    "height": height
-                },
-                "options": {
-                    "wait_for_model": True
-                }
-            },
-            timeout=300  # 5 minute timeout
-        )
-        
-        response.raise_for_status()
-        
-        # Parse image from response
-        from io import BytesIO
+    # Load the tiny preview decoder up front so its load time isn't billed to the first preview
+    if PREVIEW_ENABLED:
         try:
-            return Image.open(BytesIO(response.content))
-        except Exception as img_error:
-            # If not an image, might be JSON error
-            try:
-                error_data = response.json()
-                error_msg = error_data.get("error", str(error_data))
-                raise RuntimeError(f"Hugging Face API error: {error_msg}")
-            except json.JSONDecodeError:
-                raise RuntimeError(f"Unexpected response from HF API: {response.text[:500]}")
-                
-    except requests.exceptions.Timeout:
-        raise RuntimeError("Hugging Face API request timed out after 5 minutes")
-    except Exception as e:
-        logger.error(f"HF API request failed: {e}")
-        raise RuntimeError(f"HF API request failed: {e}")
+            get_tiny_decoder(pipe.device, pipe.dtype)
+        except Exception as preview_error:
+            logger.warning(f"Could not load preview decoder, previews disabled: {preview_error}")
+    return pipe
 
-def generate_image(prompt: str, width: int = 512, height: int = 512, 
-                   num_steps: int = 50, guidance_scale: float = 7.5) -> Image.Image:
-    """Generate image from prompt - uses local model or API fallback"""
-    global _use_api_fallback
-    
-    # If we're using API fallback, use that instead
-    if _use_api_fallback:
-        return generate_image_via_api(prompt, width, height, num_steps, guidance_scale)
-    
-    # Try to get local pipeline
-    pipe = get_pipeline()
-    
-    # If pipeline is None (memory error), use API
-    if pipe is None:
-        return generate_image_via_api(prompt, width, height, num_steps, guidance_scale)
+# A pipeline must not run two calls at once; callers processing stories in parallel (backfill.py)
+# overlap everything else (prompting, upload, Firestore) but queue here for the model
+_inference_slots = threading.BoundedSemaphore(INFERENCE_SLOTS)
+
+def generate_image(prompt: str, width: int = 512, height: int = 512,
+                   preset: Optional[Preset] = None, num_steps: Optional[int] = None,
+                   guidance_scale: Optional[float] = None,
+                   callback_on_step_end=None,
+                   memory_plan: Optional[MemoryPlan] = None,
+                   seed: Optional[int] = None,
+                   model_id: Optional[str] = None,
+                   check_safety: bool = True,
+                   deadline: Optional[Deadline] = None,
+                   timings: Optional[dict] = None) -> Tuple[Image.Image, Preset]:
+    """
+    Generate image from prompt via the shared engine - uses local model or API fallback.
+    Steps/guidance default to the preset's values; returns the image and the preset actually applied.
+    callback_on_step_end and memory_plan (VAE slicing/tiling, attention slicing) only apply to the local pipeline.
+    model_id picks one of IMAGE_MODELS (default MODEL_ID) without restarting the worker.
+    deadline cancels the run between denoising steps and bounds the API fallback's request timeout.
+    timings, if given, is filled with queueSeconds (waiting for a pipeline slot), loadSeconds (loading
+    the model) and denoiseSeconds (the generation call alone, which is what admission control samples).
+    """
+    preset = preset or resolve_preset()
     
-    logger.info(f"Generating image locally: {len(prompt)} chars, {width}x{height}, {num_steps} steps")
+    logger.info(f"Generating image: {len(prompt)} chars, {width}x{height}, preset: {preset.name}")
     
-    with torch.no_grad():
-        result = pipe(
-            prompt,
-            num_inference_steps=num_steps,
+    queued = time.monotonic()
+    wait = deadline.timeout(stage="waiting for the pipeline") if deadline else None
+    if not _inference_slots.acquire(timeout=wait):
+        raise DeadlineExceeded(f"deadline of {deadline.seconds:.0f}s exceeded waiting for the pipeline")
+    try:
+        loading = time.monotonic()
+        # Load (or pick the fallback for) the model before the clock starts, so load time isn't a step sample
+        active_backend(model_id=resolve_model(model_id or MODEL_ID))
+        started = time.monotonic()
+        images, applied = generate_images(
+            [prompt],
+            [seed],
             guidance_scale=guidance_scale,
+            num_inference_steps=num_steps,
             width=width,
-            height=height
+            height=height,
+            preset=preset,
+            callback_on_step_end=callback_on_step_end,
+            memory_plan=memory_plan,
+            model_id=model_id or MODEL_ID,
+            check_safety=check_safety,
+            deadline=deadline
         )
-    
-    return result.images[0]
+        if timings is not None:
+            timings.update(queueSeconds=loading - queued, loadSeconds=started - loading,
+                           denoiseSeconds=time.monotonic() - started)
+    finally:
+        _inference_slots.release()
+    return images[0], applied
 
-def upload_to_storage(image: Image.Image, filename: str) -> str:
+def upload_to_storage(image: Image.Image, filename: str, image_format: str = "PNG") -> str:
     """Upload image to Firebase Storage and return public URL"""
     bucket = storage_client.bucket(BUCKET_NAME)
     blob = bucket.blob(filename)
@@ -238,10 +218,10 @@ def upload_to_storage(image: Image.Image, filename: str) -> str:
     # Convert PIL Image to bytes
     from io import BytesIO
     buf = BytesIO()
-    image.save(buf, format="PNG")
+    image.save(buf, format=image_format)
     buf.seek(0)
     
-    blob.upload_from_file(buf, content_type="image/png")
+    blob.upload_from_file(buf, content_type=f"image/{image_format.lower()}")
     blob.make_public()
     
     return f"https://storage.googleapis.com/{BUCKET_NAME}/{filename}"
@@ -279,9 +259,129 @@ def convert_firestore_timestamp(timestamp_obj) -> Optional[datetime]:
     return timestamp_obj
 
 
-def process_story(doc_id: str, story_data: dict):
-    """Process a single story: generate image and update Firestore"""
+def plan_memory(width: int, height: int, model_id: Optional[str] = None) -> Optional[MemoryPlan]:
+    """
+    Check a job against the memory budget before running it (local pipeline only).
+    Returns the slicing/tiling settings and possibly a smaller size; raises MemoryBudgetExceeded
+    if it can't fit at all, so the story fails instead of the worker running out of memory.
+    """
+    pipe = get_pipeline(model_id)
+    if pipe is None:
+        return None
+    dtype_bytes = 2 if pipe.dtype == torch.float16 else 4
+    return plan_job(width, height, batch=1, dtype_bytes=dtype_bytes, weights_mb=model_weights_mb(pipe))
+
+def make_preview_publisher(doc_id: str, model_id: Optional[str] = None) -> Optional[PreviewPublisher]:
+    """Publish low-res TAESD previews of a story's image to Storage/Firestore while it denoises"""
+    if not PREVIEW_ENABLED or get_pipeline(model_id) is None:
+        return None
+    
+    doc_ref = db.collection("stories").document(doc_id)
+    
+    def publish(preview: Image.Image, step: int, total_steps: int):
+        # One object per step: public GCS objects are CDN-cached, so don't overwrite in place
+        preview_url = upload_to_storage(preview.convert("RGB"), f"{IMAGE_FOLDER}/previews/{doc_id}_{step}.jpg", image_format="JPEG")
+        doc_ref.update({
+            "aiPreviewImageUrl": preview_url,
+            "aiPreviewStep": step,
+            "aiPreviewTotalSteps": total_steps
+        })
+        logger.info(f"Preview {step}/{total_steps} published for {doc_id}")
+    
+    return PreviewPublisher(publish)
+
+@firestore.transactional
+def _claim_in_transaction(transaction, doc_ref, lease_seconds: float) -> Optional[dict]:
+    # Field mask: the lease plus just the fields process_story needs, not the AI write-ups
+    snapshot = doc_ref.get(field_paths=QUEUE_FIELDS + STORY_FIELDS, transaction=transaction)
+    story = snapshot.to_dict() or {}
+    job = story.get("imageJob") or {}
+    lease_expires = convert_firestore_timestamp(job.get("leaseExpiresAt"))
+    now = datetime.now(timezone.utc)
+    lease_expired = job.get("status") == CLAIMED and (lease_expires is None or lease_expires <= now)
+    if job.get("status") != PENDING and not lease_expired:
+        return None
+    job["attemptCount"] = job.get("attemptCount", 0) + 1
+    transaction.update(doc_ref, {
+        "imageJob.status": CLAIMED,
+        "imageJob.worker": WORKER_ID,
+        "imageJob.claimedAt": firestore.SERVER_TIMESTAMP,
+        "imageJob.leaseExpiresAt": now + timedelta(seconds=lease_seconds),
+        "imageJob.attemptCount": job["attemptCount"]
+    })
+    story["imageJob"] = job
+    return story
+
+def claim_story(doc_id: str, deadline: Deadline) -> Optional[dict]:
+    """
+    Move a pending story to claimed, leased for the length of its deadline. Returns the story's
+    STORY_FIELDS and imageJob (with this attempt counted, read in the same transaction), or None
+    if another worker got it first.
+    """
+    doc_ref = db.collection("stories").document(doc_id)
+    return _claim_in_transaction(db.transaction(), doc_ref, deadline.seconds + LEASE_GRACE_SECONDS)
+
+def failure_fields(job: dict, error: Exception) -> dict:
+    """Update fields for a failed attempt (see services.retry.attempt_failure_fields), ending the lease if final."""
+    fields = attempt_failure_fields(job, error, WORKER_ID)
+    if fields["imageJob.status"] == FAILED:
+        fields["imageJob.finishedAt"] = firestore.SERVER_TIMESTAMP
+    return fields
+
+def lease_release(status: str, reason: Optional[str] = None) -> dict:
+    """Firestore update fields that end this worker's lease on a story, recording the outcome."""
+    fields = {
+        "imageJob.status": status,
+        "imageJob.leaseExpiresAt": None,
+        "imageJob.finishedAt": firestore.SERVER_TIMESTAMP
+    }
+    if reason:
+        fields["imageJob.cancelReason"] = reason
+    return fields
+
+def process_story(doc_id: str, story_data: Optional[dict] = None, queue_depth: int = 1, full_quality: bool = False):
+    """
+    Process a single story: generate image and update Firestore.
+    queue_depth is the number of stories still waiting (including this one) and drives admission control;
+    full_quality skips admission control (used for re-rendering degraded images once the backlog clears).
+    The story is leased for JOB_DEADLINE_SECONDS; a run that overshoots is cancelled between steps and the
+    lease released with the reason, so one stuck job can't stall the queue.
+    The story's concept fields are read while claiming it; story_data, if given, takes precedence.
+    """
+    deadline = Deadline(JOB_DEADLINE_SECONDS)
+    try:
+        claimed = claim_story(doc_id, deadline)
+        if claimed is None:
+            logger.info(f"Story {doc_id} was claimed by another worker, skipping")
+            if journal:
+                journal.forget(doc_id)
+            return False
+        job = claimed.get("imageJob") or {}
+        story_data = story_data or claimed
+    except Exception as e:
+        logger.warning(f"Could not lease story {doc_id}: {e}")
+        return False
+    
+    def on_written(error):
+        if error is None:
+            logger.info(f"✅ Firestore updated successfully for {doc_id}")
+            if journal:
+                journal.written(doc_id)
+    
+    def complete(update_data: dict, degraded: bool):
+        # The image URL and the lease release are one document write, so the lease is never
+        # released without the URL; the journal keeps the write until it's confirmed, for a restart to replay
+        if degraded and REQUEUE_FULL_QUALITY:
+            # Degraded renders go back in the queue at the lowest priority, to be re-done at full quality
+            update_data.update(enqueue_fields(PRIORITY_RERENDER, full_quality=True))
+        if journal:
+            journal.finish(doc_id, DONE, update_data)
+        writes.update(db.collection("stories").document(doc_id), update_data, on_done=on_written)
+        logger.info(f"✅ Successfully processed story: {doc_id}")
+    
     try:
+        if journal:
+            journal.start(doc_id, WORKER_ID)
         logger.info(f"Processing story: {doc_id}")
         
         # Get infographic concept - handle both dict and string formats
@@ -342,19 +442,115 @@ def process_story(doc_id: str, story_data: dict):
             prompt = base_prompt
             logger.debug("RAG retriever not available, using base prompt")
         
-        logger.info(f"Generating image for: {title}")
+        # Pick the quality/latency preset requested on the story (falls back to IMAGE_PRESET)
+        try:
+            preset = resolve_preset(story_data.get("imagePreset"))
+        except ValueError as e:
+            logger.warning(f"{e}. Using default preset.")
+            preset = resolve_preset()
+        
+        # Model requested on the story (any of IMAGE_MODELS; pipelines are pooled, no restart needed)
+        try:
+            model_id = resolve_model(story_data.get("imageModel") or MODEL_ID)
+        except ValueError as e:
+            logger.warning(f"{e}. Using default model.")
+            model_id = MODEL_ID
+        
+        # High-resolution mode uses a taller canvas for the vertical infographic layout
+        if HIGHRES_ENABLED or story_data.get("imageHighRes"):
+            width, height = HIGHRES_WIDTH, HIGHRES_HEIGHT
+        else:
+            width, height = 512, 512
+        
+        # Admission control: hold the p95 time-to-image target by degrading quality under backlog
+        if full_quality:
+            decision = AdmissionDecision(level=0, steps=preset.steps, width=width, height=height,
+                                         queue_depth=queue_depth, estimated_seconds=None,
+                                         degraded=False, reason="full-quality re-render")
+        else:
+            decision = admission.plan(preset.steps, width, height, queue_depth)
+        if decision.degraded:
+            logger.info(f"Admission: degrading {doc_id} to {decision.steps} steps at {decision.width}x{decision.height} ({decision.reason})")
+        
+        # Memory budget: enable slicing/tiling as needed, downsize (or reject) jobs that won't fit
+        memory_plan = plan_memory(decision.width, decision.height, model_id)
+        if memory_plan:
+            logger.info(f"Memory plan for {doc_id}: {memory_plan.width}x{memory_plan.height}, ~{memory_plan.estimated_mb:.0f} MB "
+                        f"(budget {memory_plan.budget_mb or 0:.0f} MB, attention_slicing={memory_plan.attention_slicing}, "
+                        f"vae_slicing={memory_plan.vae_slicing}, vae_tiling={memory_plan.vae_tiling})")
+            width, height = memory_plan.width, memory_plan.height
+        else:
+            width, height = decision.width, decision.height
+        
+        # Deterministic mode: seed from the doc id and prompt; an identical earlier render is reused as is
+        seed, cache_key = None, None
+        if DETERMINISTIC_SEEDS:
+            seed = derive_seed(doc_id, prompt)
+            cache_key = render_key(prompt, seed, decision.steps if decision.degraded else preset.steps, width, height,
+                                   model_id, active_backend(model_id=model_id).name, preset.to_record())
+            cached = render_cache.get(cache_key)
+            if cached:
+                logger.info(f"Render cache hit for {doc_id} (seed {seed}, key {cache_key[:12]})")
+                complete({
+                    **cached.get("fields", {}),
+                    "aiGeneratedImageUrl": cached["url"],
+                    "analysisTimestamp": firestore.SERVER_TIMESTAMP,
+                    "imageGeneratedAt": firestore.SERVER_TIMESTAMP,
+                    "imageGeneratedLocally": True,
+                    "imageAdmission": decision.to_record(),
+                    "imageSeed": seed,
+                    "imageRenderKey": cache_key,
+                    "imageCacheHit": True,
+                    **lease_release(DONE)
+                }, decision.degraded)
+                return True
+        
+        logger.info(f"Generating image for: {title} (preset: {preset.name}, model: {model_id})")
         logger.debug(f"Final prompt: {prompt[:150]}...")  # Log first 150 chars
         
-        # Generate image
-        image = generate_image(
-            prompt=prompt,
-            width=512,
-            height=512,
-            num_steps=30,  # Faster for local generation
-            guidance_scale=7.5
-        )
+        # Generate image (publishing cheap previews along the way)
+        preview = make_preview_publisher(doc_id, model_id)
+        render_timings = {}
+        try:
+            image, applied_preset = generate_image(
+                prompt=prompt,
+                width=width,
+                height=height,
+                preset=preset,
+                num_steps=decision.steps if decision.degraded else None,
+                callback_on_step_end=preview,
+                memory_plan=memory_plan,
+                model_id=model_id,
+                check_safety=False,
+                deadline=deadline,
+                seed=seed,
+                timings=render_timings
+            )
+        finally:
+            if preview:
+                preview.close()
+        # Only the generation call itself: slot waits and model loads would read as slow steps
+        denoise_seconds = render_timings["denoiseSeconds"]
+        steps_used = decision.steps if decision.degraded else applied_preset.steps
+        admission.record(denoise_seconds, steps_used, width, height)
+        safety_pending = safety.submit([image])
+        if memory_plan:
+            logger.info(f"Peak RSS so far: {observed_peak_rss_mb() or 0:.0f} MB (estimated {memory_plan.estimated_mb:.0f} MB)")
+        
+        # Optional output stage: cheap CPU upscale instead of rendering large sizes directly
+        image, upscale_record = upscale_image(image, applied_preset.upscale, applied_preset.upscaler)
+        try:
+            _, safety_results, safety_seconds = safety_pending.result(timeout=deadline.timeout(stage="safety check"))
+        except FutureTimeoutError:
+            raise DeadlineExceeded(f"deadline of {deadline.seconds:.0f}s exceeded during safety check")
+        if safety_results[0].flagged and safety.action == "blank":
+            image = Image.new("RGB", image.size)
+        logger.info(f"Denoise {denoise_seconds:.1f}s, safety check ({safety.mode}) {safety_seconds:.2f}s")
+        if preview:
+            logger.info(f"Preview cost for {doc_id}: {preview.stats()}")
         
         # Upload to storage
+        deadline.check("upload")
         filename = f"{IMAGE_FOLDER}/{doc_id}_{int(time.time())}.png"
         image_url = upload_to_storage(image, filename)
         
@@ -363,44 +559,167 @@ def process_story(doc_id: str, story_data: dict):
         
         # Update Firestore
         # Set analysisTimestamp so frontend knows generation is complete
-        doc_ref = db.collection("stories").document(doc_id)
         update_data = {
             "aiGeneratedImageUrl": image_url,
             "analysisTimestamp": firestore.SERVER_TIMESTAMP,  # Frontend checks this to hide "Generating Content..."
             "imageGeneratedAt": firestore.SERVER_TIMESTAMP,
-            "imageGeneratedLocally": True
+            "imageGeneratedLocally": True,
+            "imagePreset": applied_preset.name,
+            "imageModel": model_id,
+            "imagePresetParams": applied_preset.to_record(),  # Records the fallback if the LoRA was unavailable
+            "imageAdmission": decision.to_record(),
+            "imageSize": {"width": image.width, "height": image.height},
+            "imageUpscale": upscale_record,
+            "imageSafety": {**safety_results[0].to_record(), "mode": safety.mode, "seconds": round(safety_seconds, 3)},
+            "imageTimings": {"denoiseSeconds": round(denoise_seconds, 2), "safetySeconds": round(safety_seconds, 3),
+                             "queueSeconds": round(render_timings["queueSeconds"], 2),
+                             "loadSeconds": round(render_timings["loadSeconds"], 2)},
+            **lease_release(DONE)
         }
-        doc_ref.update(update_data)
-        logger.info(f"✅ Firestore updated successfully for {doc_id}")
-        
-        logger.info(f"✅ Successfully processed story: {doc_id}")
+        if preview:
+            update_data["imagePreviewStats"] = preview.stats()
+        if memory_plan:
+            update_data["imageMemoryPlan"] = memory_plan.to_record()
+        if seed is not None:
+            update_data.update({"imageSeed": seed, "imageRenderKey": cache_key, "imageCacheHit": False})
+            if not safety_results[0].flagged:
+                render_cache.put(cache_key, {
+                    "url": image_url,
+                    "docId": doc_id,
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                    "fields": {key: update_data[key] for key in (
+                        "imagePreset", "imageModel", "imagePresetParams", "imageSize", "imageUpscale", "imageSafety")}
+                })
+        complete(update_data, decision.degraded)
         return True
         
     except Exception as e:
-        logger.error(f"❌ Error processing story {doc_id}: {e}", exc_info=True)
+        if isinstance(e, JobCancelled):
+            logger.error(f"⏱️  Story {doc_id} cancelled: {e.reason}")
+        else:
+            logger.error(f"❌ Error processing story {doc_id}: {e}", exc_info=True)
         
-        # Update Firestore with error
+        # Record the attempt on imageJob and schedule a retry if it's worth one; aiGeneratedImageUrl
+        # is left alone (a re-render keeps its degraded image, a first render stays pending)
         try:
-            doc_ref = db.collection("stories").document(doc_id)
-            doc_ref.update({
-                "aiGeneratedImageUrl": f"Error: {str(e)}",
-                "imageGeneratedAt": firestore.SERVER_TIMESTAMP
-            })
-        except:
-            pass
+            fields = failure_fields(job, e)
+            if fields["imageJob.status"] == RETRY:
+                logger.info(f"Story {doc_id}: attempt {fields['imageJob.lastError']['attempt']} failed "
+                            f"({fields['imageJob.lastError']['kind']}), retrying at {fields['imageJob.retryAt']:%H:%M:%S} UTC")
+            else:
+                logger.warning(f"Story {doc_id}: giving up after attempt {fields['imageJob.lastError']['attempt']} "
+                               f"({fields['imageJob.lastError']['kind']} error)")
+            if journal:
+                journal.finish(doc_id, fields["imageJob.status"], fields)
+            writes.update(db.collection("stories").document(doc_id), fields, on_done=on_written)
+        except Exception as write_error:
+            logger.error(f"Could not record failure for {doc_id}: {write_error}")
         
         return False
 
+@firestore.transactional
+def _take_over_in_transaction(transaction, doc_ref, previous_worker: str, make_fields) -> Optional[dict]:
+    # Only if the story is still leased to this worker's previous run (nobody else has moved it on)
+    snapshot = doc_ref.get(field_paths=QUEUE_FIELDS, transaction=transaction)
+    job = (snapshot.to_dict() or {}).get("imageJob") or {}
+    if job.get("status") != CLAIMED or job.get("worker") != previous_worker:
+        return None
+    transaction.update(doc_ref, make_fields(job))
+    return job
+
+def recover_from_journal() -> list:
+    """
+    Settle what the previous run of this worker left behind, without waiting for its leases to expire:
+    finished jobs whose Firestore write was never confirmed are written now, and running jobs are put
+    back in the queue. Returns (doc_id, full_quality) for the re-queued jobs, to resume first.
+    """
+    resume = []
+    for entry in journal.unfinished():
+        doc_id = entry["doc_id"]
+        doc_ref = db.collection("stories").document(doc_id)
+        try:
+            if entry["state"] == FINISHED:
+                job = _take_over_in_transaction(db.transaction(), doc_ref, entry["worker_id"], lambda job: entry["fields"])
+                logger.info(f"[Journal] {doc_id}: {'wrote' if job is not None else 'dropped (moved on since)'} "
+                            f"unconfirmed '{entry['outcome']}' result")
+                journal.written(doc_id)
+            elif entry["state"] == RUNNING:
+                job = _take_over_in_transaction(
+                    db.transaction(), doc_ref, entry["worker_id"],
+                    lambda job: enqueue_fields(job.get("priority", PRIORITY_RERENDER), job.get("fullQuality", False),
+                                               reset_attempts=False))
+                if job is not None:
+                    logger.info(f"[Journal] {doc_id}: resuming interrupted job")
+                    resume.append((doc_id, bool(job.get("fullQuality"))))
+                else:
+                    journal.forget(doc_id)
+            else:
+                # Accepted but never claimed: still pending, the queue will bring it back
+                journal.forget(doc_id)
+        except Exception as e:
+            logger.warning(f"[Journal] Could not recover {doc_id}: {e}")
+    return resume
+
+def reclaim_expired_leases(stories_ref):
+    """Put stories whose worker died or stalled past its lease back in the queue."""
+    now = datetime.now(timezone.utc)
+    for doc in expired_leases_query(stories_ref, now).stream():
+        job = doc.to_dict().get("imageJob") or {}
+        logger.warning(f"[Monitor Cycle] Lease on {doc.id} held by {job.get('worker')} expired; re-queueing")
+        writes.update(doc.reference, enqueue_fields(job.get("priority", PRIORITY_RERENDER), job.get("fullQuality", False),
+                                                    reset_attempts=False))
+
+def promote_due_retries(stories_ref):
+    """Move failed stories whose backoff has elapsed back into the pending queue, at their old priority."""
+    now = datetime.now(timezone.utc)
+    for doc in due_retries_query(stories_ref, now).stream():
+        job = doc.to_dict().get("imageJob") or {}
+        logger.info(f"[Monitor Cycle] Retrying {doc.id} (attempt {job.get('attemptCount', 0) + 1})")
+        writes.update(doc.reference, enqueue_fields(job.get("priority", PRIORITY_RERENDER), job.get("fullQuality", False),
+                                                    reset_attempts=False))
+
+# Orders this worker's share of the queue by job class, with ageing and per-class caps (SCHED_* env)
+scheduler = JobScheduler()
+
+def queued_job(doc) -> QueuedJob:
+    # Queue snapshots only carry imageJob (field mask)
+    job = (doc.to_dict() or {}).get("imageJob") or {}
+    return QueuedJob(
+        doc_id=doc.id,
+        job_class=job_class(job),
+        enqueued_at=convert_firestore_timestamp(job.get("enqueuedAt")) or datetime.now(timezone.utc),
+        full_quality=bool(job.get("fullQuality")),
+        # With several workers, try this worker's hash shard first to keep claim contention low
+        preferred=owns(doc.id)
+    )
+
+def run_scheduled_jobs() -> int:
+    """Start jobs in scheduler order, up to scheduler.concurrency at once, until none is eligible; returns stories processed."""
+    def run(job: QueuedJob) -> bool:
+        if journal:
+            journal.accept(job.doc_id, job.job_class)
+        try:
+            return process_story(job.doc_id, queue_depth=scheduler.depth(), full_quality=job.full_quality)
+        finally:
+            scheduler.finish(job)
+    
+    processed, running = 0, set()
+    with ThreadPoolExecutor(max_workers=scheduler.concurrency, thread_name_prefix="story") as pool:
+        while True:
+            job = scheduler.next()
+            if job is not None:
+                logger.info(f"[Scheduler] Starting {job.doc_id} ({job.job_class})")
+                running.add(pool.submit(run, job))
+                continue
+            if not running:
+                return processed
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            processed += sum(1 for future in done if future.result())
+
 def monitor_firestore():
-    """Monitor Firestore for stories that need image generation"""
+    """Work the story image queue: claim pending stories (imageJob.status) in priority order"""
     logger.info("Starting Firestore monitor...")
     
-    # Record script start time - only process stories submitted AFTER this time
-    # Use UTC to match Firestore timestamps (Firestore stores all timestamps in UTC)
-    script_start_time = datetime.now(timezone.utc)
-    logger.info(f"Script started at: {script_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
-    logger.info(f"Will only process stories submitted AFTER script start time")
-    
     # Try to load pipeline once at startup
     logger.info("Loading pipeline (this may take a few minutes on first run)...")
     try:
@@ -414,123 +733,47 @@ def monitor_firestore():
         logger.error(f"Failed to initialize: {e}")
         logger.info("Will attempt to use API fallback when processing stories...")
     
+    global journal
+    journal = open_journal(f"worker-{WORKER_INDEX}")
+    if journal:
+        last_cycle = journal.get_meta("lastCycleAt")
+        logger.info(f"Job journal: {journal.path} (previous run {journal.get_meta('workerId') or 'none'}, "
+                    f"last cycle {last_cycle or 'never'})")
+        resume = recover_from_journal()
+        journal.set_meta("workerId", WORKER_ID)
+        for doc_id, full_quality in resume:
+            process_story(doc_id, queue_depth=len(resume), full_quality=full_quality)
+    
+    stories_ref = db.collection("stories")
     while True:
         try:
-            stories_ref = db.collection("stories")
-            
             logger.info("=" * 60)
-            logger.info(f"[Monitor Cycle] Checking for stories needing image generation at {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
-            logger.info(f"[Monitor Cycle] Script started at: {script_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+            logger.info(f"[Monitor Cycle] Checking the image queue at {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
             
-            # Query for stories needing image generation in two ways:
-            # 1. Stories submitted AFTER script start (new submissions)
-            # 2. Recent stories with concepts that need images (regardless of submission time)
-            logger.info(f"[Monitor Cycle] Querying for stories needing image generation...")
+            try:
+                reclaim_expired_leases(stories_ref)
+            except Exception as e:
+                logger.warning(f"Error re-queueing expired leases: {e}")
+            try:
+                promote_due_retries(stories_ref)
+            except Exception as e:
+                logger.warning(f"Error re-queueing due retries: {e}")
             
             try:
-                all_docs_dict = {}  # Use dict to deduplicate by document ID
-                
-                # Query 1: Stories submitted after script start (for new submissions)
-                try:
-                    query_new = stories_ref.where("submittedAt", ">=", script_start_time)\
-                                          .order_by("submittedAt")\
-                                          .limit(20)
-                    docs_new = list(query_new.stream())
-                    logger.info(f"[Monitor Cycle] Found {len(docs_new)} document(s) submitted after script start")
-                    for doc in docs_new:
-                        all_docs_dict[doc.id] = doc
-                except Exception as e:
-                    logger.warning(f"Error querying new submissions: {e}")
-                
-                # Query 2: Recent documents (last 50) - we'll filter for those with concepts needing images
-                # This catches documents submitted before script start that have concepts
-                try:
-                    query_recent = stories_ref.order_by("submittedAt", direction=firestore.Query.DESCENDING).limit(50)
-                    docs_recent = list(query_recent.stream())
-                    logger.info(f"[Monitor Cycle] Checking {len(docs_recent)} most recent documents for concepts needing images")
-                    
-                    for doc in docs_recent:
-                        doc_data = doc.to_dict()
-                        has_concept = bool(doc_data.get("aiInfographicConcept"))
-                        image_url = doc_data.get("aiGeneratedImageUrl", "NOT SET")
-                        
-                        # Check if this document needs image generation
-                        # (has concept but no valid image URL)
-                        is_valid_url = isinstance(image_url, str) and (image_url.startswith("http://") or image_url.startswith("https://"))
-                        has_error = isinstance(image_url, str) and ("Error:" in image_url or "failed" in image_url.lower())
-                        
-                        if has_concept and not is_valid_url and not has_error:
-                            # This document has a concept and needs an image
-                            if doc.id not in all_docs_dict:
-                                all_docs_dict[doc.id] = doc
-                                logger.info(f"[Monitor Cycle] Found document with concept needing image (submitted before script start): {doc.id}")
-                except Exception as e:
-                    logger.warning(f"Error querying recent documents: {e}")
-                
-                # Convert dict values to list
-                docs = list(all_docs_dict.values())
-                logger.info(f"[Monitor Cycle] Total documents to check: {len(docs)} (after deduplication)")
-                
-                # Diagnostic logging for first few documents
-                if len(docs) > 0:
-                    logger.info(f"[Monitor Cycle] Sample of documents to process:")
-                    for doc in docs[:3]:  # Show first 3
-                        doc_data = doc.to_dict()
-                        doc_id = doc.id
-                        title = doc_data.get("nonShiftTitle") or doc_data.get("storyTitle", "N/A")
-                        has_concept = bool(doc_data.get("aiInfographicConcept"))
-                        image_url = doc_data.get("aiGeneratedImageUrl", "NOT SET")
-                        logger.info(f"[Monitor Cycle]   - {doc_id}: '{title[:40]}', hasConcept={has_concept}, imageUrl='{str(image_url)[:50]}'")
-                
+                # Highest priority first, plus the longest-waiting, so ageing can reach old low-priority jobs
+                docs = {doc.id: doc for doc in oldest_pending_query(stories_ref).stream()}
+                docs.update((doc.id, doc) for doc in pending_query(stories_ref).stream())
             except Exception as e:
-                logger.warning(f"Query timeout or error, retrying: {e}")
+                logger.warning(f"Queue query failed, retrying: {e}")
                 time.sleep(5)
                 continue
+            logger.info(f"[Monitor Cycle] {len(docs)} pending stor{'y' if len(docs) == 1 else 'ies'}")
             
-            processed_count = 0
-            for doc in docs:
-                doc_data = doc.to_dict()
-                doc_id = doc.id
-                
-                # Log document details for debugging
-                image_url = doc_data.get("aiGeneratedImageUrl", "NOT SET")
-                has_concept = bool(doc_data.get("aiInfographicConcept"))
-                submitted_at = doc_data.get("submittedAt")
-                
-                # Convert Firestore timestamp to string for logging
-                if submitted_at:
-                    submitted_dt = convert_firestore_timestamp(submitted_at)
-                    if submitted_dt:
-                        submitted_str = submitted_dt.strftime("%Y-%m-%d %H:%M:%S UTC")
-                    else:
-                        submitted_str = "unknown (conversion failed)"
-                else:
-                    submitted_str = "unknown"
-                
-                title = doc_data.get("nonShiftTitle") or doc_data.get("storyTitle", "N/A")
-                
-                logger.info(f"[Monitor Cycle] Doc {doc_id}: title='{title[:40]}', submitted={submitted_str}, imageUrl='{str(image_url)[:60]}', hasConcept={has_concept}")
-                
-                # Skip documents that already have error messages (they've been tried before)
-                if isinstance(image_url, str) and ("Error:" in image_url or "failed" in image_url.lower()):
-                    logger.debug(f"[Monitor Cycle] Skipping doc {doc_id} - already has error: {image_url[:50]}")
-                    continue
-                
-                # Skip documents that already have a valid image URL
-                is_valid_url = isinstance(image_url, str) and (image_url.startswith("http://") or image_url.startswith("https://"))
-                if is_valid_url:
-                    logger.debug(f"[Monitor Cycle] Skipping doc {doc_id} - already has valid image URL")
-                    continue
-                
-                # Check if concept exists
-                if not has_concept:
-                    logger.debug(f"Story {doc_id} has no concept yet, skipping (waiting for analyzeStorySubmission)")
-                    continue
-                
-                # Process this story (has concept, no valid image yet)
-                logger.info(f"Found story needing image generation: {doc_id}")
-                process_story(doc_id, doc_data)
-                processed_count += 1
+            scheduler.refresh([queued_job(doc) for doc in docs.values()])
+            processed_count = run_scheduled_jobs()
+            logger.info(f"[Monitor Cycle] Scheduler: {json.dumps(scheduler.stats())}")
+            if journal:
+                journal.set_meta("lastCycleAt", datetime.now(timezone.utc).isoformat())
             
             if processed_count > 0:
                 logger.info(f"Processed {processed_count} stories in this cycle")
@@ -539,23 +782,31 @@ def monitor_firestore():
             
             logger.info("=" * 60)
             
-            # Wait before next check
-            time.sleep(30)  # Check every 30 seconds
+            # Poll again right away while there's a backlog
+            if processed_count == 0:
+                time.sleep(30)  # Check every 30 seconds
             
         except KeyboardInterrupt:
             logger.info("Stopping monitor...")
+            writes.close()
             break
         except Exception as e:
             logger.error(f"Error in monitor loop: {e}", exc_info=True)
             time.sleep(60)  # Wait longer on error
 
 if __name__ == "__main__":
+    # Set by launcher.py: pin to this worker's cores and size torch's thread pools to match
+    threads = apply_worker_settings()
+    
     logger.info("=" * 60)
     logger.info("Local Image Generator Service")
     logger.info("=" * 60)
     logger.info(f"Model: {MODEL_ID}")
     logger.info(f"Device: {'CUDA' if torch.cuda.is_available() else 'CPU'}")
+    if WORKER_COUNT > 1 or threads:
+        logger.info(f"Worker: {WORKER_INDEX + 1}/{WORKER_COUNT}, torch threads: {torch.get_num_threads()}")
     logger.info(f"Bucket: {BUCKET_NAME}")
+    logger.info(f"Default preset: {resolve_preset().name}")
     logger.info("=" * 60)
     
     monitor_firestore()
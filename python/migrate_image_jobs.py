@@ -0,0 +1,72 @@
+"""
+One-off migration: give existing stories an imageJob status (see services/job_queue.py), so the
+local generator can query its queue instead of scanning recent stories.
+Run from the python/ folder:
+    python migrate_image_jobs.py --dry-run
+    python migrate_image_jobs.py
+"""
+import argparse
+import logging
+from collections import Counter
+
+from google.cloud import firestore
+
+from services.firestore_client import get_db
+from services.job_queue import DONE, PENDING, PRIORITY_MIGRATED, PRIORITY_RERENDER, legacy_status
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 300  # below Firestore's 500 writes per batch
+
+
+def migrate(db: firestore.Client, dry_run: bool) -> Counter:
+    counts = Counter()
+    stories_ref = db.collection("stories")
+    last = None
+    while True:
+        query = stories_ref.order_by("__name__").limit(PAGE_SIZE)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        if not docs:
+            break
+        batch, writes = db.batch(), 0
+        for doc in docs:
+            story = doc.to_dict() or {}
+            if (story.get("imageJob") or {}).get("status"):
+                counts["already migrated"] += 1
+                continue
+            status = legacy_status(story)
+            if status is None:
+                counts["skipped (no concept)"] += 1
+                continue
+            job = {"status": status, "priority": PRIORITY_MIGRATED, "fullQuality": False, "migrated": True}
+            if status == DONE and story.get("imageRerenderPending"):
+                # Degraded image still waiting for its full-quality re-render
+                status = PENDING
+                job.update(status=PENDING, priority=PRIORITY_RERENDER, fullQuality=True)
+            counts[status] += 1
+            if status == PENDING:
+                # Oldest submissions first among migrated stories
+                job["enqueuedAt"] = story.get("submittedAt") or firestore.SERVER_TIMESTAMP
+            batch.update(doc.reference, {"imageJob": job})
+            writes += 1
+        if writes and not dry_run:
+            batch.commit()
+        last = docs[-1]
+        logger.info(f"Processed {sum(counts.values())} stories so far: {dict(counts)}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add imageJob status to existing stories")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    args = parser.parse_args()
+
+    counts = migrate(get_db(), args.dry_run)
+    logger.info(f"{'Would migrate' if args.dry_run else 'Migrated'}: {dict(counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Backlog-aware admission control: trades steps/resolution for queue latency.
+import os
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Deque, Optional
+
+logger = logging.getLogger("image_admission")
+logger.setLevel(logging.INFO)
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() not in ("0", "false", "no")
+TARGET_P95_SECONDS = float(os.environ.get("ADMISSION_TARGET_P95_SECONDS", "300"))
+REQUEUE_FULL_QUALITY = os.environ.get("ADMISSION_REQUEUE_FULL_QUALITY", "true").lower() not in ("0", "false", "no")
+MIN_STEPS = int(os.environ.get("ADMISSION_MIN_STEPS", "4"))
+
+# Quality ladder, best first: (fraction of preset steps, fraction of requested edge length).
+LEVELS = [
+    (1.0, 1.0),
+    (0.6, 1.0),
+    (0.4, 0.875),
+    (0.3, 0.75),
+]
+
+
+@dataclass
+class AdmissionDecision:
+    level: int
+    steps: int
+    width: int
+    height: int
+    queue_depth: int
+    estimated_seconds: Optional[float]
+    degraded: bool
+    reason: str
+
+    def to_record(self) -> dict:
+        return asdict(self)
+
+
+def _round_dim(value: float) -> int:
+    # UNet needs multiples of 8; stick to 64 so the VAE/attention shapes stay friendly.
+    return max(256, int(round(value / 64.0)) * 64)
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class AdmissionController:
+    """
+    Tracks recent per-step latency and picks the best quality level that keeps the
+    last job in the queue within the target p95 time-to-image.
+    """
+
+    def __init__(self, target_p95_seconds: float = TARGET_P95_SECONDS, window: int = 50,
+                 min_steps: int = MIN_STEPS, enabled: bool = ADMISSION_ENABLED):
+        self.target_p95_seconds = target_p95_seconds
+        self.min_steps = min_steps
+        self.enabled = enabled
+        # Seconds per denoising step per megapixel, most recent samples only.
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, steps: int, width: int, height: int) -> None:
+        """Feed back the wall time of a finished generation."""
+        if steps <= 0 or seconds <= 0:
+            return
+        megapixels = (width * height) / 1_000_000.0
+        with self._lock:
+            self._samples.append(seconds / (steps * megapixels))
+
+    def estimate_seconds(self, steps: int, width: int, height: int) -> Optional[float]:
+        """p95 estimate of one generation at this size, or None before any samples exist."""
+        with self._lock:
+            if not self._samples:
+                return None
+            per_step_mp = _percentile(self._samples, 95)
+        return per_step_mp * steps * (width * height) / 1_000_000.0
+
+    def plan(self, steps: int, width: int, height: int, queue_depth: int) -> AdmissionDecision:
+        """
+        Choose steps/size for the job at the head of a queue of queue_depth jobs
+        (including itself), assuming the rest of the queue is served at the same level.
+        """
+        def decision(level, reason, estimate):
+            step_frac, size_frac = LEVELS[level]
+            return AdmissionDecision(
+                level=level,
+                steps=max(min(self.min_steps, steps), int(round(steps * step_frac))),
+                width=_round_dim(width * size_frac) if size_frac < 1.0 else width,
+                height=_round_dim(height * size_frac) if size_frac < 1.0 else height,
+                queue_depth=queue_depth,
+                estimated_seconds=estimate,
+                degraded=level > 0,
+                reason=reason,
+            )
+
+        if not self.enabled:
+            return decision(0, "admission control disabled", None)
+        if self.estimate_seconds(steps, width, height) is None:
+            return decision(0, "no latency samples yet", None)
+
+        depth = max(1, queue_depth)
+        estimate = None
+        for level in range(len(LEVELS)):
+            candidate = decision(level, "", None)
+            estimate = depth * self.estimate_seconds(candidate.steps, candidate.width, candidate.height)
+            if estimate <= self.target_p95_seconds:
+                reason = "within target" if level == 0 else f"backlog of {depth} exceeds target at full quality"
+                return decision(level, reason, round(estimate, 1))
+
+        last = len(LEVELS) - 1
+        logger.warning("Backlog of %d cannot meet %.0fs target even at lowest quality (est. %.0fs)",
+                       depth, self.target_p95_seconds, estimate)
+        return decision(last, f"backlog of {depth} exceeds target at every level", round(estimate, 1))
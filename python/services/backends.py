@@ -0,0 +1,204 @@
+# Generation backends (local diffusers pipeline, Hugging Face Inference API) and their registry.
+import os
+import json
+import logging
+import threading
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+import torch
+from PIL import Image
+
+from .callbacks import compose_step_callbacks
+from .deadline import Deadline
+from .memory import MemoryPlan, apply_memory_plan
+from .pipeline import HF_TOKEN, MODEL_ID, get_pipeline, pool, resolve_device_dtype
+from .presets import Preset, apply_preset, without_lora
+from .rate_limit import get_rate_limiter
+
+logger = logging.getLogger("image_backends")
+logger.setLevel(logging.INFO)
+
+IMAGE_BACKEND = os.environ.get("IMAGE_BACKEND", "diffusers")
+# Used when the local model can't be loaded (not enough RAM); empty disables the fallback.
+IMAGE_BACKEND_FALLBACK = os.environ.get("IMAGE_BACKEND_FALLBACK", "hf_api")
+HF_API_TIMEOUT = float(os.environ.get("HF_API_TIMEOUT", "300"))
+
+_hf_token_provider: Callable[[], Optional[str]] = lambda: HF_TOKEN
+
+
+def set_hf_token_provider(provider: Callable[[], Optional[str]]) -> None:
+    """Override where the HF token comes from (e.g. a Firebase Secret in Cloud Functions)."""
+    global _hf_token_provider
+    _hf_token_provider = provider
+
+
+def make_generators(seeds: Sequence[Optional[int]], device) -> List[torch.Generator]:
+    """One generator per item, so a seeded item renders identically alone or in a batch."""
+    gen_device = device if isinstance(device, torch.device) else torch.device(device)
+    generators = []
+    for seed in seeds:
+        generator = torch.Generator(device=gen_device)
+        if seed is not None:
+            generator.manual_seed(int(seed))
+        else:
+            generator.seed()
+        generators.append(generator)
+    return generators
+
+
+class DiffusersBackend:
+    """Local StableDiffusionPipeline (cached per model/dtype/device by services.pipeline)."""
+
+    name = "diffusers"
+
+    def __init__(self, model_id: Optional[str] = None, device: Optional[str] = None,
+                 dtype: Optional[torch.dtype] = None):
+        self.model_id = model_id or MODEL_ID
+        self.device, self.dtype = resolve_device_dtype(device, dtype)
+
+    @property
+    def pipeline(self):
+        return get_pipeline(self.model_id, self.device, self.dtype, _hf_token_provider())
+
+    def generate(self, prompts: Sequence[str], seeds: Sequence[Optional[int]], preset: Preset,
+                 width: int, height: int, num_steps: Optional[int] = None,
+                 guidance_scale: Optional[float] = None, callback_on_step_end=None,
+                 memory_plan: Optional[MemoryPlan] = None,
+                 deadline: Optional[Deadline] = None) -> Tuple[List[Image.Image], Preset]:
+        if deadline is not None:
+            deadline.check("pipeline load")
+        pipe = self.pipeline
+        # With INFERENCE_SLOTS > 1, calls on different models overlap; calls on this one take turns
+        with pool.render_lock(self.model_id, self.device, self.dtype):
+            applied = apply_preset(pipe, preset)
+            if memory_plan is not None:
+                apply_memory_plan(pipe, memory_plan)
+
+            device = next(pipe.unet.parameters()).device
+            call_kwargs = dict(
+                height=height,
+                width=width,
+                num_inference_steps=int(num_steps or applied.steps),
+                guidance_scale=float(guidance_scale if guidance_scale is not None else applied.guidance_scale),
+                generator=make_generators(seeds, device),
+                # The deadline is checked between steps; raising there aborts the run
+                callback_on_step_end=compose_step_callbacks(
+                    deadline.step_callback if deadline is not None else None, callback_on_step_end
+                ),
+            )
+            with torch.no_grad():
+                if str(device).startswith("cuda") and pipe.dtype == torch.float16:
+                    with torch.cuda.amp.autocast():
+                        result = pipe(list(prompts), **call_kwargs)
+                else:
+                    result = pipe(list(prompts), **call_kwargs)
+        return list(result.images), applied
+
+
+class HfApiBackend:
+    """Hugging Face Inference API: no local model, one HTTP request per prompt."""
+
+    name = "hf_api"
+
+    def __init__(self, model_id: Optional[str] = None, timeout: float = HF_API_TIMEOUT):
+        self.model_id = model_id or MODEL_ID
+        self.timeout = timeout
+
+    def generate(self, prompts: Sequence[str], seeds: Sequence[Optional[int]], preset: Preset,
+                 width: int, height: int, num_steps: Optional[int] = None,
+                 guidance_scale: Optional[float] = None, callback_on_step_end=None,
+                 memory_plan: Optional[MemoryPlan] = None,
+                 deadline: Optional[Deadline] = None) -> Tuple[List[Image.Image], Preset]:
+        # The API can't load LoRAs or pick a scheduler; step callbacks and memory plans don't apply
+        applied = without_lora(preset)
+        steps = int(num_steps or applied.steps)
+        guidance = float(guidance_scale if guidance_scale is not None else applied.guidance_scale)
+        images = [self._request(prompt, seed, width, height, steps, guidance, deadline) for prompt, seed in zip(prompts, seeds)]
+        return images, applied
+
+    def _request(self, prompt: str, seed: Optional[int], width: int, height: int,
+                 steps: int, guidance: float, deadline: Optional[Deadline] = None) -> Image.Image:
+        token = _hf_token_provider()
+        if not token:
+            raise ValueError("HF_API_TOKEN is required for the HF API backend")
+
+        parameters = {"num_inference_steps": steps, "guidance_scale": guidance, "width": width, "height": height}
+        if seed is not None:
+            parameters["seed"] = int(seed)
+        # Wait for a token (RATE_LIMITS) rather than bursting into 429s; the wait comes out of the deadline
+        wait = deadline.timeout(self.timeout, "HF API rate limit") if deadline is not None else self.timeout
+        get_rate_limiter().acquire(self.name, self.model_id, timeout=wait)
+        # The request gets whatever is left of the job's deadline (at most HF_API_TIMEOUT)
+        timeout = deadline.timeout(self.timeout, "HF API request") if deadline is not None else self.timeout
+        logger.info("Generating image via HF API: %d chars, %dx%d, %d steps", len(prompt), width, height, steps)
+        try:
+            response = requests.post(
+                f"https://api-inference.huggingface.co/models/{self.model_id}",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"inputs": prompt, "parameters": parameters, "options": {"wait_for_model": True}},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+        except requests.exceptions.Timeout:
+            if deadline is not None:
+                deadline.check("HF API request")
+            raise RuntimeError(f"Hugging Face API request timed out after {timeout:.0f}s")
+        except requests.exceptions.RequestException as exc:
+            raise RuntimeError(f"HF API request failed: {exc}") from exc
+
+        try:
+            return Image.open(BytesIO(response.content))
+        except Exception:
+            # Not an image: probably a JSON error body
+            try:
+                error = response.json()
+                raise RuntimeError(f"Hugging Face API error: {error.get('error', error)}")
+            except json.JSONDecodeError:
+                raise RuntimeError(f"Unexpected response from HF API: {response.text[:500]}")
+
+
+_BACKENDS: Dict[str, Callable[..., object]] = {
+    DiffusersBackend.name: DiffusersBackend,
+    HfApiBackend.name: HfApiBackend,
+}
+_instances: Dict[Tuple[str, str], object] = {}
+_failed_local: Dict[str, str] = {}  # model_id -> reason the local backend was abandoned
+_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[..., object]) -> None:
+    """Register a backend factory: factory(model_id=...) -> object with .name and .generate(...)."""
+    _BACKENDS[name] = factory
+
+
+def get_backend(name: Optional[str] = None, model_id: Optional[str] = None):
+    """Backend instance by name (default IMAGE_BACKEND), cached per model."""
+    name = name or IMAGE_BACKEND
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown image backend '{name}' (expected one of: {', '.join(_BACKENDS)})")
+    key = (name, model_id or MODEL_ID)
+    with _lock:
+        if key not in _instances:
+            _instances[key] = _BACKENDS[name](model_id=model_id)
+        return _instances[key]
+
+
+def active_backend(name: Optional[str] = None, model_id: Optional[str] = None):
+    """
+    The backend to use right now. The local diffusers backend is loaded eagerly here; if the
+    model doesn't fit in memory, IMAGE_BACKEND_FALLBACK is used for this model from then on.
+    """
+    backend = get_backend(name, model_id)
+    if backend.name != DiffusersBackend.name or not IMAGE_BACKEND_FALLBACK:
+        return backend
+    if backend.model_id in _failed_local:
+        return get_backend(IMAGE_BACKEND_FALLBACK, model_id)
+    try:
+        backend.pipeline
+        return backend
+    except MemoryError as exc:
+        logger.error("Not enough RAM to load '%s' locally; falling back to '%s' backend", backend.model_id, IMAGE_BACKEND_FALLBACK)
+        _failed_local[backend.model_id] = str(exc) or "MemoryError"
+        return get_backend(IMAGE_BACKEND_FALLBACK, model_id)
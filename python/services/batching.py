@@ -0,0 +1,125 @@
+# Dynamic micro-batching: group compatible concurrent requests into one pipeline call.
+import os
+import time
+import asyncio
+import bisect
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+from .executor import InferenceExecutor, QueueFull
+
+logger = logging.getLogger("image_batching")
+logger.setLevel(logging.INFO)
+
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "50"))
+BATCH_MAX_PENDING = int(os.environ.get("BATCH_MAX_PENDING", "32"))
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus-style) with count and sum."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last bucket is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative, running = {}, 0
+            for bound, count in zip(self.buckets + [float("inf")], self._counts):
+                running += count
+                cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+            return {"buckets": cumulative, "count": running, "sum": round(self._sum, 4)}
+
+
+class BatchScheduler:
+    """
+    Collects submissions for up to max_wait_ms or max_batch items per compatibility key
+    (e.g. size/steps/preset), then runs run_batch(key, items) -> results on the inference
+    executor and resolves each submitter's future with its own result.
+    """
+
+    def __init__(self, run_batch: Callable[[Hashable, List[Any]], List[Any]], executor: InferenceExecutor,
+                 max_batch: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 max_pending: int = BATCH_MAX_PENDING):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_pending = max_pending
+        self._groups: Dict[Hashable, List[Tuple[Any, asyncio.Future, float]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._pending = 0
+        self.batch_size = Histogram([1, 2, 3, 4, 6, 8, 12, 16])
+        self.queue_wait = Histogram([0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120])
+
+    @property
+    def full(self) -> bool:
+        return self._pending >= self.max_pending
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Queue item under key and wait for its result. Raises QueueFull when saturated."""
+        if self.full:
+            raise QueueFull(self.executor.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._groups.setdefault(key, [])
+        group.append((item, future, time.monotonic()))
+        self._pending += 1
+
+        if len(group) >= self.max_batch:
+            self._dispatch(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._dispatch, key)
+        return await future
+
+    def _dispatch(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._groups.pop(key, [])
+        if group:
+            asyncio.ensure_future(self._run(key, group))
+
+    async def _run(self, key: Hashable, group: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        dispatched = time.monotonic()
+        self.batch_size.observe(len(group))
+        try:
+            # Queue wait covers batching delay plus time waiting for a free inference slot
+            def _timed_batch(items):
+                started = time.monotonic()
+                for _, _, enqueued in group:
+                    self.queue_wait.observe(started - enqueued)
+                return self.run_batch(key, items)
+
+            results = await self.executor.run(_timed_batch, [item for item, _, _ in group])
+            if len(results) != len(group):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(group)} requests")
+            for (_, future, _), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+            logger.info("Ran batch of %d in %.2fs", len(group), time.monotonic() - dispatched)
+        except Exception as exc:
+            for _, future, _ in group:
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            self._pending -= len(group)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "maxBatch": self.max_batch,
+            "maxWaitMs": self.max_wait * 1000.0,
+            "batchSize": self.batch_size.snapshot(),
+            "queueWaitSeconds": self.queue_wait.snapshot(),
+        }
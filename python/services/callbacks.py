@@ -0,0 +1,25 @@
+# Helpers for diffusers' callback_on_step_end hook.
+from typing import Callable, Optional
+
+StepCallback = Callable[[object, int, object, dict], dict]
+
+
+def compose_step_callbacks(*callbacks: Optional[StepCallback]) -> Optional[StepCallback]:
+    """
+    Chain several callback_on_step_end callbacks into one (diffusers accepts a single callable).
+    None entries are ignored; returns None when nothing is left so the pipeline skips the hook.
+    """
+    active = [cb for cb in callbacks if cb is not None]
+    if not active:
+        return None
+    if len(active) == 1:
+        return active[0]
+
+    def _chained(pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        for cb in active:
+            result = cb(pipe, step, timestep, callback_kwargs)
+            if result is not None:
+                callback_kwargs = result
+        return callback_kwargs
+
+    return _chained
@@ -0,0 +1,58 @@
+# Per-job deadlines and cooperative cancellation, checked between denoising steps and before API calls.
+import os
+import time
+import threading
+from typing import Optional
+
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", "600"))
+
+
+class JobCancelled(RuntimeError):
+    """A job was cancelled cooperatively; reason says why (recorded on the job)."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Cancelled: {reason}")
+        self.reason = reason
+
+
+class DeadlineExceeded(JobCancelled):
+    pass
+
+
+class Deadline:
+    """
+    A job's time budget plus a cancel flag. check() raises once either trips; timeout() gives
+    downstream calls (HTTP requests) whatever is left, capped at their own limit.
+    """
+
+    def __init__(self, seconds: float = JOB_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self._reason: Optional[str] = None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def cancel(self, reason: str) -> None:
+        """Request cancellation from another thread; takes effect at the job's next check()."""
+        self._reason = reason
+        self._cancelled.set()
+
+    def check(self, stage: str = "") -> None:
+        if self._cancelled.is_set():
+            raise JobCancelled(self._reason or "cancelled")
+        if self.remaining() <= 0:
+            where = f" during {stage}" if stage else ""
+            raise DeadlineExceeded(f"deadline of {self.seconds:.0f}s exceeded{where}")
+
+    def timeout(self, cap: Optional[float] = None, stage: str = "") -> float:
+        """Seconds a blocking call may take: the remaining budget, at most cap. Raises if none is left."""
+        self.check(stage)
+        remaining = self.remaining()
+        return min(cap, remaining) if cap is not None else remaining
+
+    def step_callback(self, pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        """callback_on_step_end hook: aborts the pipeline call between steps once the job is cancelled."""
+        self.check(f"denoising step {step + 1}")
+        return callback_kwargs
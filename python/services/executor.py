@@ -0,0 +1,93 @@
+# Bounded executor for blocking inference calls, so async servers never run them on the event loop.
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque
+
+logger = logging.getLogger("image_executor")
+logger.setLevel(logging.INFO)
+
+# Concurrent inference calls. Each pooled pipeline still runs one call at a time (PipelinePool.render_lock),
+# so more than 1 only helps when requests use different models.
+INFERENCE_SLOTS = int(os.environ.get("INFERENCE_SLOTS", "1"))
+INFERENCE_MAX_QUEUE = int(os.environ.get("INFERENCE_MAX_QUEUE", "8"))
+
+
+class QueueFull(RuntimeError):
+    """Raised by submit() when every slot is busy and the wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Runs blocking inference on a fixed number of worker threads ("slots") with a bounded
+    wait queue. Submissions beyond slots + max_queue are rejected with QueueFull carrying a
+    Retry-After estimate based on recent job durations.
+    """
+
+    def __init__(self, slots: int = INFERENCE_SLOTS, max_queue: int = INFERENCE_MAX_QUEUE):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._pending = 0  # running + waiting
+        self._running = 0
+        self._rejected = 0
+        self._durations: Deque[float] = deque(maxlen=20)
+
+    def retry_after(self) -> int:
+        """Seconds until a queue position is likely to free up."""
+        with self._lock:
+            mean = sum(self._durations) / len(self._durations) if self._durations else 30.0
+            waiting = max(0, self._pending - self.slots)
+        return max(1, math.ceil(mean * (waiting // self.slots + 1)))
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._pending >= self.slots + self.max_queue:
+                self._rejected += 1
+                full = True
+            else:
+                self._pending += 1
+                full = False
+        if full:
+            raise QueueFull(self.retry_after())
+
+        def _run():
+            with self._lock:
+                self._running += 1
+            started = time.monotonic()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._durations.append(time.monotonic() - started)
+
+        return self._pool.submit(_run)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Await fn(*args, **kwargs) on an inference slot; raises QueueFull immediately if full."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "maxQueue": self.max_queue,
+                "running": self._running,
+                "waiting": self._pending - self._running,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
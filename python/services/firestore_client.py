@@ -0,0 +1,18 @@
+# Firestore client for the standalone tools (migration, benchmarks), using the same credentials lookup as the worker.
+import os
+
+from google.cloud import firestore
+
+PROJECT_ID = "systemicshiftv2"
+
+
+def get_db() -> firestore.Client:
+    """Firestore client from GOOGLE_APPLICATION_CREDENTIALS, python/firebase-key.json, or default credentials."""
+    key = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY")
+    if not key or not os.path.exists(key):
+        default_key = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "firebase-key.json")
+        key = default_key if os.path.exists(default_key) else None
+    if key:
+        from google.oauth2 import service_account
+        return firestore.Client(project=PROJECT_ID, credentials=service_account.Credentials.from_service_account_file(key))
+    return firestore.Client(project=PROJECT_ID)
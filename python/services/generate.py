@@ -1,68 +1,123 @@
-# Minimal generate wrapper: returns PNG bytes.
+# Generate wrappers over the backend registry: PIL images or PNG bytes.
 import io
 import logging
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple, Union
 
-import torch
 from PIL import Image
 
-from .pipeline import get_pipeline
+from .backends import active_backend
+from .deadline import Deadline, JobCancelled
+from .memory import MemoryPlan
+from .pipeline import resolve_model
+from .presets import Preset, resolve_preset
+from .safety import get_safety_stage
 
 logger = logging.getLogger("image_generate")
 logger.setLevel(logging.INFO)
 
-def generate_image_bytes(
-    prompt: str,
-    seed: Optional[int] = None,
-    guidance_scale: float = 7.5,
-    num_inference_steps: int = 25,
+def generate_images(
+    prompts: Sequence[str],
+    seeds: Optional[Sequence[Optional[int]]] = None,
+    guidance_scale: Optional[float] = None,
+    num_inference_steps: Optional[int] = None,
     width: int = 512,
     height: int = 512,
-) -> bytes:
-    if not prompt:
+    preset: Union[str, Preset, None] = None,
+    callback_on_step_end=None,
+    memory_plan: Optional[MemoryPlan] = None,
+    model_id: Optional[str] = None,
+    backend: Optional[str] = None,
+    check_safety: bool = True,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[Image.Image], Preset]:
+    """
+    Single entry point for every caller: runs prompts sharing size/steps/guidance as one batch
+    on the active backend (local diffusers, or the HF API fallback) and returns the images and
+    the preset actually applied. Explicit step/guidance values override the preset's defaults.
+    Each prompt gets its own generator, so a seeded item renders the same image alone or batched.
+    model_id picks a model from IMAGE_MODELS (default SD_MODEL_ID); pipelines are pooled per model.
+    check_safety=False skips the safety stage, for callers that run it themselves off the inference thread.
+    deadline is checked between denoising steps and bounds HF API calls; JobCancelled propagates unchanged.
+    """
+    if not prompts or any(not p for p in prompts):
         raise ValueError("prompt must be a non-empty string")
+    seeds = list(seeds) if seeds is not None else [None] * len(prompts)
+    if len(seeds) != len(prompts):
+        raise ValueError("seeds must match prompts in length")
+    if not isinstance(preset, Preset):
+        preset = resolve_preset(preset)
 
-    pipe = get_pipeline()
-
-    # Determine device/dtype
-    device = next(pipe.unet.parameters()).device if hasattr(pipe, "unet") else ("cuda" if torch.cuda.is_available() else "cpu")
-    is_cuda = str(device).startswith("cuda")
-    use_fp16 = getattr(pipe, "dtype", None) == torch.float16
-
-    generator = None
-    if seed is not None:
-        gen_device = device if isinstance(device, torch.device) else torch.device(device)
-        generator = torch.Generator(device=gen_device).manual_seed(int(seed))
-
+    engine = active_backend(backend, resolve_model(model_id))
     try:
-        with torch.no_grad():
-            if is_cuda and use_fp16:
-                with torch.cuda.amp.autocast():
-                    result = pipe(
-                        prompt,
-                        height=height,
-                        width=width,
-                        num_inference_steps=int(num_inference_steps),
-                        guidance_scale=float(guidance_scale),
-                        generator=generator,
-                    )
-            else:
-                result = pipe(
-                    prompt,
-                    height=height,
-                    width=width,
-                    num_inference_steps=int(num_inference_steps),
-                    guidance_scale=float(guidance_scale),
-                    generator=generator,
-                )
+        images, applied = engine.generate(
+            prompts, seeds, preset, width, height,
+            num_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            callback_on_step_end=callback_on_step_end,
+            memory_plan=memory_plan,
+            deadline=deadline,
+        )
+    except JobCancelled:
+        raise
     except Exception as exc:
-        logger.exception("Pipeline inference failed")
+        logger.exception("Image generation failed (%s backend)", engine.name)
         raise RuntimeError(f"Image generation failed: {exc}") from exc
 
-    if not hasattr(result, "images") or not result.images:
+    if len(images) != len(prompts):
         raise RuntimeError("Pipeline returned no images")
+    if check_safety:
+        images, _, _ = get_safety_stage().check(images)
+    return images, applied
 
-    image: Image.Image = result.images[0]
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    return buf.getvalue()
\ No newline at end of file
+def generate_images_batch(
+    prompts: List[str],
+    seeds: Optional[List[Optional[int]]] = None,
+    guidance_scale: Optional[float] = None,
+    num_inference_steps: Optional[int] = None,
+    width: int = 512,
+    height: int = 512,
+    preset: Optional[str] = None,
+    callback_on_step_end=None,
+    model_id: Optional[str] = None,
+) -> Tuple[List[bytes], Preset]:
+    """generate_images, returning PNG bytes."""
+    images, applied = generate_images(
+        prompts, seeds, guidance_scale, num_inference_steps, width, height, preset,
+        callback_on_step_end=callback_on_step_end,
+        model_id=model_id,
+    )
+    pngs = []
+    for image in images:
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        pngs.append(buf.getvalue())
+    return pngs, applied
+
+def generate_image_bytes(
+    prompt: str,
+    seed: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    num_inference_steps: Optional[int] = None,
+    width: int = 512,
+    height: int = 512,
+    preset: Optional[str] = None,
+) -> bytes:
+    png, _ = generate_image_bytes_with_preset(
+        prompt, seed, guidance_scale, num_inference_steps, width, height, preset
+    )
+    return png
+
+def generate_image_bytes_with_preset(
+    prompt: str,
+    seed: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    num_inference_steps: Optional[int] = None,
+    width: int = 512,
+    height: int = 512,
+    preset: Optional[str] = None,
+) -> Tuple[bytes, Preset]:
+    """Like generate_image_bytes, but also returns the preset that was actually applied."""
+    pngs, applied = generate_images_batch(
+        [prompt], [seed], guidance_scale, num_inference_steps, width, height, preset
+    )
+    return pngs[0], applied
@@ -0,0 +1,63 @@
+# Local content-addressed image store: files are named by the SHA-256 of their bytes.
+import os
+import re
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger("image_store")
+logger.setLevel(logging.INFO)
+
+IMAGE_STORE_DIR = os.environ.get(
+    "IMAGE_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".image_store"),
+)
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_sha256(value: str) -> bool:
+    return bool(_SHA256_RE.match(value or ""))
+
+
+class ImageStore:
+    """
+    Write-once store keyed by content hash. Objects are immutable, so they can be cached
+    forever by clients/CDNs; writes are atomic (temp file + rename) and idempotent.
+    """
+
+    def __init__(self, root: str = IMAGE_STORE_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        if not is_sha256(digest):
+            raise ValueError("not a sha256 hex digest")
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """Store data and return its sha256 hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest
+
+    def get_path(self, digest: str) -> Optional[str]:
+        """Path of a stored object, or None if it isn't there (or digest is malformed)."""
+        if not is_sha256(digest):
+            return None
+        path = self.path_for(digest)
+        return path if os.path.exists(path) else None
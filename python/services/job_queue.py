@@ -0,0 +1,99 @@
+# Story image work queue: the imageJob state machine stored on each story document.
+#
+#   pending --claim--> claimed --+--> done
+#      ^  ^                      +--> failed      (permanent error, or out of attempts)
+#      |  +---- lease expired ---+
+#      |                         +--> retry       (transient error; see services/retry.py)
+#      +------ retryAt passed ---------+
+#
+# Workers query `imageJob.status == "pending"` ordered by priority (see firestore.indexes.json).
+# Each claim counts in imageJob.attemptCount; failed attempts are listed in imageJob.attempts.
+import os
+from typing import List, Optional
+
+PENDING, CLAIMED, DONE, FAILED, RETRY = "pending", "claimed", "done", "failed", "retry"
+STATUSES = (PENDING, CLAIMED, DONE, FAILED, RETRY)
+
+# Higher runs first; ties run oldest-first (imageJob.enqueuedAt)
+PRIORITY_INTERACTIVE = 100  # new submissions and manual triggers (set in functions/index.js)
+PRIORITY_MIGRATED = 50      # stories queued by migrate_image_jobs.py
+PRIORITY_BACKFILL = 30      # historical stories regenerated by backfill.py
+PRIORITY_RERENDER = 10      # full-quality re-renders of degraded images
+
+QUEUE_FETCH_LIMIT = int(os.environ.get("QUEUE_FETCH_LIMIT", "20"))
+
+# Field masks: stories also hold large AI-generated text (write-ups, concepts) that scheduling never reads
+QUEUE_FIELDS = ["imageJob"]
+STORY_FIELDS = ["aiInfographicConcept", "nonShiftTitle", "storyTitle", "imagePreset", "imageModel", "imageHighRes"]
+
+
+def pending_query(stories_ref, limit: int = QUEUE_FETCH_LIMIT, fields: Optional[List[str]] = QUEUE_FIELDS):
+    """Highest-priority pending stories (composite index: status, priority desc, enqueuedAt), masked to fields."""
+    from google.cloud import firestore
+
+    query = stories_ref.where("imageJob.status", "==", PENDING) \
+                       .order_by("imageJob.priority", direction=firestore.Query.DESCENDING) \
+                       .order_by("imageJob.enqueuedAt")
+    if fields is not None:
+        query = query.select(fields)
+    return query.limit(limit)
+
+
+def oldest_pending_query(stories_ref, limit: int = QUEUE_FETCH_LIMIT):
+    """Longest-waiting pending stories regardless of priority (composite index: status, enqueuedAt), for ageing."""
+    return stories_ref.where("imageJob.status", "==", PENDING) \
+                      .order_by("imageJob.enqueuedAt") \
+                      .select(QUEUE_FIELDS) \
+                      .limit(limit)
+
+
+def expired_leases_query(stories_ref, now, limit: int = QUEUE_FETCH_LIMIT):
+    """Claimed stories whose worker died or stalled past its lease (composite index: status, leaseExpiresAt)."""
+    return stories_ref.where("imageJob.status", "==", CLAIMED) \
+                      .where("imageJob.leaseExpiresAt", "<", now) \
+                      .select(QUEUE_FIELDS) \
+                      .limit(limit)
+
+
+def due_retries_query(stories_ref, now, limit: int = QUEUE_FETCH_LIMIT):
+    """Failed stories whose backoff has elapsed (composite index: status, retryAt)."""
+    return stories_ref.where("imageJob.status", "==", RETRY) \
+                      .where("imageJob.retryAt", "<=", now) \
+                      .select(QUEUE_FIELDS) \
+                      .limit(limit)
+
+
+def enqueue_fields(priority: int, full_quality: bool = False, reset_attempts: bool = True) -> dict:
+    """
+    Update fields that (re)queue a story. A fresh request starts a new attempt budget; re-queueing
+    the same job (expired lease, due retry) keeps counting against it.
+    """
+    from google.cloud import firestore
+
+    fields = {
+        "imageJob.status": PENDING,
+        "imageJob.priority": priority,
+        "imageJob.enqueuedAt": firestore.SERVER_TIMESTAMP,
+        "imageJob.fullQuality": full_quality,
+        "imageJob.leaseExpiresAt": None,
+        "imageJob.retryAt": None,
+        "imageJob.worker": None,
+    }
+    if reset_attempts:
+        fields["imageJob.attemptCount"] = 0
+    return fields
+
+
+def legacy_status(story: dict) -> Optional[str]:
+    """
+    Status for a story written before imageJob existed, from the fields the old scan inspected;
+    None when there's nothing to queue (no concept yet).
+    """
+    image_url = story.get("aiGeneratedImageUrl")
+    if isinstance(image_url, str) and image_url.startswith(("http://", "https://")):
+        return DONE
+    if isinstance(image_url, str) and ("Error:" in image_url or "failed" in image_url.lower()):
+        return FAILED
+    if not story.get("aiInfographicConcept"):
+        return None
+    return PENDING
@@ -0,0 +1,196 @@
+# In-memory job registry with progress events, for streaming (SSE) and reconnectable job status.
+import os
+import time
+import uuid
+import json
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger("image_jobs")
+logger.setLevel(logging.INFO)
+
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", "3600"))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+
+TERMINAL = ("done", "failed")
+
+
+class Job:
+    def __init__(self, job_id: str, params: dict):
+        self.id = job_id
+        self.params = params
+        self.status = "queued"  # queued -> running -> done | failed
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.step = 0
+        self.total_steps: Optional[int] = None
+        self.queue_position: Optional[int] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "step": self.step,
+            "totalSteps": self.total_steps,
+            "queuePosition": self.queue_position,
+            "result": self.result,
+            "error": self.error,
+            "createdAt": self.created,
+            "finishedAt": self.finished,
+        }
+
+
+class JobRegistry:
+    """
+    Tracks jobs and fans their events out to any number of listeners.
+    Update methods may be called from any thread (inference threads report progress): every
+    change to a job and its events is applied on the event loop, in call order, so jobs are only
+    ever mutated and read there. Listeners are async generators.
+    """
+
+    def __init__(self, ttl_seconds: float = JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._listeners: Dict[str, List[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """The loop that owns job state (the app's loop, bound at startup; create() binds it too)."""
+        self._loop = loop
+
+    def create(self, params: dict) -> Job:
+        self._loop = asyncio.get_running_loop()
+        self._evict_expired()
+        job = Job(uuid.uuid4().hex, params)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._refresh_queue_positions()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # --- updates (safe to call from any thread) ---
+
+    def mark_running(self, job: Job, total_steps: Optional[int] = None) -> None:
+        self._on_loop(self._mark_running, job, total_steps)
+
+    def progress(self, job: Job, step: int, total_steps: int) -> None:
+        self._on_loop(self._progress, job, step, total_steps)
+
+    def finish(self, job: Job, result: dict) -> None:
+        self._on_loop(self._finish, job, result)
+
+    def fail(self, job: Job, error: str) -> None:
+        self._on_loop(self._fail, job, error)
+
+    def shutdown(self, reason: str = "Server shutting down") -> None:
+        """Fail every unfinished job so clients polling or streaming it get a final answer."""
+        with self._lock:
+            unfinished = [job for job in self._jobs.values() if job.status not in TERMINAL]
+        for job in unfinished:
+            self.fail(job, reason)
+
+    # --- listening ---
+
+    async def events(self, job_id: str) -> AsyncIterator[str]:
+        """Server-sent events for a job: current state first, then updates until it finishes."""
+        job = self.get(job_id)
+        if job is None:
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._listeners.setdefault(job_id, []).append(queue)
+        try:
+            yield _sse("status", job.snapshot())
+            if job.status in TERMINAL:
+                yield _sse(job.status, job.snapshot())
+                return
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(event, data)
+                if event in TERMINAL:
+                    return
+        finally:
+            with self._lock:
+                listeners = self._listeners.get(job_id, [])
+                if queue in listeners:
+                    listeners.remove(queue)
+
+    # --- internals (run on the loop) ---
+
+    def _on_loop(self, fn, *args) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            fn(*args)
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+        else:
+            loop.call_soon_threadsafe(fn, *args)
+
+    def _mark_running(self, job: Job, total_steps: Optional[int]) -> None:
+        job.status, job.total_steps, job.queue_position = "running", total_steps, None
+        self._emit(job, "status")
+        self._refresh_queue_positions()
+
+    def _progress(self, job: Job, step: int, total_steps: int) -> None:
+        if job.status in TERMINAL:
+            return  # a late step report after the job was failed
+        job.step, job.total_steps = step, total_steps
+        self._emit(job, "progress")
+
+    def _finish(self, job: Job, result: dict) -> None:
+        if job.status in TERMINAL:
+            return
+        job.status, job.result, job.finished = "done", result, time.time()
+        self._emit(job, "done")
+        self._refresh_queue_positions()
+
+    def _fail(self, job: Job, error: str) -> None:
+        if job.status in TERMINAL:
+            return
+        job.status, job.error, job.finished = "failed", error, time.time()
+        self._emit(job, "failed")
+        self._refresh_queue_positions()
+
+    def _emit(self, job: Job, event: str) -> None:
+        data = job.snapshot()
+        with self._lock:
+            queues = list(self._listeners.get(job.id, []))
+        for queue in queues:
+            queue.put_nowait((event, data))
+
+    def _refresh_queue_positions(self) -> None:
+        with self._lock:
+            queued = sorted((j for j in self._jobs.values() if j.status == "queued"), key=lambda j: j.created)
+        for position, job in enumerate(queued, start=1):
+            if job.queue_position != position:
+                job.queue_position = position
+                self._emit(job, "queue")
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [jid for jid, j in self._jobs.items() if j.finished is not None and j.finished < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+                self._listeners.pop(jid, None)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
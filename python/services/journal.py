@@ -0,0 +1,161 @@
+# Local job journal (SQLite, WAL): what this worker accepted, is running, and finished but hasn't
+# confirmed writing to Firestore, so a restarted worker can pick up exactly where it stopped.
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+logger = logging.getLogger("image_journal")
+logger.setLevel(logging.INFO)
+
+JOB_JOURNAL_ENABLED = os.environ.get("JOB_JOURNAL", "true").lower() not in ("0", "false", "no", "off")
+JOB_JOURNAL_DIR = os.environ.get("JOB_JOURNAL_DIR",
+                                 os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".job_journal"))
+JOB_JOURNAL_RETENTION_DAYS = float(os.environ.get("JOB_JOURNAL_RETENTION_DAYS", "7"))
+
+# accepted: picked by the scheduler; running: claimed (leased) by this worker;
+# finished: outcome known, Firestore write not yet confirmed; written: confirmed
+ACCEPTED, RUNNING, FINISHED, WRITTEN = "accepted", "running", "finished", "written"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    doc_id      TEXT PRIMARY KEY,
+    state       TEXT NOT NULL,
+    job_class   TEXT,
+    worker_id   TEXT,
+    outcome     TEXT,
+    fields      TEXT,
+    accepted_at REAL,
+    started_at  REAL,
+    finished_at REAL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _encode(value):
+    """json default= for Firestore update values: datetimes and the server-timestamp sentinel."""
+    from google.cloud import firestore
+
+    if value is firestore.SERVER_TIMESTAMP:
+        return {"$serverTimestamp": True}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Can't journal a {type(value).__name__}")
+
+
+def _decode(obj: dict):
+    from google.cloud import firestore
+
+    if obj.get("$serverTimestamp"):
+        return firestore.SERVER_TIMESTAMP
+    if "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+class JobJournal:
+    """
+    One SQLite file per worker. Every transition is its own small transaction; WAL mode with
+    synchronous=NORMAL keeps those cheap and survives the process dying at any point (only an
+    OS crash can lose the last few).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.prune(JOB_JOURNAL_RETENTION_DAYS * 86400)
+
+    def accept(self, doc_id: str, job_class: Optional[str] = None) -> None:
+        now = time.time()
+        self._execute("INSERT INTO jobs (doc_id, state, job_class, accepted_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT(doc_id) DO UPDATE SET state = excluded.state, job_class = excluded.job_class, "
+                      "worker_id = NULL, outcome = NULL, fields = NULL, accepted_at = excluded.accepted_at, "
+                      "started_at = NULL, finished_at = NULL, updated_at = excluded.updated_at",
+                      (doc_id, ACCEPTED, job_class, now, now))
+
+    def start(self, doc_id: str, worker_id: str) -> None:
+        now = time.time()
+        self._execute("INSERT INTO jobs (doc_id, state, worker_id, accepted_at, started_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                      "ON CONFLICT(doc_id) DO UPDATE SET state = excluded.state, worker_id = excluded.worker_id, "
+                      "outcome = NULL, fields = NULL, started_at = excluded.started_at, finished_at = NULL, "
+                      "updated_at = excluded.updated_at",
+                      (doc_id, RUNNING, worker_id, now, now, now))
+
+    def finish(self, doc_id: str, outcome: str, fields: dict) -> None:
+        """Record the outcome and the Firestore update that carries it, until written() confirms it."""
+        now = time.time()
+        self._execute("UPDATE jobs SET state = ?, outcome = ?, fields = ?, finished_at = ?, updated_at = ? WHERE doc_id = ?",
+                      (FINISHED, outcome, json.dumps(fields, default=_encode), now, now, doc_id))
+
+    def written(self, doc_id: str) -> None:
+        self._execute("UPDATE jobs SET state = ?, fields = NULL, updated_at = ? WHERE doc_id = ? AND state = ?",
+                      (WRITTEN, time.time(), doc_id, FINISHED))
+
+    def forget(self, doc_id: str) -> None:
+        """Drop a job this worker didn't get (claimed elsewhere)."""
+        self._execute("DELETE FROM jobs WHERE doc_id = ? AND state IN (?, ?)", (doc_id, ACCEPTED, RUNNING))
+
+    def unfinished(self) -> List[dict]:
+        """Jobs interrupted before their outcome was written, oldest first (fields decoded)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE state IN (?, ?, ?) ORDER BY accepted_at",
+                                      (ACCEPTED, RUNNING, FINISHED)).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["fields"] = json.loads(job["fields"], object_hook=_decode) if job["fields"] else None
+            jobs.append(job)
+        return jobs
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                      (key, value))
+
+    def prune(self, max_age_seconds: float) -> None:
+        self._execute("DELETE FROM jobs WHERE state = ? AND updated_at < ?", (WRITTEN, time.time() - max_age_seconds))
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params=()) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+
+
+def open_journal(name: str) -> Optional[JobJournal]:
+    """The journal at JOB_JOURNAL_DIR/<name>.sqlite, or None when JOB_JOURNAL is off or it can't be opened."""
+    if not JOB_JOURNAL_ENABLED:
+        return None
+    path = os.path.join(JOB_JOURNAL_DIR, f"{name}.sqlite")
+    try:
+        return JobJournal(path)
+    except sqlite3.Error as exc:
+        logger.warning("Job journal unavailable at %s (%s); running without it", path, exc)
+        return None
@@ -0,0 +1,169 @@
+# Peak-memory estimation and memory-bounded job planning (high-resolution mode).
+import os
+import logging
+import sys
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+logger = logging.getLogger("image_memory")
+logger.setLevel(logging.INFO)
+
+HIGHRES_ENABLED = os.environ.get("IMAGE_HIGHRES", "false").lower() in ("1", "true", "yes")
+# Infographics are vertical: taller canvas by default in high-res mode.
+HIGHRES_WIDTH = int(os.environ.get("IMAGE_HIGHRES_WIDTH", "512"))
+HIGHRES_HEIGHT = int(os.environ.get("IMAGE_HIGHRES_HEIGHT", "768"))
+MIN_EDGE = 256
+
+# Rough fp32 weight sizes for SD 1.x/2.x (UNet + VAE + text encoder); replaced by the
+# measured value once a pipeline is loaded (see model_weights_mb).
+DEFAULT_WEIGHTS_MB = float(os.environ.get("MODEL_WEIGHTS_MB", "4100"))
+# Interpreter, torch runtime, allocator slack.
+RUNTIME_OVERHEAD_MB = 700.0
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """Raised when a job can't fit in the memory budget even at the smallest size."""
+
+
+def _total_ram_mb() -> Optional[float]:
+    try:
+        import psutil  # optional
+        return psutil.virtual_memory().total / 2**20
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def memory_budget_mb() -> Optional[float]:
+    """IMAGE_MEMORY_BUDGET_MB, or 85% of physical RAM; None if neither is known."""
+    configured = os.environ.get("IMAGE_MEMORY_BUDGET_MB")
+    if configured:
+        return float(configured)
+    total = _total_ram_mb()
+    return total * 0.85 if total else None
+
+
+def model_weights_mb(pipe) -> float:
+    """Measured size of the pipeline's weights."""
+    total = 0
+    for name in ("unet", "vae", "text_encoder", "text_encoder_2", "safety_checker"):
+        module = getattr(pipe, name, None)
+        if module is not None and hasattr(module, "parameters"):
+            total += sum(p.numel() * p.element_size() for p in module.parameters())
+    return total / 2**20 if total else DEFAULT_WEIGHTS_MB
+
+
+def observed_peak_rss_mb() -> Optional[float]:
+    """Process high-water mark RSS (Unix only), for comparing against estimates."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class MemoryPlan:
+    width: int
+    height: int
+    batch: int
+    attention_slicing: Optional[str]  # None, "auto" or "max"
+    vae_slicing: bool
+    vae_tiling: bool
+    estimated_mb: float
+    budget_mb: Optional[float]
+    downsized: bool
+
+    def to_record(self) -> dict:
+        return asdict(self)
+
+
+def estimate_peak_rss_mb(width: int, height: int, batch: int = 1, dtype_bytes: int = 4,
+                         attention_slicing: Optional[str] = None, vae_slicing: bool = False,
+                         vae_tiling: bool = False, weights_mb: float = DEFAULT_WEIGHTS_MB,
+                         guidance: bool = True) -> float:
+    """
+    Predict peak RSS in MB for one txt2img call.
+
+    The dominant terms are the UNet's highest-resolution self-attention (quadratic in
+    latent tokens, per head), its conv activations, and the VAE decoder which runs at
+    full pixel resolution with a single-head attention in its mid block.
+    """
+    mb = 2**20
+    tokens = (width // 8) * (height // 8)
+    unet_batch = batch * (2 if guidance else 1)  # classifier-free guidance doubles the batch
+
+    heads = 8
+    heads_at_once = {None: heads, "auto": heads // 2, "max": 1}[attention_slicing]
+    unet_attention = unet_batch * heads_at_once * tokens * tokens * dtype_bytes
+    unet_activations = unet_batch * tokens * 320 * dtype_bytes * 24
+
+    if vae_tiling:
+        # Tiles are decoded at the 512px tile size, one at a time
+        vae_tokens, vae_pixels, vae_batch = 64 * 64, 512 * 512, 1
+    else:
+        vae_tokens, vae_pixels = tokens, width * height
+        vae_batch = 1 if vae_slicing else batch
+    vae_attention = vae_batch * vae_tokens * vae_tokens * dtype_bytes
+    vae_activations = vae_batch * vae_pixels * 128 * dtype_bytes * 6
+
+    # The UNet is done before the VAE runs, so only the larger of the two phases counts
+    working = max(unet_attention + unet_activations, vae_attention + vae_activations)
+    return round(weights_mb + RUNTIME_OVERHEAD_MB + working / mb, 1)
+
+
+# Cheapest-first memory settings to try at the requested size before downsizing.
+_STRATEGIES = [
+    dict(attention_slicing=None, vae_slicing=False, vae_tiling=False),
+    dict(attention_slicing="auto", vae_slicing=True, vae_tiling=False),
+    dict(attention_slicing="max", vae_slicing=True, vae_tiling=False),
+    dict(attention_slicing="max", vae_slicing=True, vae_tiling=True),
+]
+
+
+def plan_job(width: int, height: int, batch: int = 1, dtype_bytes: int = 4,
+             weights_mb: float = DEFAULT_WEIGHTS_MB, budget_mb: Optional[float] = None) -> MemoryPlan:
+    """
+    Pick the cheapest slicing/tiling settings that keep the job inside the memory budget,
+    shrinking the canvas (aspect ratio kept) only when no setting fits. Raises
+    MemoryBudgetExceeded if even MIN_EDGE doesn't fit.
+    """
+    if budget_mb is None:
+        budget_mb = memory_budget_mb()
+
+    w, h = width, height
+    while True:
+        for strategy in _STRATEGIES:
+            estimate = estimate_peak_rss_mb(w, h, batch, dtype_bytes, weights_mb=weights_mb, **strategy)
+            if budget_mb is None or estimate <= budget_mb:
+                return MemoryPlan(width=w, height=h, batch=batch, estimated_mb=estimate,
+                                  budget_mb=budget_mb, downsized=(w, h) != (width, height), **strategy)
+        if min(w, h) <= MIN_EDGE:
+            raise MemoryBudgetExceeded(
+                f"{width}x{height} (batch {batch}) needs ~{estimate:.0f} MB even at {w}x{h}; "
+                f"budget is {budget_mb:.0f} MB"
+            )
+        scale = max(MIN_EDGE / min(w, h), 0.875)
+        w = max(MIN_EDGE, int(w * scale) // 64 * 64)
+        h = max(MIN_EDGE, int(h * scale) // 64 * 64)
+
+
+def apply_memory_plan(pipe, plan: MemoryPlan) -> None:
+    """Switch the pipeline's attention/VAE memory features to match plan."""
+    if plan.attention_slicing:
+        pipe.enable_attention_slicing(plan.attention_slicing)
+    else:
+        pipe.disable_attention_slicing()
+    if plan.vae_slicing:
+        pipe.enable_vae_slicing()
+    else:
+        pipe.disable_vae_slicing()
+    if plan.vae_tiling:
+        pipe.enable_vae_tiling()
+    else:
+        pipe.disable_vae_tiling()
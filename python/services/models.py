@@ -0,0 +1,21 @@
+# Which models a request may use: the default SD_MODEL_ID plus the IMAGE_MODELS allow-list.
+# No torch/diffusers imports, so the HF API Cloud Functions (vendored services) can use it too.
+import os
+from typing import Optional
+
+# The one default model for every entry point. SD 1.x: the draft preset's LCM-LoRA (lcm-lora-sdv1-5)
+# only fits SD 1.x UNets, and stabilityai/stable-diffusion-2-1 returns 410 Gone from the HF Inference API.
+MODEL_ID = os.environ.get("SD_MODEL_ID", "CompVis/stable-diffusion-v1-4")
+# Models that requests/jobs may name (the default model is always allowed)
+IMAGE_MODELS = [m.strip() for m in os.environ.get(
+    "IMAGE_MODELS", "CompVis/stable-diffusion-v1-4,runwayml/stable-diffusion-v1-5,stabilityai/stable-diffusion-2-1"
+).split(",") if m.strip()]
+
+
+def resolve_model(model_id: Optional[str] = None) -> str:
+    """The model to use for a request; raises ValueError for models not in IMAGE_MODELS."""
+    if not model_id or model_id == MODEL_ID:
+        return MODEL_ID
+    if model_id not in IMAGE_MODELS:
+        raise ValueError(f"Unknown model '{model_id}' (expected one of: {', '.join([MODEL_ID] + [m for m in IMAGE_MODELS if m != MODEL_ID])})")
+    return model_id
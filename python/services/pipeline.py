@@ -1,26 +1,232 @@
 # Lightweight pipeline factory inspired by Enfugue patterns (original reimplementation).
+import gc
 import os
 import logging
-from typing import Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
 
 import torch
 from diffusers import StableDiffusionPipeline
 
+from .models import IMAGE_MODELS, MODEL_ID, resolve_model  # noqa: F401  (re-exported)
+
 logger = logging.getLogger("image_pipeline")
 logger.setLevel(logging.INFO)
 
-MODEL_ID = os.environ.get("SD_MODEL_ID", "stabilityai/stable-diffusion-2-1")
 FORCE_FP32 = os.environ.get("PIPELINE_FORCE_FP32", "false").lower() in ("1", "true", "yes")
 USE_XFORMERS = os.environ.get("PIPELINE_USE_XFORMERS", "true").lower() not in ("0", "false", "no")
+DEVICE = os.environ.get("PIPELINE_DEVICE")  # e.g. "cpu" to ignore an available GPU
+HF_TOKEN = os.environ.get("HF_API_TOKEN")
+# Pool limits: weights of all resident pipelines (shared components counted once)
+POOL_MAX_MODELS = int(os.environ.get("PIPELINE_POOL_MAX_MODELS", "2"))
+POOL_MAX_MB = os.environ.get("PIPELINE_POOL_MAX_MB")  # default: 60% of IMAGE_MEMORY_BUDGET_MB
+
+# Components reused across models when their files are byte-identical (same hub blob)
+SHARED_COMPONENTS = {
+    "vae": ("vae/diffusion_pytorch_model.safetensors", "vae/diffusion_pytorch_model.bin"),
+    "tokenizer": ("tokenizer/vocab.json", "tokenizer/merges.txt"),
+}
+
+PipelineKey = Tuple[str, torch.dtype, str]
+
+
+def resolve_device_dtype(device: Optional[str] = None, dtype: Optional[torch.dtype] = None) -> Tuple[str, torch.dtype]:
+    """Device/dtype policy: CUDA + fp16 when available, otherwise CPU + fp32."""
+    device = device or DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+    if dtype is None:
+        dtype = torch.float16 if device.startswith("cuda") and not FORCE_FP32 else torch.float32
+    return device, dtype
+
+
+def _component_fingerprint(model_id: str, files: Tuple[str, ...], token: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Content identity of a component without downloading it: the hub ETag (the sha256 of LFS
+    files), or the resolved path for local folders. None if it can't be determined.
+    """
+    if os.path.isdir(model_id):
+        paths = [os.path.join(model_id, f) for f in files]
+        existing = [os.path.realpath(p) for p in paths if os.path.exists(p)]
+        return tuple(existing) or None
+    try:
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url
+    except ImportError:
+        return None
+    for filename in files:
+        try:
+            metadata = get_hf_file_metadata(hf_hub_url(model_id, filename), token=token)
+            return (filename.rsplit("/", 1)[-1], metadata.etag)
+        except Exception:
+            continue
+    return None
+
+
+def _load(model_id: str, device: str, torch_dtype: torch.dtype, token: Optional[str],
+          components: Optional[Dict[str, object]] = None) -> StableDiffusionPipeline:
+    logger.info("Loading StableDiffusion pipeline '%s' on %s (dtype=%s)", model_id, device, torch_dtype)
+    if components:
+        logger.info("Reusing %s from an already loaded model", ", ".join(sorted(components)))
+    # The safety checker is a separate output stage (services/safety.py), not part of the pipeline call
+    kwargs = dict(torch_dtype=torch_dtype, token=token, low_cpu_mem_usage=True,
+                  safety_checker=None, requires_safety_checker=False, **(components or {}))
+    try:
+        pipe = StableDiffusionPipeline.from_pretrained(model_id, use_safetensors=True, **kwargs)
+    except (OSError, EnvironmentError) as exc:
+        # Older repos only ship .bin weights
+        logger.warning("No safetensors weights for '%s' (%s); loading .bin weights", model_id, exc)
+        pipe = StableDiffusionPipeline.from_pretrained(model_id, **kwargs)
+    pipe = pipe.to(device)
+    pipe.set_progress_bar_config(disable=True)
+
+    pipe.enable_attention_slicing()
+    if USE_XFORMERS and device.startswith("cuda"):
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+            logger.info("xformers memory-efficient attention enabled")
+        except Exception as exc:
+            logger.info("xformers unavailable (%s); using attention slicing", exc)
+
+    logger.info("Pipeline '%s' loaded", model_id)
+    return pipe
+
+
+def _module_bytes(module) -> Tuple[int, int]:
+    """(id, parameter bytes) of a torch module, so shared modules can be counted once."""
+    return id(module), sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+class PipelinePool:
+    """
+    LRU pool of pipelines keyed by (model_id, dtype, device). Loading a model reuses the VAE and
+    tokenizer of a resident model on the same device/dtype when the files are identical, and
+    least-recently-used models are evicted to stay under max_models and max_mb.
+    The pool lock only covers lookups and bookkeeping: a model is fingerprinted and loaded outside
+    it, and concurrent callers for a model that is loading wait on that load alone.
+    """
+
+    def __init__(self, max_models: int = POOL_MAX_MODELS, max_mb: Optional[float] = None):
+        if max_mb is None and POOL_MAX_MB:
+            max_mb = float(POOL_MAX_MB)
+        if max_mb is None:
+            from .memory import memory_budget_mb
+            budget = memory_budget_mb()
+            max_mb = budget * 0.6 if budget else None
+        self.max_models = max(1, max_models)
+        self.max_mb = max_mb
+        self._pipelines: "OrderedDict[PipelineKey, StableDiffusionPipeline]" = OrderedDict()
+        self._fingerprints: Dict[PipelineKey, Dict[str, Optional[Tuple[str, ...]]]] = {}
+        self._render_locks: Dict[PipelineKey, threading.Lock] = {}
+        self._loading: Dict[PipelineKey, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = self.loads = self.evictions = 0
+
+    def get(self, model_id: str, device: str, dtype: torch.dtype, token: Optional[str]) -> StableDiffusionPipeline:
+        key = (model_id, dtype, device)
+        with self._lock:
+            pipe = self._pipelines.get(key)
+            if pipe is not None:
+                self._pipelines.move_to_end(key)
+                self.hits += 1
+                return pipe
+            loading = self._loading.get(key)
+            leader = loading is None
+            if leader:
+                loading = self._loading[key] = Future()
+                # Make room first so the new model isn't loaded on top of one we're about to drop
+                while self._pipelines and len(self._pipelines) + len(self._loading) > self.max_models:
+                    self._evict_lru()
+        if not leader:
+            return loading.result()  # another caller is loading this model; its failure is ours too
+
+        try:
+            fingerprints = {name: _component_fingerprint(model_id, files, token)
+                            for name, files in SHARED_COMPONENTS.items()}
+            with self._lock:
+                shared = self._shareable(key, fingerprints)
+            pipe = _load(model_id, device, dtype, token, shared)
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(exc)
+            raise
+
+        with self._lock:
+            self._pipelines[key] = pipe
+            self._fingerprints[key] = fingerprints
+            self.loads += 1
+            del self._loading[key]
+            while len(self._pipelines) > 1 and (
+                    len(self._pipelines) > self.max_models
+                    or (self.max_mb is not None and self.resident_mb() > self.max_mb)):
+                self._evict_lru()
+        loading.set_result(pipe)
+        return pipe
+
+    def render_lock(self, model_id: str, device: str, dtype: torch.dtype) -> threading.Lock:
+        """
+        Held for a whole render on one pipeline: presets (scheduler, LoRA) and memory plans (slicing)
+        change the pipeline's shared state, so two calls must not interleave on it.
+        """
+        key = (model_id, dtype, device)
+        with self._lock:
+            return self._render_locks.setdefault(key, threading.Lock())
+
+    def _shareable(self, key: PipelineKey, fingerprints: Dict[str, Optional[Tuple[str, ...]]]) -> Dict[str, object]:
+        _, dtype, device = key
+        components = {}
+        for other_key, other in self._pipelines.items():
+            if other_key[1:] != (dtype, device):
+                continue
+            for name, fingerprint in fingerprints.items():
+                if name not in components and fingerprint is not None and self._fingerprints[other_key].get(name) == fingerprint:
+                    components[name] = getattr(other, name)
+        return components
+
+    def _evict_lru(self) -> None:
+        key, _ = self._pipelines.popitem(last=False)
+        self._fingerprints.pop(key, None)
+        self.evictions += 1
+        logger.info("Evicted pipeline '%s' (%s, %s) from the pool", *key)
+        # Shared components stay alive through the pipelines still using them
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def resident_mb(self) -> float:
+        """Weights of all resident pipelines, counting shared modules once."""
+        sizes = {}
+        for pipe in self._pipelines.values():
+            for name in ("unet", "vae", "text_encoder", "text_encoder_2", "safety_checker"):
+                module = getattr(pipe, name, None)
+                if module is not None and hasattr(module, "parameters"):
+                    module_id, size = _module_bytes(module)
+                    sizes[module_id] = size
+        return sum(sizes.values()) / 2**20
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "models": [{"modelId": m, "dtype": str(d), "device": dev} for m, d, dev in self._pipelines],
+                "maxModels": self.max_models,
+                "maxMb": self.max_mb,
+                "residentMb": round(self.resident_mb(), 1),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
 
-_pipeline: Optional[StableDiffusionPipeline] = None
 
-def get_pipeline() -> StableDiffusionPipeline:
-    global _pipeline
-    if _pipeline is not None:
-        return _pipeline
+pool = PipelinePool()
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    torch_dtype = torch.float16 if device == "cuda" and not FORCE_FP32 else torch.float32
 
-    logger.info("Loading StableDiffusion pipeline '%s' on %s (dtype=%s)", MODEL_ID, device, torch_dtype)
+def get_pipeline(model_id: Optional[str] = None, device: Optional[str] = None,
+                 dtype: Optional[torch.dtype] = None, token: Optional[str] = None) -> StableDiffusionPipeline:
+    """
+    Return the pooled pipeline for (model_id, dtype, device), loading it on first use (and
+    possibly evicting the least recently used model).
+    Raises MemoryError if the host can't hold the model (callers may fall back to the HF API backend).
+    """
+    model_id = model_id or MODEL_ID
+    device, dtype = resolve_device_dtype(device, dtype)
+    return pool.get(model_id, device, dtype, token or HF_TOKEN)
@@ -0,0 +1,124 @@
+# Named quality/latency presets: each maps to a scheduler, step count and guidance.
+import os
+import logging
+import weakref
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, Optional
+
+logger = logging.getLogger("image_presets")
+logger.setLevel(logging.INFO)
+
+DEFAULT_PRESET = os.environ.get("IMAGE_PRESET", "standard")
+# LCM-LoRA weights matching the SD 1.x family; override for SD 2.x / SDXL bases.
+LCM_LORA_ID = os.environ.get("LCM_LORA_ID", "latent-consistency/lcm-lora-sdv1-5")
+
+
+@dataclass(frozen=True)
+class Preset:
+    name: str
+    scheduler: str
+    steps: int
+    guidance_scale: float
+    lora_id: Optional[str] = None
+    # Output stage: generate at the native size, then upscale by this factor (1.0 = off)
+    upscale: float = 1.0
+    upscaler: str = "lanczos"  # "lanczos" or "esrgan" (see services/upscale.py)
+
+    def to_record(self) -> dict:
+        """Plain dict for storing on the Firestore doc / returning from the API."""
+        return asdict(self)
+
+
+PRESETS: Dict[str, Preset] = {
+    # 4-8 step generation; needs the optional LCM-LoRA, see without_lora() for the fallback.
+    "draft": Preset("draft", scheduler="lcm", steps=6, guidance_scale=1.5, lora_id=LCM_LORA_ID),
+    "standard": Preset("standard", scheduler="dpmpp_2m_karras", steps=20, guidance_scale=7.0),
+    "final": Preset("final", scheduler="unipc", steps=30, guidance_scale=7.5,
+                    upscale=float(os.environ.get("FINAL_UPSCALE", "1.0")),
+                    upscaler=os.environ.get("FINAL_UPSCALER", "lanczos")),
+}
+
+# Used when the draft preset cannot load its LoRA (offline, incompatible base model, API backend).
+_LORA_FALLBACK = {"scheduler": "dpmpp_2m_karras", "steps": 12, "guidance_scale": 7.0}
+
+
+def resolve_preset(name: Optional[str] = None) -> Preset:
+    """Look up a preset by name, falling back to IMAGE_PRESET when name is empty."""
+    key = (name or DEFAULT_PRESET).strip().lower()
+    if key not in PRESETS:
+        raise ValueError(f"Unknown image preset '{key}' (expected one of: {', '.join(PRESETS)})")
+    return PRESETS[key]
+
+
+def without_lora(preset: Preset) -> Preset:
+    """The closest preset that runs without LoRA weights (e.g. on the HF Inference API)."""
+    if not preset.lora_id:
+        return preset
+    return replace(preset, lora_id=None, **_LORA_FALLBACK)
+
+
+def make_scheduler(name: str, config):
+    """Build a scheduler from the pipeline's base scheduler config."""
+    from diffusers import (
+        DPMSolverMultistepScheduler,
+        LCMScheduler,
+        UniPCMultistepScheduler,
+    )
+
+    if name == "dpmpp_2m_karras":
+        return DPMSolverMultistepScheduler.from_config(
+            config, algorithm_type="dpmsolver++", solver_order=2, use_karras_sigmas=True
+        )
+    if name == "unipc":
+        return UniPCMultistepScheduler.from_config(config)
+    if name == "lcm":
+        return LCMScheduler.from_config(config)
+    if name == "dpm":
+        return DPMSolverMultistepScheduler.from_config(config)
+    raise ValueError(f"Unknown scheduler '{name}'")
+
+
+# Per-pipeline state: original scheduler config, loaded LoRAs and the preset currently applied.
+_pipeline_state: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def apply_preset(pipe, preset: Preset) -> Preset:
+    """
+    Configure pipe for preset and return the preset that was actually applied.
+    If the preset's LoRA cannot be loaded, the LoRA-free fallback is applied instead.
+    Switching back to the same preset is a no-op.
+    """
+    state = _pipeline_state.setdefault(pipe, {
+        "base_config": pipe.scheduler.config,
+        "loras": set(),
+        "failed_loras": set(),
+        "active": None,
+    })
+    if state["active"] and state["active"][0] == preset:
+        return state["active"][1]
+
+    effective = preset
+    if preset.lora_id and preset.lora_id in state["failed_loras"]:
+        effective = without_lora(preset)
+    elif preset.lora_id and preset.lora_id not in state["loras"]:
+        try:
+            logger.info("Loading LoRA '%s' for preset '%s'", preset.lora_id, preset.name)
+            pipe.load_lora_weights(preset.lora_id, adapter_name=preset.name)
+            state["loras"].add(preset.lora_id)
+        except Exception as exc:
+            logger.warning("Could not load LoRA '%s' (%s); using %s fallback", preset.lora_id, exc, preset.name)
+            state["failed_loras"].add(preset.lora_id)
+            effective = without_lora(preset)
+
+    if state["loras"]:
+        if effective.lora_id:
+            pipe.enable_lora()
+            pipe.set_adapters([effective.name])
+        else:
+            pipe.disable_lora()
+
+    pipe.scheduler = make_scheduler(effective.scheduler, state["base_config"])
+    state["active"] = (preset, effective)
+    logger.info("Applied preset '%s' (scheduler=%s, steps=%d, guidance=%.1f)",
+                effective.name, effective.scheduler, effective.steps, effective.guidance_scale)
+    return effective
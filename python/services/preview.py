@@ -0,0 +1,161 @@
+# Preview-first rendering: decode intermediate latents with a tiny autoencoder (TAESD).
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import torch
+from PIL import Image
+
+logger = logging.getLogger("image_preview")
+logger.setLevel(logging.INFO)
+
+PREVIEW_ENABLED = os.environ.get("PREVIEW_ENABLED", "true").lower() not in ("0", "false", "no")
+# TAESD shares the SD 1.x / 2.x latent space; use madebyollin/taesdxl for SDXL bases.
+TAESD_MODEL_ID = os.environ.get("TAESD_MODEL_ID", "madebyollin/taesd")
+# Fractions of the denoising run at which to publish a preview.
+PREVIEW_AT = tuple(float(x) for x in os.environ.get("PREVIEW_AT", "0.35,0.7").split(",") if x.strip())
+PREVIEW_MAX_EDGE = int(os.environ.get("PREVIEW_MAX_EDGE", "256"))
+# Previews may cost at most this fraction of the denoising time so far.
+PREVIEW_BUDGET_FRACTION = float(os.environ.get("PREVIEW_BUDGET_FRACTION", "0.05"))
+
+_decoders: Dict[Tuple[str, str, torch.dtype], object] = {}
+# Measured decode cost per latent pixel, per decoder: calibrated on load, then updated by real previews
+_decode_costs: Dict[Tuple[str, str, torch.dtype], float] = {}
+_decoders_lock = threading.Lock()
+_CALIBRATION_LATENT = (1, 4, 64, 64)  # a 512x512 image
+
+
+def get_tiny_decoder(device, dtype: torch.dtype):
+    """Load (once per device/dtype) the tiny autoencoder used for previews, and time one decode."""
+    from diffusers import AutoencoderTiny
+
+    key = (TAESD_MODEL_ID, str(device), dtype)
+    with _decoders_lock:
+        if key not in _decoders:
+            logger.info("Loading tiny autoencoder '%s' on %s", TAESD_MODEL_ID, device)
+            decoder = AutoencoderTiny.from_pretrained(TAESD_MODEL_ID, torch_dtype=dtype).to(device).eval()
+            with torch.no_grad():
+                latents = torch.zeros(_CALIBRATION_LATENT, device=device, dtype=dtype)
+                decoder.decode(latents)  # warm-up
+                t0 = time.monotonic()
+                decoder.decode(latents)
+            _decode_costs[key] = (time.monotonic() - t0) / (_CALIBRATION_LATENT[2] * _CALIBRATION_LATENT[3])
+            _decoders[key] = decoder
+        return _decoders[key]
+
+
+def estimate_decode_seconds(latents: torch.Tensor) -> float:
+    """Expected cost of one preview decode of these latents (loads and calibrates the decoder if needed)."""
+    get_tiny_decoder(latents.device, latents.dtype)
+    key = (TAESD_MODEL_ID, str(latents.device), latents.dtype)
+    return _decode_costs[key] * latents.shape[-2] * latents.shape[-1]
+
+
+def _record_decode_seconds(latents: torch.Tensor, seconds: float) -> None:
+    key = (TAESD_MODEL_ID, str(latents.device), latents.dtype)
+    per_pixel = seconds / (latents.shape[-2] * latents.shape[-1])
+    with _decoders_lock:
+        previous = _decode_costs.get(key)
+        _decode_costs[key] = per_pixel if previous is None else 0.7 * previous + 0.3 * per_pixel
+
+
+class PreviewPublisher:
+    """
+    callback_on_step_end hook that decodes latents with TAESD at the configured points of
+    the run and hands a small PIL image to publish(image, step, total_steps).
+
+    A preview is skipped whenever its expected decode cost would push the total preview time
+    above budget_fraction of the elapsed denoising time. The expected cost is known before the
+    first preview (timed when the decoder loads) and tracks real decodes after that. publish() runs on a
+    background thread; a preview is dropped if the previous one is still being published.
+    """
+
+    def __init__(self, publish: Callable[[Image.Image, int, int], None],
+                 total_steps: Optional[int] = None, at: Sequence[float] = PREVIEW_AT,
+                 max_edge: int = PREVIEW_MAX_EDGE, budget_fraction: float = PREVIEW_BUDGET_FRACTION):
+        self.publish = publish
+        self.at = tuple(at)
+        self.max_edge = max_edge
+        self.budget_fraction = budget_fraction
+        self.total_steps = None
+        self.preview_steps = []
+        if total_steps:
+            self._set_total_steps(total_steps)
+        self.preview_seconds = 0.0
+        self.published = 0
+        self.skipped = 0
+        self._started = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+        self._in_flight = None
+
+    def _set_total_steps(self, total_steps: int) -> None:
+        self.total_steps = total_steps
+        self.preview_steps = sorted({min(total_steps - 1, max(0, int(f * total_steps))) for f in self.at})
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        if self.total_steps is None:
+            # Resolved lazily: the preset (or its LoRA fallback) decides the step count
+            self._set_total_steps(getattr(pipe, "num_timesteps", None) or len(pipe.scheduler.timesteps))
+        if step not in self.preview_steps:
+            return callback_kwargs
+
+        latents = callback_kwargs["latents"]
+        try:
+            expected = estimate_decode_seconds(latents)
+        except Exception as exc:
+            logger.warning("Preview decoder unavailable: %s", exc)
+            self.preview_steps = []
+            return callback_kwargs
+        denoise_seconds = time.monotonic() - self._started - self.preview_seconds
+        if self.preview_seconds + expected > self.budget_fraction * denoise_seconds or \
+                (self._in_flight is not None and not self._in_flight.done()):
+            self.skipped += 1
+            return callback_kwargs
+
+        t0 = time.monotonic()
+        try:
+            image = self._decode(pipe, latents)
+        except Exception as exc:
+            logger.warning("Preview decode failed at step %d: %s", step, exc)
+            self.preview_steps = []  # don't keep paying for a broken decoder
+            return callback_kwargs
+        finally:
+            cost = time.monotonic() - t0
+            self.preview_seconds += cost
+        _record_decode_seconds(latents, cost)
+
+        self._in_flight = self._executor.submit(self._publish, image, step + 1)
+        self.published += 1
+        return callback_kwargs
+
+    def _decode(self, pipe, latents: torch.Tensor) -> Image.Image:
+        decoder = get_tiny_decoder(latents.device, latents.dtype)
+        with torch.no_grad():
+            # TAESD takes the scaled latents directly (scaling_factor == 1.0)
+            decoded = decoder.decode(latents[:1]).sample
+        array = (decoded[0] / 2 + 0.5).clamp(0, 1).permute(1, 2, 0).float().cpu().numpy()
+        image = Image.fromarray((array * 255).round().astype("uint8"))
+        image.thumbnail((self.max_edge, self.max_edge))
+        return image
+
+    def _publish(self, image: Image.Image, step: int) -> None:
+        try:
+            self.publish(image, step, self.total_steps)
+        except Exception as exc:
+            logger.warning("Publishing preview for step %d failed: %s", step, exc)
+
+    def close(self) -> None:
+        """Wait for the last preview upload so it can't land after the final image."""
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started
+        return {
+            "published": self.published,
+            "skipped": self.skipped,
+            "previewSeconds": round(self.preview_seconds, 3),
+            "fractionOfGeneration": round(self.preview_seconds / elapsed, 4) if elapsed > 0 else 0.0,
+        }
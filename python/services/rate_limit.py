@@ -0,0 +1,213 @@
+# Client-side rate limits for paid external APIs: a token bucket per provider (and optionally per model),
+# in-process or shared across the fleet through Firestore. The Cloud Functions use this module too,
+# vendored into functions-python/ by functions-python/vendor_shared.py.
+import os
+import math
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("image_rate_limit")
+logger.setLevel(logging.INFO)
+
+# "<provider>[@<model>]=<count>/<s|m|h>[:<burst>]", comma-separated; a provider@model limit applies on top of the provider's
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "hf_api=30/m:5,openrouter=60/m:10")
+# local: per process; firestore: one bucket per key shared by every worker (collection RATE_LIMIT_COLLECTION)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "local").lower()
+RATE_LIMIT_COLLECTION = os.environ.get("RATE_LIMIT_COLLECTION", "rateLimits")
+
+_UNITS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimited(RuntimeError):
+    """No token within the caller's wait budget; retry_after is when one is expected."""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Rate limit for {key} reached, retry after {retry_after:.1f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """key -> (tokens per second, burst)."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, rate = item.partition("=")
+        rate, _, burst = rate.partition(":")
+        count, _, unit = rate.partition("/")
+        if unit not in _UNITS:
+            raise ValueError(f"Bad rate '{rate}' for {key} in RATE_LIMITS (expected <count>/<s|m|h>[:<burst>])")
+        per_second = float(count) / _UNITS[unit]
+        limits[key.strip()] = (per_second, float(burst) if burst else float(max(1, math.ceil(per_second))))
+    return limits
+
+
+class TokenBucket:
+    """In-process bucket: refills at rate tokens/s up to burst."""
+
+    def __init__(self, key: str, rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens now and return 0, or take nothing and return the seconds until they'd be available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def refund(self, tokens: float = 1.0) -> None:
+        """Give back tokens taken for a call that didn't happen."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + tokens)
+
+
+class FirestoreTokenBucket:
+    """
+    The same bucket kept in a Firestore document (tokens, updatedAt), refilled and taken from in a
+    transaction, so every worker draws from one quota. Costs one transaction per acquire.
+    """
+
+    def __init__(self, key: str, rate: float, burst: float, db):
+        from google.cloud import firestore
+
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.doc_ref = db.collection(RATE_LIMIT_COLLECTION).document(key.replace("/", "__"))
+        self._db = db
+        self._take = firestore.transactional(self._take_in_transaction)
+        self._give = firestore.transactional(self._give_in_transaction)
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        return self._take(self._db.transaction(), tokens)
+
+    def refund(self, tokens: float = 1.0) -> None:
+        self._give(self._db.transaction(), tokens)
+
+    def _available(self, transaction, now: float) -> float:
+        snapshot = self.doc_ref.get(transaction=transaction)
+        state = snapshot.to_dict() or {}
+        return min(self.burst, state.get("tokens", self.burst) + max(0.0, now - state.get("updatedAt", now)) * self.rate)
+
+    def _take_in_transaction(self, transaction, tokens: float) -> float:
+        now = time.time()  # wall clock: shared between hosts
+        available = self._available(transaction, now)
+        if available >= tokens:
+            transaction.set(self.doc_ref, {"tokens": available - tokens, "updatedAt": now})
+            return 0.0
+        return (tokens - available) / self.rate
+
+    def _give_in_transaction(self, transaction, tokens: float) -> None:
+        now = time.time()
+        transaction.set(self.doc_ref, {"tokens": min(self.burst, self._available(transaction, now) + tokens),
+                                       "updatedAt": now})
+
+
+class RateLimiter:
+    """Buckets by key, built lazily from RATE_LIMITS; keys without a configured limit are unlimited."""
+
+    def __init__(self, spec: str = RATE_LIMITS, backend: str = RATE_LIMIT_BACKEND,
+                 client_factory: Optional[Callable[[], object]] = None):
+        self.limits = parse_limits(spec)
+        self.backend = backend
+        self._client_factory = client_factory
+        self._buckets: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.stats_counts: Dict[str, Dict[str, float]] = {}
+
+    def acquire(self, provider: str, model: Optional[str] = None, timeout: Optional[float] = None) -> float:
+        """
+        Take one token from provider's bucket and provider@model's, waiting up to timeout seconds
+        (None: as long as it takes, 0: fail fast). Raises RateLimited; returns the seconds waited.
+        All or nothing: if a later bucket fails, tokens already taken from earlier ones are refunded.
+        """
+        waited = 0.0
+        taken = []
+        try:
+            for bucket in self._buckets_for(provider, model):
+                waited += self._acquire_one(bucket, None if timeout is None else max(0.0, timeout - waited))
+                taken.append(bucket)
+        except BaseException:
+            self._refund(taken)
+            raise
+        return waited
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {key: dict(counts) for key, counts in self.stats_counts.items()}
+
+    # --- internals ---
+
+    def _buckets_for(self, provider: str, model: Optional[str]) -> List[object]:
+        keys = [provider] + ([f"{provider}@{model}"] if model else [])
+        return [bucket for bucket in (self._bucket(key) for key in keys) if bucket is not None]
+
+    def _bucket(self, key: str):
+        if key not in self.limits:
+            return None
+        with self._lock:
+            if key not in self._buckets:
+                rate, burst = self.limits[key]
+                if self.backend == "firestore":
+                    self._buckets[key] = FirestoreTokenBucket(key, rate, burst, self._client())
+                else:
+                    self._buckets[key] = TokenBucket(key, rate, burst)
+                self.stats_counts[key] = {"acquired": 0, "rejected": 0, "refunded": 0, "waitSeconds": 0.0}
+            return self._buckets[key]
+
+    def _client(self):
+        if self._client_factory is not None:
+            return self._client_factory()
+        from .firestore_client import get_db
+        return get_db()
+
+    def _acquire_one(self, bucket, timeout: Optional[float]) -> float:
+        started = time.monotonic()
+        while True:
+            wait = bucket.try_acquire()
+            waited = time.monotonic() - started
+            if wait <= 0:
+                self._count(bucket.key, "acquired", waited)
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                self._count(bucket.key, "rejected", waited)
+                raise RateLimited(bucket.key, wait)
+            time.sleep(wait)
+
+    def _refund(self, buckets: List[object]) -> None:
+        for bucket in buckets:
+            try:
+                bucket.refund()
+            except Exception as exc:  # a lost token only costs throughput
+                logger.warning("Couldn't refund a %s token: %s", bucket.key, exc)
+                continue
+            self._count(bucket.key, "refunded", 0.0)
+
+    def _count(self, key: str, outcome: str, waited: float) -> None:
+        with self._lock:
+            counts = self.stats_counts[key]
+            counts[outcome] += 1
+            counts["waitSeconds"] = round(counts["waitSeconds"] + waited, 3)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+            logger.info("Rate limits (%s backend): %s", _limiter.backend, RATE_LIMITS or "none")
+        return _limiter
@@ -0,0 +1,115 @@
+# Retry policy for failed story jobs: classify the error, then back off exponentially (capped, jittered).
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from .deadline import DeadlineExceeded, JobCancelled
+from .job_queue import FAILED, RETRY
+from .memory import MemoryBudgetExceeded
+from .rate_limit import RateLimited
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.environ.get("RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.environ.get("RETRY_MAX_SECONDS", "3600"))
+ATTEMPT_HISTORY_LIMIT = 10  # newest attempts kept on the story
+ERROR_MESSAGE_LIMIT = 500
+
+TRANSIENT, PERMANENT = "transient", "permanent"
+
+# HTTP statuses worth retrying: timeouts, rate limits, and server-side errors (HF 503 while a model loads)
+_TRANSIENT_HTTP = {408, 425, 429, 500, 502, 503, 504}
+# Errors in the job itself: retrying the same inputs fails the same way
+_PERMANENT_TYPES = (ValueError, TypeError, KeyError, MemoryBudgetExceeded)
+# Network, storage and server trouble, from requests/urllib3/google-api-core and the OS
+_TRANSIENT_TYPES = (ConnectionError, TimeoutError, OSError, MemoryError)
+
+
+def _http_status(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)  # google.api_core.exceptions.GoogleAPICallError
+    return status if isinstance(status, int) else None
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    TRANSIENT or PERMANENT. Backends wrap their errors (RuntimeError from ...), so the cause chain
+    is searched for the first error with a known type or HTTP status. Unknown errors count as
+    transient: the attempt cap bounds what a wrong guess costs.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, DeadlineExceeded):
+            return TRANSIENT
+        if isinstance(exc, JobCancelled):
+            return PERMANENT  # cancelled on purpose
+        if isinstance(exc, RateLimited):
+            return TRANSIENT
+        status = _http_status(exc)
+        if status is not None:
+            return TRANSIENT if status in _TRANSIENT_HTTP or status >= 500 else PERMANENT
+        if isinstance(exc, _PERMANENT_TYPES):
+            return PERMANENT
+        if isinstance(exc, _TRANSIENT_TYPES):
+            return TRANSIENT
+        exc = exc.__cause__ or exc.__context__
+    return TRANSIENT
+
+
+def backoff_seconds(attempt: int, base: float = RETRY_BASE_SECONDS, cap: float = RETRY_MAX_SECONDS) -> float:
+    """Delay before retry number `attempt` (1-based): base * 2^(attempt-1), capped, jittered down by up to half."""
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** max(0, attempt - 1))
+
+
+def should_retry(kind: str, attempt: int, max_attempts: int = RETRY_MAX_ATTEMPTS) -> bool:
+    return kind == TRANSIENT and attempt < max_attempts
+
+
+def attempt_record(attempt: int, exc: BaseException, kind: str, worker: str,
+                   retry_at: Optional[datetime] = None) -> dict:
+    """One entry of imageJob.attempts (array values can't hold server timestamps, so the time is local)."""
+    record = {
+        "attempt": attempt,
+        "at": datetime.now(timezone.utc),
+        "worker": worker,
+        "errorType": type(exc).__name__,
+        "error": str(exc)[:ERROR_MESSAGE_LIMIT],
+        "kind": kind,
+    }
+    if isinstance(exc, JobCancelled):
+        record["cancelReason"] = exc.reason
+    if retry_at is not None:
+        record["retryAt"] = retry_at
+    return record
+
+
+def attempt_failure_fields(job: dict, exc: BaseException, worker: str) -> dict:
+    """
+    Update fields for a failed attempt: back to the queue after a backoff (status retry) if the error
+    is transient and attempts remain, otherwise failed for good. Either way the attempt is appended
+    to imageJob.attempts (newest ATTEMPT_HISTORY_LIMIT kept) and mirrored in imageJob.lastError.
+    The caller adds the server-side finish time to a final failure.
+    """
+    attempt = job.get("attemptCount", 1)
+    kind = classify_error(exc)
+    retry_at = None
+    if should_retry(kind, attempt):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=backoff_seconds(attempt))
+    record = attempt_record(attempt, exc, kind, worker, retry_at)
+    history = list(job.get("attempts") or [])[-(ATTEMPT_HISTORY_LIMIT - 1):] + [record]
+    if retry_at is not None:
+        fields = {
+            "imageJob.status": RETRY,
+            "imageJob.retryAt": retry_at,
+            "imageJob.leaseExpiresAt": None,
+            "imageJob.worker": None,
+        }
+    else:
+        fields = {"imageJob.status": FAILED, "imageJob.leaseExpiresAt": None}
+        if isinstance(exc, JobCancelled) and exc.reason:
+            fields["imageJob.cancelReason"] = exc.reason
+    fields.update({"imageJob.attempts": history, "imageJob.lastError": record})
+    return fields
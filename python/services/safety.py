@@ -0,0 +1,159 @@
+# Safety check as a separate output stage: off, the stock SD checker, or a lightweight classifier.
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .batching import Histogram
+
+logger = logging.getLogger("image_safety")
+logger.setLevel(logging.INFO)
+
+# "off" | "default" (CompVis CLIP-based checker, what diffusers loads by default) | "light"
+SAFETY_CHECKER = os.environ.get("SAFETY_CHECKER", "default").lower()
+SAFETY_MODEL_ID = os.environ.get("SAFETY_MODEL_ID", "CompVis/stable-diffusion-safety-checker")
+# Small ViT image classifier (~85M params vs ~300M for the CLIP-L vision tower)
+SAFETY_LIGHT_MODEL_ID = os.environ.get("SAFETY_LIGHT_MODEL_ID", "Falconsai/nsfw_image_detection")
+SAFETY_LIGHT_THRESHOLD = float(os.environ.get("SAFETY_LIGHT_THRESHOLD", "0.5"))
+# "blank" replaces flagged images with black ones (diffusers' behaviour); "flag" only reports them
+SAFETY_ACTION = os.environ.get("SAFETY_ACTION", "blank").lower()
+SAFETY_DEVICE = os.environ.get("SAFETY_DEVICE", "cpu")
+
+
+@dataclass
+class SafetyResult:
+    flagged: bool
+    score: Optional[float] = None  # classifier probability (light checker only)
+
+    def to_record(self) -> dict:
+        return asdict(self)
+
+
+class DefaultChecker:
+    """StableDiffusionSafetyChecker, run on its own instead of inside the pipeline call."""
+
+    name = "default"
+
+    def __init__(self, model_id: str = SAFETY_MODEL_ID, device: str = SAFETY_DEVICE):
+        import torch
+        from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
+        from transformers import CLIPImageProcessor
+
+        self.device = device
+        self.processor = CLIPImageProcessor.from_pretrained(model_id)
+        self.model = StableDiffusionSafetyChecker.from_pretrained(model_id).to(device).eval()
+        self._torch = torch
+
+    def check(self, images: Sequence[Image.Image]) -> List[SafetyResult]:
+        import numpy as np
+
+        rgb = [image.convert("RGB") for image in images]
+        inputs = self.processor(rgb, return_tensors="pt")
+        # The checker blanks flagged entries of `images` in place; we only use its flags
+        arrays = [np.asarray(image, dtype=np.float32) / 255.0 for image in rgb]
+        with self._torch.no_grad():
+            _, flags = self.model(images=arrays, clip_input=inputs.pixel_values.to(self.device))
+        return [SafetyResult(flagged=bool(flag)) for flag in flags]
+
+
+class LightChecker:
+    """Small NSFW image classifier via transformers' image-classification pipeline."""
+
+    name = "light"
+
+    def __init__(self, model_id: str = SAFETY_LIGHT_MODEL_ID, device: str = SAFETY_DEVICE,
+                 threshold: float = SAFETY_LIGHT_THRESHOLD):
+        from transformers import pipeline
+
+        self.classifier = pipeline("image-classification", model=model_id, device=device)
+        self.threshold = threshold
+
+    def check(self, images: Sequence[Image.Image]) -> List[SafetyResult]:
+        outputs = self.classifier([image.convert("RGB") for image in images], batch_size=len(images))
+        results = []
+        for scores in outputs:
+            nsfw = next((s["score"] for s in scores if s["label"].lower() in ("nsfw", "unsafe", "porn")), 0.0)
+            results.append(SafetyResult(flagged=nsfw >= self.threshold, score=round(float(nsfw), 4)))
+        return results
+
+
+_CHECKERS = {DefaultChecker.name: DefaultChecker, LightChecker.name: LightChecker}
+
+
+class SafetyStage:
+    """
+    Post-processing stage: checks a batch of finished images in one call, off the inference
+    thread, and keeps its own timing so its cost is reported separately from denoising.
+    """
+
+    def __init__(self, mode: str = SAFETY_CHECKER, action: str = SAFETY_ACTION):
+        if mode not in ("off", *_CHECKERS):
+            raise ValueError(f"Unknown SAFETY_CHECKER '{mode}' (expected off, {', '.join(_CHECKERS)})")
+        self.mode = mode
+        self.action = action
+        self._checker = None
+        self._load_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="safety")
+        self.seconds = Histogram([0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+        self.images = self.flagged = 0
+
+    def _get_checker(self):
+        with self._load_lock:
+            if self._checker is None:
+                started = time.monotonic()
+                self._checker = _CHECKERS[self.mode]()
+                logger.info("Loaded '%s' safety checker in %.1fs", self.mode, time.monotonic() - started)
+            return self._checker
+
+    def check(self, images: Sequence[Image.Image]) -> Tuple[List[Image.Image], List[SafetyResult], float]:
+        """Check images in one batch; returns (images, with flagged ones blanked if configured), results, seconds."""
+        images = list(images)
+        if self.mode == "off" or not images:
+            return images, [SafetyResult(flagged=False) for _ in images], 0.0
+        started = time.monotonic()
+        results = self._get_checker().check(images)
+        seconds = time.monotonic() - started
+        self.seconds.observe(seconds)
+        self.images += len(images)
+        self.flagged += sum(r.flagged for r in results)
+
+        if self.action == "blank":
+            images = [Image.new("RGB", image.size) if result.flagged else image for image, result in zip(images, results)]
+        if any(r.flagged for r in results):
+            logger.warning("Safety checker flagged %d of %d images", sum(r.flagged for r in results), len(results))
+        return images, results, seconds
+
+    def submit(self, images: Sequence[Image.Image], then: Optional[Callable] = None) -> Future:
+        """
+        check() on the stage's own thread, so the next denoising run can start meanwhile.
+        then(images, results, seconds), if given, runs there too (e.g. encoding/storing) and its return value is the result.
+        """
+        def _run():
+            checked = self.check(images)
+            return then(*checked) if then is not None else checked
+        return self._pool.submit(_run)
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "action": self.action, "images": self.images,
+                "flagged": self.flagged, "seconds": self.seconds.snapshot()}
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+_stage: Optional[SafetyStage] = None
+_stage_lock = threading.Lock()
+
+
+def get_safety_stage() -> SafetyStage:
+    """Process-wide stage configured from SAFETY_CHECKER / SAFETY_ACTION."""
+    global _stage
+    with _stage_lock:
+        if _stage is None:
+            _stage = SafetyStage()
+        return _stage
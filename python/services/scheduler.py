@@ -0,0 +1,148 @@
+# In-process job scheduler for the story queue: class priority, ageing, per-class concurrency caps.
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from .job_queue import PRIORITY_INTERACTIVE
+
+# Dispatch order, best first. A job's class comes from its imageJob (see job_class()).
+INTERACTIVE, RETRY, BACKFILL, RERENDER = "interactive", "retry", "backfill", "rerender"
+CLASSES = (INTERACTIVE, RETRY, BACKFILL, RERENDER)
+
+# A waiting job moves up one class per SCHED_AGEING_SECONDS, so nothing waits forever behind new work
+SCHED_AGEING_SECONDS = float(os.environ.get("SCHED_AGEING_SECONDS", "600"))
+# Stories this worker runs at once (inference itself stays serialized on the pipeline's slots)
+SCHED_CONCURRENCY = int(os.environ.get("SCHED_CONCURRENCY", "1"))
+# Max in-flight jobs per class, e.g. "backfill=1,retry=2"; classes not listed are only bound by SCHED_CONCURRENCY
+SCHED_CLASS_CAPS = os.environ.get("SCHED_CLASS_CAPS", "")
+
+
+def parse_caps(spec: str) -> Dict[str, int]:
+    caps = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in CLASSES:
+            raise ValueError(f"Unknown job class '{name}' in SCHED_CLASS_CAPS (expected one of: {', '.join(CLASSES)})")
+        caps[name] = max(0, int(value))
+    return caps
+
+
+def job_class(job: dict) -> str:
+    """Scheduling class of a queued imageJob."""
+    if job.get("fullQuality"):
+        return RERENDER
+    if job.get("attemptCount", 0) > 0:
+        return RETRY  # back from a failed attempt or an expired lease
+    if job.get("priority", 0) >= PRIORITY_INTERACTIVE:
+        return INTERACTIVE
+    return BACKFILL  # migrated and backfilled stories
+
+
+@dataclass
+class QueuedJob:
+    doc_id: str
+    job_class: str
+    enqueued_at: datetime
+    full_quality: bool = False
+    preferred: bool = True  # e.g. in this worker's shard; breaks ties within a class
+
+    def wait_seconds(self, now: datetime) -> float:
+        return max(0.0, (now - self.enqueued_at).total_seconds())
+
+
+class JobScheduler:
+    """
+    Orders this worker's view of the pending queue. Each refresh() replaces the waiting set with
+    the latest queue snapshot; next() returns the job to start now, or None.
+
+    Jobs rank by class (CLASSES order), moved up one class per ageing_seconds waited, then
+    preferred first, then by enqueue time. A fresh re-render only starts when nothing else is waiting or
+    running, at most one per refresh, as the monitor has always done; once it has aged past its class
+    it competes like any other job, so re-renders can't starve. A class at its cap is passed over.
+    """
+
+    def __init__(self, ageing_seconds: float = SCHED_AGEING_SECONDS, concurrency: int = SCHED_CONCURRENCY,
+                 caps: Optional[Dict[str, int]] = None):
+        self.ageing_seconds = ageing_seconds
+        self.concurrency = max(1, concurrency)
+        self.caps = parse_caps(SCHED_CLASS_CAPS) if caps is None else caps
+        self._lock = threading.Lock()
+        self._waiting: Dict[str, QueuedJob] = {}
+        self._running: Dict[str, QueuedJob] = {}
+        self._started_since_refresh = 0
+        self._started = {name: 0 for name in CLASSES}
+        self._waits: Dict[str, Deque[float]] = {name: deque(maxlen=100) for name in CLASSES}
+
+    def refresh(self, jobs: List[QueuedJob]) -> None:
+        with self._lock:
+            self._waiting = {job.doc_id: job for job in jobs if job.doc_id not in self._running}
+            self._started_since_refresh = 0
+
+    def depth(self) -> int:
+        """Jobs waiting plus running (what admission control sees as the backlog)."""
+        with self._lock:
+            return len(self._waiting) + len(self._running)
+
+    def next(self) -> Optional[QueuedJob]:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if len(self._running) >= self.concurrency:
+                return None
+            running = self._running_by_class()
+            candidates = [job for job in self._waiting.values()
+                          if running.get(job.job_class, 0) < self.caps.get(job.job_class, self.concurrency)]
+            others = [job for job in candidates
+                      if job.job_class != RERENDER or self._rank(job, now) < CLASSES.index(RERENDER)]
+            if others:
+                job = min(others, key=lambda job: (self._rank(job, now), not job.preferred, job.enqueued_at))
+            elif candidates and len(self._waiting) == len(candidates) and not self._running \
+                    and not self._started_since_refresh:
+                job = min(candidates, key=lambda job: job.enqueued_at)
+            else:
+                return None
+            del self._waiting[job.doc_id]
+            self._running[job.doc_id] = job
+            self._started_since_refresh += 1
+            self._started[job.job_class] += 1
+            self._waits[job.job_class].append(job.wait_seconds(now))
+            return job
+
+    def finish(self, job: QueuedJob) -> None:
+        with self._lock:
+            self._running.pop(job.doc_id, None)
+
+    def stats(self) -> dict:
+        """Per class: waiting, running, started (total), oldest current wait, mean/max wait at start (recent)."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            running = self._running_by_class()
+            result = {}
+            for name in CLASSES:
+                waiting = [job.wait_seconds(now) for job in self._waiting.values() if job.job_class == name]
+                waits = self._waits[name]
+                result[name] = {
+                    "waiting": len(waiting),
+                    "running": running.get(name, 0),
+                    "started": self._started[name],
+                    "oldestWaitSeconds": round(max(waiting), 1) if waiting else 0.0,
+                    "meanWaitSeconds": round(sum(waits) / len(waits), 1) if waits else None,
+                    "maxWaitSeconds": round(max(waits), 1) if waits else None,
+                }
+            return result
+
+    # --- internals ---
+
+    def _rank(self, job: QueuedJob, now: datetime) -> int:
+        rank = CLASSES.index(job.job_class)
+        if self.ageing_seconds > 0:
+            rank -= int(job.wait_seconds(now) // self.ageing_seconds)
+        return max(0, rank)
+
+    def _running_by_class(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for job in self._running.values():
+            counts[job.job_class] = counts.get(job.job_class, 0) + 1
+        return counts
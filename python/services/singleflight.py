@@ -0,0 +1,67 @@
+# Single-flight request coalescing: concurrent identical requests share one computation.
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("image_singleflight")
+logger.setLevel(logging.INFO)
+
+
+def canonical_request_key(prompt: str, seed: Optional[int], steps: int, guidance_scale: float,
+                          width: int, height: int, model: str, scheduler: Optional[str] = None) -> Optional[str]:
+    """
+    Stable hash of everything that determines the output image.
+    Returns None for unseeded requests: those are expected to differ, so they're never coalesced.
+    """
+    if seed is None:
+        return None
+    canonical = json.dumps({
+        "prompt": prompt,
+        "seed": int(seed),
+        "steps": int(steps),
+        "guidance_scale": round(float(guidance_scale), 4),
+        "width": int(width),
+        "height": int(height),
+        "model": model,
+        "scheduler": scheduler,
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    asyncio single-flight: the first caller for a key starts fn as its own task, and every caller
+    (the first included) awaits that task through shield, so cancelling any caller - even the
+    one that started it - leaves the computation running for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Optional[str], fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Returns (result, shared) where shared is True if another caller's computation was reused."""
+        if key is None:
+            return await fn(), False
+
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            logger.info("Coalescing duplicate request %s", key[:12])
+        else:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: str, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved: every caller may have gone away before it failed
+
+    def stats(self) -> dict:
+        return {"inFlight": len(self._in_flight), "coalesced": self.coalesced}
@@ -0,0 +1,152 @@
+# CPU worker layout for multi-process generation: NUMA-aware core sets, torch thread settings, sharding.
+import os
+import glob
+import zlib
+import logging
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger("image_workers")
+logger.setLevel(logging.INFO)
+
+# Set by launcher.py for each worker process
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "1"))
+WORKER_CPUS = os.environ.get("WORKER_CPUS")  # e.g. "0-7,16-23"
+WORKER_INTEROP_THREADS = int(os.environ.get("WORKER_INTEROP_THREADS", "1"))
+# One thread per physical core: intra-op threads on SMT siblings mostly contend for the same units
+WORKER_PHYSICAL_CORES_ONLY = os.environ.get("WORKER_PHYSICAL_CORES_ONLY", "true").lower() not in ("0", "false", "no")
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """Parse a Linux cpulist ("0-3,8,10-11") into CPU ids."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def format_cpulist(cpus: Sequence[int]) -> str:
+    """Inverse of parse_cpulist, with runs collapsed."""
+    cpus = sorted(set(cpus))
+    parts, i = [], 0
+    while i < len(cpus):
+        j = i
+        while j + 1 < len(cpus) and cpus[j + 1] == cpus[j] + 1:
+            j += 1
+        parts.append(str(cpus[i]) if i == j else f"{cpus[i]}-{cpus[j]}")
+        i = j + 1
+    return ",".join(parts)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (respects cgroup/taskset restrictions)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """NUMA node -> available CPUs on it; a single node 0 when the topology isn't exposed."""
+    allowed = set(available_cpus())
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        node = int(path.split("/node")[-1].split("/")[0])
+        cpus = [c for c in parse_cpulist(_read(path) or "") if c in allowed]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def physical_cores(cpus: Sequence[int]) -> List[int]:
+    """First SMT sibling of each core in cpus."""
+    chosen, seen = [], set()
+    for cpu in sorted(cpus):
+        siblings = _read(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+        key = tuple(parse_cpulist(siblings)) if siblings else (cpu,)
+        if key not in seen:
+            seen.add(key)
+            chosen.append(cpu)
+    return chosen
+
+
+def plan_core_sets(workers: int, physical_only: bool = WORKER_PHYSICAL_CORES_ONLY) -> List[Dict]:
+    """
+    Split the host into `workers` disjoint core sets. Workers are spread over NUMA nodes in
+    proportion to their core counts so that no set crosses a node when workers >= nodes.
+    Returns [{"node": node or None, "cpus": [...]}] per worker.
+    """
+    nodes = numa_nodes()
+    if physical_only:
+        nodes = {node: physical_cores(cpus) for node, cpus in nodes.items()}
+    total = sum(len(cpus) for cpus in nodes.values())
+    if workers < 1 or workers > total:
+        raise ValueError(f"Need between 1 and {total} workers for {total} cores")
+
+    if workers < len(nodes):
+        # Fewer workers than nodes: each takes whole nodes
+        node_ids = sorted(nodes)
+        plans = []
+        for index in range(workers):
+            owned = node_ids[index::workers]
+            plans.append({"node": owned[0] if len(owned) == 1 else None,
+                          "cpus": sorted(c for n in owned for c in nodes[n])})
+        return plans
+
+    # Workers per node proportional to core count (largest remainder), at least one each
+    shares = {node: max(1, workers * len(cpus) // total) for node, cpus in nodes.items()}
+    while sum(shares.values()) < workers:
+        node = max(nodes, key=lambda n: len(nodes[n]) / shares[n])
+        shares[node] += 1
+    while sum(shares.values()) > workers:
+        node = max((n for n in nodes if shares[n] > 1), key=lambda n: shares[n])
+        shares[node] -= 1
+
+    plans = []
+    for node, cpus in sorted(nodes.items()):
+        count = shares[node]
+        size, extra = divmod(len(cpus), count)
+        start = 0
+        for i in range(count):
+            end = start + size + (1 if i < extra else 0)
+            plans.append({"node": node, "cpus": cpus[start:end]})
+            start = end
+    return plans
+
+
+def apply_worker_settings(cpus: Optional[Sequence[int]] = None, interop_threads: int = WORKER_INTEROP_THREADS) -> Optional[int]:
+    """
+    Pin this process to its core set (WORKER_CPUS by default) and match torch's intra-op
+    threads to it. Call before the first torch op; returns the thread count, or None if unpinned.
+    """
+    if cpus is None:
+        if not WORKER_CPUS:
+            return None
+        cpus = parse_cpulist(WORKER_CPUS)
+    import torch
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    try:
+        torch.set_num_interop_threads(max(1, interop_threads))
+    except RuntimeError:
+        # Only settable before any inter-op parallel work has started
+        logger.warning("torch inter-op threads already initialized; leaving at %d", torch.get_num_interop_threads())
+    logger.info("Worker %d/%d pinned to CPUs %s (%d intra-op threads)", WORKER_INDEX, WORKER_COUNT, format_cpulist(cpus), len(cpus))
+    return len(cpus)
+
+
+def owns(doc_id: str, index: int = WORKER_INDEX, count: int = WORKER_COUNT) -> bool:
+    """Whether this worker handles doc_id: stable hash sharding so workers never render the same story."""
+    return count <= 1 or zlib.crc32(doc_id.encode("utf-8")) % count == index
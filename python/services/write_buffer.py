@@ -0,0 +1,154 @@
+# Write-behind buffer for Firestore document updates: grouped into batched commits, flushed by size or age.
+import os
+import time
+import random
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("image_write_buffer")
+logger.setLevel(logging.INFO)
+
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "20"))
+WRITE_FLUSH_SECONDS = float(os.environ.get("WRITE_FLUSH_SECONDS", "2"))
+WRITE_MAX_ATTEMPTS = int(os.environ.get("WRITE_MAX_ATTEMPTS", "5"))
+FIRESTORE_BATCH_LIMIT = 500
+
+Callback = Callable[[Optional[Exception]], None]
+
+
+class WriteBehindBuffer:
+    """
+    Buffers doc_ref.update() calls and commits them as WriteBatches once max_batch documents are
+    waiting or the oldest has waited max_delay seconds.
+
+    Updates to the same document are merged in order (later fields win) into one write, so fields
+    passed in a single update() - e.g. a story's image URL and its lease release - always land
+    together, atomically. If a batch commit fails, its documents are retried one by one with
+    backoff so a single bad document can't sink the rest; on_done(error) reports the outcome.
+    """
+
+    def __init__(self, db, max_batch: int = WRITE_BATCH_SIZE, max_delay: float = WRITE_FLUSH_SECONDS,
+                 max_attempts: int = WRITE_MAX_ATTEMPTS):
+        self.db = db
+        self.max_batch = max(1, min(max_batch, FIRESTORE_BATCH_LIMIT))
+        self.max_delay = max_delay
+        self.max_attempts = max(1, max_attempts)
+        # doc path -> (doc_ref, merged fields, callbacks, first enqueued at)
+        self._pending: "OrderedDict[str, Tuple[object, dict, List[Callback], float]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_lock = threading.Lock()  # one commit at a time, so per-document order holds
+        self.stats_counts: Dict[str, int] = {"updates": 0, "writes": 0, "batches": 0, "retries": 0, "failures": 0}
+        self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def update(self, doc_ref, fields: dict, on_done: Optional[Callback] = None) -> None:
+        """Queue doc_ref.update(fields); returns immediately."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write buffer is closed")
+            key = doc_ref.path
+            if key in self._pending:
+                _, merged, callbacks, enqueued = self._pending[key]
+                merged.update(fields)
+            else:
+                merged, callbacks, enqueued = dict(fields), [], time.monotonic()
+                self._pending[key] = (doc_ref, merged, callbacks, enqueued)
+            if on_done is not None:
+                callbacks.append(on_done)
+            self.stats_counts["updates"] += 1
+            # Wake the flusher to start the age timer (first item) or flush now (full batch)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def flush(self) -> None:
+        """Commit everything queued so far (blocking)."""
+        with self._flush_lock:
+            with self._cond:
+                items = list(self._pending.values())
+                self._pending.clear()
+            for start in range(0, len(items), self.max_batch):
+                self._commit(items[start:start + self.max_batch])
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=30)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self.stats_counts, "pending": len(self._pending)}
+
+    # --- internals ---
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(timeout=self._wait_seconds())
+                if self._closed:
+                    return
+            self.flush()
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.max_batch:
+            return True
+        oldest = next(iter(self._pending.values()))[3]
+        return time.monotonic() - oldest >= self.max_delay
+
+    def _wait_seconds(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        oldest = next(iter(self._pending.values()))[3]
+        return max(0.0, self.max_delay - (time.monotonic() - oldest))
+
+    def _commit(self, items) -> None:
+        batch = self.db.batch()
+        for doc_ref, fields, _, _ in items:
+            batch.update(doc_ref, fields)
+        try:
+            batch.commit()
+            self.stats_counts["batches"] += 1
+            self.stats_counts["writes"] += len(items)
+            for _, _, callbacks, _ in items:
+                self._notify(callbacks, None)
+        except Exception as exc:
+            logger.warning("Batch of %d writes failed (%s); retrying per document", len(items), exc)
+            for item in items:
+                self._commit_one(*item)
+
+    def _commit_one(self, doc_ref, fields: dict, callbacks: List[Callback], _enqueued: float) -> None:
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                doc_ref.update(fields)
+                self.stats_counts["writes"] += 1
+                error = None
+                break
+            except Exception as exc:
+                error = exc
+                if attempt < self.max_attempts:
+                    self.stats_counts["retries"] += 1
+                    time.sleep(min(10.0, 0.25 * 2 ** attempt) * random.uniform(0.5, 1.0))
+        if error is not None:
+            self.stats_counts["failures"] += 1
+            logger.error("Giving up on write to %s after %d attempts: %s", doc_ref.path, self.max_attempts, error)
+        self._notify(callbacks, error)
+
+    @staticmethod
+    def _notify(callbacks: List[Callback], error: Optional[Exception]) -> None:
+        for callback in callbacks:
+            try:
+                callback(error)
+            except Exception:
+                logger.exception("Write callback failed")
@@ -0,0 +1,29 @@
+# Tests import the worker's modules the way the worker does (python/ on sys.path, `services.*`).
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def firestore_module(monkeypatch):
+    """google.cloud.firestore, or a stand-in with the names these modules use when the SDK isn't installed."""
+    try:
+        from google.cloud import firestore
+        return firestore
+    except ImportError:
+        pass
+    firestore = types.ModuleType("google.cloud.firestore")
+    firestore.Client = object
+    firestore.SERVER_TIMESTAMP = object()
+    cloud = types.ModuleType("google.cloud")
+    cloud.firestore = firestore
+    google = types.ModuleType("google")
+    google.cloud = cloud
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.cloud", cloud)
+    monkeypatch.setitem(sys.modules, "google.cloud.firestore", firestore)
+    return firestore
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+from services.jobs import JobRegistry
+
+
+async def _collect(registry, job_id):
+    return [event async for event in registry.events(job_id)]
+
+
+def test_updates_from_other_threads_are_applied_on_the_loop():
+    async def scenario():
+        registry = JobRegistry()
+        job = registry.create({"prompt": "p"})
+        listener = asyncio.ensure_future(_collect(registry, job.id))
+        await asyncio.sleep(0)
+        loop_thread = threading.get_ident()
+        applied_on = []
+        original = registry._progress
+
+        def record(*args):
+            applied_on.append(threading.get_ident())
+            original(*args)
+
+        registry._progress = record
+
+        def inference():
+            registry.mark_running(job)
+            for step in range(1, 4):
+                registry.progress(job, step, 3)
+
+        worker = threading.Thread(target=inference)
+        worker.start()
+        await asyncio.to_thread(worker.join)
+        await asyncio.sleep(0)
+        registry.finish(job, {"imageUrl": "/images/x"})
+        events = await listener
+        return job, events, applied_on, loop_thread
+
+    job, events, applied_on, loop_thread = asyncio.run(scenario())
+    assert applied_on == [loop_thread] * 3
+    assert job.status == "done" and job.step == 3
+    kinds = [event.split("\n", 1)[0] for event in events]
+    assert kinds == ["event: status", "event: status", "event: progress", "event: progress",
+                     "event: progress", "event: done"]
+
+
+def test_shutdown_fails_unfinished_jobs_once():
+    async def scenario():
+        registry = JobRegistry()
+        running, done = registry.create({}), registry.create({})
+        registry.finish(done, {})
+        registry.shutdown()
+        registry.finish(running, {})  # too late: the job already failed
+        return running, done
+
+    running, done = asyncio.run(scenario())
+    assert running.status == "failed" and running.error == "Server shutting down"
+    assert done.status == "done"
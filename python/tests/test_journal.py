@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from services.journal import ACCEPTED, FINISHED, RUNNING, WRITTEN, JobJournal
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal" / "worker.sqlite")
+
+
+def test_lifecycle(path, firestore_module):
+    journal = JobJournal(path)
+    journal.accept("a", "interactive")
+    journal.start("a", "worker-1")
+    assert [(job["doc_id"], job["state"]) for job in journal.unfinished()] == [("a", RUNNING)]
+
+    journal.finish("a", "done", {"imageJob.status": "done"})
+    journal.written("a")
+    assert journal.unfinished() == []
+    assert journal.stats() == {WRITTEN: 1}
+    journal.close()
+
+
+# Runs in a child process that dies (os._exit) without closing the journal
+_CRASHING_WORKER = """
+import os, sys, types
+from datetime import datetime, timezone
+sys.path.insert(0, {python_dir!r})
+try:
+    from google.cloud import firestore
+except ImportError:
+    firestore = types.ModuleType("google.cloud.firestore")
+    firestore.SERVER_TIMESTAMP = object()
+    sys.modules["google.cloud.firestore"] = firestore
+    sys.modules["google.cloud"] = types.ModuleType("google.cloud")
+    sys.modules["google.cloud"].firestore = firestore
+from services.journal import JobJournal
+
+journal = JobJournal({path!r})
+journal.accept("accepted", "backfill")
+journal.accept("running", "interactive")
+journal.start("running", "worker-1")
+journal.accept("finished", "retry")
+journal.start("finished", "worker-1")
+journal.finish("finished", "done", {{
+    "imageJob.status": "done",
+    "imageJob.finishedAt": firestore.SERVER_TIMESTAMP,
+    "imageJob.retryAt": datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+}})
+journal.accept("written", "interactive")
+journal.start("written", "worker-1")
+journal.finish("written", "done", {{"imageJob.status": "done"}})
+journal.written("written")
+journal.set_meta("cursor", "abc")
+os._exit(1)
+"""
+
+
+def test_replay_after_a_crash(path, firestore_module):
+    python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    crashed = subprocess.run([sys.executable, "-c", _CRASHING_WORKER.format(python_dir=python_dir, path=path)])
+    assert crashed.returncode == 1
+
+    restarted = JobJournal(path)
+    jobs = {job["doc_id"]: job for job in restarted.unfinished()}
+    assert {doc_id: job["state"] for doc_id, job in jobs.items()} == {
+        "accepted": ACCEPTED, "running": RUNNING, "finished": FINISHED,
+    }
+    assert jobs["running"]["worker_id"] == "worker-1"
+    assert jobs["finished"]["fields"] == {
+        "imageJob.status": "done",
+        "imageJob.finishedAt": firestore_module.SERVER_TIMESTAMP,
+        "imageJob.retryAt": datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    }
+    assert restarted.get_meta("cursor") == "abc"
+    restarted.close()
+
+
+def test_forget_drops_only_unfinished_jobs(path, firestore_module):
+    journal = JobJournal(path)
+    journal.accept("lost", "interactive")
+    journal.accept("done", "interactive")
+    journal.start("done", "worker-1")
+    journal.finish("done", "done", {})
+    journal.forget("lost")
+    journal.forget("done")
+    assert [job["doc_id"] for job in journal.unfinished()] == ["done"]
+    journal.close()
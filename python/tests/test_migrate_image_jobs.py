@@ -0,0 +1,75 @@
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def migrate(monkeypatch, firestore_module):
+    """migrate_image_jobs.migrate, importable without the Firestore SDK."""
+    monkeypatch.delitem(sys.modules, "migrate_image_jobs", raising=False)
+    monkeypatch.delitem(sys.modules, "services.firestore_client", raising=False)
+    import migrate_image_jobs
+    return migrate_image_jobs.migrate
+
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.reference = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeQuery:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, n):
+        return FakeQuery(self._docs[:n])
+
+    def start_after(self, last):
+        return FakeQuery(self._docs[self._docs.index(last) + 1:])
+
+    def stream(self):
+        return iter(self._docs)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+
+    def update(self, ref, fields):
+        self._db.updates[ref] = fields
+
+    def commit(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self, docs):
+        self._docs = docs
+        self.updates = {}
+
+    def collection(self, name):
+        return FakeQuery(self._docs)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def test_null_image_job_is_migrated(migrate):
+    db = FakeDb([
+        FakeDoc("null-job", {"imageJob": None, "aiInfographicConcept": "concept"}),
+        FakeDoc("queued", {"imageJob": {"status": "pending"}, "aiInfographicConcept": "concept"}),
+        FakeDoc("legacy-done", {"aiGeneratedImageUrl": "https://example.com/a.png"}),
+    ])
+    counts = migrate(db, dry_run=False)
+
+    assert counts == {"pending": 1, "already migrated": 1, "done": 1}
+    assert db.updates["null-job"]["imageJob"]["status"] == "pending"
+    assert "queued" not in db.updates
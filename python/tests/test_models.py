@@ -0,0 +1,14 @@
+import pytest
+
+from services.models import IMAGE_MODELS, MODEL_ID, resolve_model
+
+
+def test_default_model_is_always_allowed():
+    assert resolve_model(None) == MODEL_ID
+    assert resolve_model(MODEL_ID) == MODEL_ID
+
+
+def test_models_outside_the_allow_list_are_rejected():
+    assert resolve_model(IMAGE_MODELS[0]) == IMAGE_MODELS[0]
+    with pytest.raises(ValueError):
+        resolve_model("someone/unknown-model")
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+import torch  # noqa: E402
+
+from services import pipeline  # noqa: E402
+
+
+class FakePipe:
+    pass
+
+
+def test_cold_load_doesnt_block_other_models(monkeypatch):
+    loading_b = threading.Event()
+    release_b = threading.Event()
+
+    def fake_load(model_id, device, dtype, token, shared):
+        if model_id == "b":
+            loading_b.set()
+            assert release_b.wait(5)
+        return FakePipe()
+
+    monkeypatch.setattr(pipeline, "_load", fake_load)
+    monkeypatch.setattr(pipeline, "_component_fingerprint", lambda *args: None)
+    pool = pipeline.PipelinePool(max_models=3, max_mb=float("inf"))
+    a = pool.get("a", "cpu", torch.float32, None)
+
+    results = []
+    loaders = [threading.Thread(target=lambda: results.append(pool.get("b", "cpu", torch.float32, None)))
+               for _ in range(2)]
+    for thread in loaders:
+        thread.start()
+    assert loading_b.wait(5)
+    # b is still loading: a cache hit on a must not wait for it
+    assert pool.get("a", "cpu", torch.float32, None) is a
+    release_b.set()
+    for thread in loaders:
+        thread.join(5)
+    assert len(results) == 2 and results[0] is results[1]
+    assert pool.loads == 2
+
+
+def test_failed_load_reaches_waiters_and_can_be_retried(monkeypatch):
+    attempts = []
+
+    def fake_load(model_id, device, dtype, token, shared):
+        attempts.append(model_id)
+        if len(attempts) == 1:
+            raise MemoryError("no room")
+        return FakePipe()
+
+    monkeypatch.setattr(pipeline, "_load", fake_load)
+    monkeypatch.setattr(pipeline, "_component_fingerprint", lambda *args: None)
+    pool = pipeline.PipelinePool(max_models=2, max_mb=float("inf"))
+    with pytest.raises(MemoryError):
+        pool.get("a", "cpu", torch.float32, None)
+    assert isinstance(pool.get("a", "cpu", torch.float32, None), FakePipe)
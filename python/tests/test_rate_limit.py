@@ -0,0 +1,30 @@
+import pytest
+
+from services.rate_limit import RateLimited, RateLimiter, parse_limits
+
+
+def test_parse_limits():
+    assert parse_limits("hf_api=30/m:5, openrouter@gpt=2/s") == {"hf_api": (0.5, 5.0), "openrouter@gpt": (2.0, 2.0)}
+    with pytest.raises(ValueError):
+        parse_limits("hf_api=30/day")
+
+
+def test_unlimited_keys_never_wait():
+    limiter = RateLimiter(spec="", backend="local")
+    assert limiter.acquire("hf_api", "model", timeout=0) == 0.0
+
+
+def test_rejected_model_token_refunds_the_provider_token():
+    limiter = RateLimiter(spec="hf_api=1/h:2,hf_api@a=1/h:1", backend="local")
+    limiter.acquire("hf_api", "a", timeout=0)
+    with pytest.raises(RateLimited) as rejected:
+        limiter.acquire("hf_api", "a", timeout=0)  # provider has a token left, model a doesn't
+    assert rejected.value.key == "hf_api@a"
+
+    # The provider token taken before the rejection is back: another model can still use it
+    limiter.acquire("hf_api", "b", timeout=0)
+    with pytest.raises(RateLimited):
+        limiter.acquire("hf_api", "b", timeout=0)
+    stats = limiter.stats()
+    assert stats["hf_api"]["refunded"] == 1
+    assert stats["hf_api@a"]["rejected"] == 1
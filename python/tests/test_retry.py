@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from services import retry
+from services.deadline import DeadlineExceeded, JobCancelled
+from services.job_queue import FAILED, RETRY
+from services.memory import MemoryBudgetExceeded
+from services.rate_limit import RateLimited
+from services.retry import PERMANENT, TRANSIENT, attempt_failure_fields, backoff_seconds, classify_error
+
+
+class HttpError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = type("Response", (), {"status_code": status_code})()
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (DeadlineExceeded("deadline"), TRANSIENT),
+    (JobCancelled("user"), PERMANENT),
+    (RateLimited("hf_api", 3.0), TRANSIENT),
+    (HttpError(503), TRANSIENT),
+    (HttpError(429), TRANSIENT),
+    (HttpError(400), PERMANENT),
+    (ValueError("bad prompt"), PERMANENT),
+    (MemoryBudgetExceeded("too big"), PERMANENT),
+    (ConnectionError("reset"), TRANSIENT),
+    (TimeoutError(), TRANSIENT),
+])
+def test_classify_error(exc, kind):
+    assert classify_error(exc) == kind
+
+
+def test_classify_error_walks_the_cause_chain():
+    try:
+        try:
+            raise HttpError(404)
+        except HttpError as inner:
+            raise RuntimeError("Image generation failed") from inner
+    except RuntimeError as wrapped:
+        assert classify_error(wrapped) == PERMANENT
+
+    try:
+        try:
+            raise ConnectionError("reset")
+        except ConnectionError:
+            raise RuntimeError("upload failed")  # implicit __context__
+    except RuntimeError as wrapped:
+        assert classify_error(wrapped) == TRANSIENT
+
+
+def test_unknown_errors_are_transient():
+    class Strange(Exception):
+        pass
+
+    assert classify_error(Strange()) == TRANSIENT
+
+
+def test_backoff_doubles_and_is_capped(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    assert [backoff_seconds(n, base=30, cap=100) for n in (1, 2, 3, 4)] == [30, 60, 100, 100]
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: low)
+    assert backoff_seconds(10, base=30, cap=100) == 50  # jittered down by at most half
+
+
+def test_transient_failure_goes_back_to_the_queue():
+    before = datetime.now(timezone.utc)
+    fields = attempt_failure_fields({"attemptCount": 1}, ConnectionError("reset"), "worker-1")
+    assert fields["imageJob.status"] == RETRY
+    assert fields["imageJob.retryAt"] > before
+    assert fields["imageJob.worker"] is None
+    assert fields["imageJob.lastError"]["kind"] == TRANSIENT
+    assert fields["imageJob.attempts"] == [fields["imageJob.lastError"]]
+
+
+def test_last_attempt_fails_for_good():
+    job = {"attemptCount": retry.RETRY_MAX_ATTEMPTS}
+    fields = attempt_failure_fields(job, ConnectionError("reset"), "worker-1")
+    assert fields["imageJob.status"] == FAILED
+    assert "imageJob.retryAt" not in fields
+    assert fields["imageJob.lastError"]["attempt"] == retry.RETRY_MAX_ATTEMPTS
+
+
+def test_permanent_failure_and_cancel_reason():
+    fields = attempt_failure_fields({"attemptCount": 1}, JobCancelled("superseded"), "worker-1")
+    assert fields["imageJob.status"] == FAILED
+    assert fields["imageJob.cancelReason"] == "superseded"
+
+
+def test_attempt_history_is_bounded():
+    job = {"attemptCount": 1, "attempts": [{"attempt": n} for n in range(retry.ATTEMPT_HISTORY_LIMIT + 5)]}
+    fields = attempt_failure_fields(job, ValueError("bad"), "worker-1")
+    assert len(fields["imageJob.attempts"]) == retry.ATTEMPT_HISTORY_LIMIT
+    assert fields["imageJob.attempts"][-1] is fields["imageJob.lastError"]
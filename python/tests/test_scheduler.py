@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta, timezone
+
+from services.scheduler import BACKFILL, INTERACTIVE, RERENDER, JobScheduler, QueuedJob
+
+AGEING = 600
+
+
+def queued(doc_id, job_class, waited_seconds):
+    return QueuedJob(doc_id, job_class, datetime.now(timezone.utc) - timedelta(seconds=waited_seconds))
+
+
+def test_fresh_rerender_waits_for_other_work():
+    scheduler = JobScheduler(ageing_seconds=AGEING, concurrency=1, caps={})
+    scheduler.refresh([queued("rerender", RERENDER, 10), queued("new", INTERACTIVE, 0)])
+    assert scheduler.next().doc_id == "new"
+
+
+def test_aged_rerender_is_not_starved_by_new_submissions():
+    scheduler = JobScheduler(ageing_seconds=AGEING, concurrency=1, caps={})
+    started = []
+    for cycle in range(5):
+        # A steady stream: a fresh interactive story arrives every cycle
+        scheduler.refresh([queued("rerender", RERENDER, cycle * AGEING), queued(f"new-{cycle}", INTERACTIVE, 0)])
+        job = scheduler.next()
+        started.append(job.doc_id)
+        scheduler.finish(job)
+        if job.doc_id == "rerender":
+            break
+    assert started[-1] == "rerender"
+    assert len(started) <= 4
+
+
+def test_aged_rerender_competes_with_lower_classes():
+    scheduler = JobScheduler(ageing_seconds=AGEING, concurrency=1, caps={})
+    scheduler.refresh([queued("rerender", RERENDER, AGEING + 1), queued("backfill", BACKFILL, 0)])
+    assert scheduler.next().doc_id == "rerender"
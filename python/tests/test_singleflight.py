@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+
+def test_followers_share_the_leaders_result():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def render():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "image"
+
+        callers = [asyncio.ensure_future(flight.do("key", render)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers)
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [("image", False), ("image", True), ("image", True)]
+    assert stats == {"inFlight": 0, "coalesced": 2}
+
+
+def test_cancelling_the_leader_leaves_followers_running():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def render():
+            await release.wait()
+            return "image"
+
+        leader = asyncio.ensure_future(flight.do("key", render))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", render))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, flight.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == ("image", True)
+    assert stats["inFlight"] == 0
+
+
+def test_failure_reaches_every_caller_and_clears_the_key():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def render():
+            await asyncio.sleep(0)
+            raise RuntimeError("boom")
+
+        results = await asyncio.gather(flight.do("key", render), flight.do("key", render),
+                                       return_exceptions=True)
+        return results, flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert stats["inFlight"] == 0
+
+
+def test_unseeded_requests_are_never_coalesced():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def render():
+            return object()
+
+        first, second = await asyncio.gather(flight.do(None, render), flight.do(None, render))
+        return first, second
+
+    (first, shared_first), (second, shared_second) = asyncio.run(scenario())
+    assert first is not second and not shared_first and not shared_second
@@ -41,7 +41,8 @@ export default function SystemicShiftsDropbox() {
     // 1. Has submittedAt but no analysisTimestamp (AI analysis not started)
     // 2. Has analysisTimestamp but image is still pending (image generation in progress)
     const hasNoAnalysis = sub.submittedAt && !sub.analysisTimestamp;
-    const imagePending = sub.analysisTimestamp && 
+    const imageFailed = sub.imageJob && sub.imageJob.status === 'failed';
+    const imagePending = sub.analysisTimestamp && !imageFailed && 
                          (sub.aiGeneratedImageUrl === "Pending local generation" || 
                           !sub.aiGeneratedImageUrl || 
                           (sub.aiGeneratedImageUrl && !sub.aiGeneratedImageUrl.startsWith('http')));
@@ -616,6 +617,25 @@ export default function SystemicShiftsDropbox() {
                                 }}
                               />
                             </div>
+                          ) : sub.aiPreviewImageUrl ? (
+                            <div className="relative w-full h-60 bg-gray-100 rounded-lg overflow-hidden">
+                              <Image
+                                src={sub.aiPreviewImageUrl}
+                                alt="AI Infographic Preview"
+                                width={250}
+                                height={250}
+                                className="rounded-lg shadow-md w-full h-full object-contain opacity-80"
+                              />
+                              <span className="absolute bottom-2 right-2 px-2 py-1 text-xs rounded bg-yellow-100 text-yellow-700">
+                                Preview {sub.aiPreviewStep}/{sub.aiPreviewTotalSteps}
+                              </span>
+                            </div>
+                          ) : sub.imageJob && sub.imageJob.lastError && ['failed', 'retry'].includes(sub.imageJob.status) ? (
+                            <p className={`p-3 text-xs rounded whitespace-pre-wrap ${sub.imageJob.status === 'failed' ? 'bg-red-100 text-red-700' : 'bg-yellow-100 text-yellow-700'}`}>
+                              {sub.imageJob.status === 'failed'
+                                ? `Image generation failed after ${sub.imageJob.lastError.attempt} attempt(s): ${sub.imageJob.lastError.error}`
+                                : `Attempt ${sub.imageJob.lastError.attempt} failed (${sub.imageJob.lastError.error}); retrying shortly.`}
+                            </p>
                           ) : (
                             <p className={`p-3 text-xs rounded whitespace-pre-wrap ${sub.aiGeneratedImageUrl && sub.aiGeneratedImageUrl.includes('failed') ? 'bg-red-100 text-red-700' : 'bg-yellow-100 text-yellow-700'}`}>
                               {sub.aiGeneratedImageUrl || 'Image generation pending.'}